@@ -0,0 +1,4 @@
+''' Benchmark suite for airspeed velocity (see asv.conf.json in the
+repository root). Workloads are generated synthetically and seeded (see
+workloads), so results are comparable across commits and machines need no
+fixtures or network access. '''
@@ -0,0 +1,31 @@
+''' Cache planning over growing numbers of cached keys. '''
+
+import pandas as pd
+
+from split_query.cache import MinimalCache
+from split_query.core import And, Attribute, Ge, Lt
+
+from .workloads import partition_keys
+
+
+class Planning(object):
+
+    params = [10, 100, 10000]
+    param_names = ['keys']
+    timeout = 600
+
+    def setup(self, keys):
+        # Planning does not read data, so entries can share an empty frame.
+        empty = pd.DataFrame(dict(x=[]))
+        self.cache = MinimalCache(None, {key: empty for key in partition_keys(keys)})
+        x = Attribute('x')
+        # Covers the middle 6 keys: 4 whole keys and half of one either side.
+        middle = keys * 5
+        self.query = And([Ge(x, middle - 25), Lt(x, middle + 25)])
+
+    def time_plan(self, keys):
+        self.cache._plan_cache(self.query)
+
+    def time_plan_repeat(self, keys):
+        # Query exactly matching a cached key.
+        self.cache._plan_cache(partition_keys(1)[0])
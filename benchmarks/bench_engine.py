@@ -0,0 +1,35 @@
+''' Pandas engine filtering on large frames. '''
+
+import pandas as pd
+
+from split_query.engine import query_df
+
+from .workloads import frame, range_query, tag_query
+
+
+class QueryDF(object):
+
+    params = [10 ** 5, 10 ** 6, 10 ** 7]
+    param_names = ['rows']
+    timeout = 300
+
+    def setup(self, rows):
+        self.df = frame(rows)
+        self.categorical = self.df.assign(tag=pd.Categorical(self.df.tag))
+        self.range = range_query(rows)
+        self.tags = tag_query()
+
+    def time_range(self, rows):
+        query_df(self.df, self.range)
+
+    def time_range_sorted(self, rows):
+        query_df(self.df, self.range, sort_key='x')
+
+    def time_tags(self, rows):
+        query_df(self.df, self.tags)
+
+    def time_tags_categorical(self, rows):
+        query_df(self.categorical, self.tags)
+
+    def time_projection(self, rows):
+        query_df(self.df, self.range, columns=['y'])
@@ -0,0 +1,34 @@
+''' Simplification at growing clause and attribute counts. Intersections and
+remainders are taken with a single block, as the cache planner does with a
+cached key. '''
+
+from split_query.core import And, Not, to_dnf_simplified
+from split_query.core.domain import simplify_flat_or
+
+from .workloads import random_expression
+
+
+class Simplify(object):
+
+    params = ([1, 4, 16, 64], [1, 2, 4])
+    param_names = ['clauses', 'attributes']
+
+    def setup(self, clauses, attributes):
+        self.expression = random_expression(clauses, attributes, seed=0)
+        self.other = random_expression(1, attributes, seed=1)
+
+    def time_dnf(self, clauses, attributes):
+        to_dnf_simplified(self.expression)
+
+    def time_flat_or(self, clauses, attributes):
+        simplify_flat_or(self.expression)
+
+    def time_intersection(self, clauses, attributes):
+        to_dnf_simplified(And([self.expression, self.other]))
+
+    def time_remainder(self, clauses, attributes):
+        to_dnf_simplified(And([self.expression, Not(self.other)]))
+
+    def track_dnf_clauses(self, clauses, attributes):
+        result = to_dnf_simplified(And([self.expression, Not(self.other)]))
+        return len(getattr(result, 'clauses', [result]))
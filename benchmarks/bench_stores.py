@@ -0,0 +1,63 @@
+''' Persistent store read and write. '''
+
+import shutil
+import tempfile
+
+from split_query.cache import PersistentDict
+from split_query.core import Attribute, Le
+
+from .workloads import frame
+
+KEY = Le(Attribute('x'), 0)
+
+
+class PersistentStore(object):
+
+    params = ([10 ** 4, 10 ** 5, 10 ** 6], ['fixed', 'table'])
+    param_names = ['rows', 'data_format']
+    timeout = 300
+
+    def setup(self, rows, data_format):
+        self.location = tempfile.mkdtemp()
+        self.data = frame(rows)
+        self.store = PersistentDict(self.location, data_format=data_format)
+        self.store[KEY] = self.data
+        self.categorical = PersistentDict(
+            tempfile.mkdtemp(dir=self.location), data_format=data_format,
+            categorical=['tag'])
+        self.categorical[KEY] = self.data
+
+    def teardown(self, rows, data_format):
+        shutil.rmtree(self.location, ignore_errors=True)
+
+    def time_read(self, rows, data_format):
+        self.store[KEY]
+
+    def time_read_columns(self, rows, data_format):
+        self.store.read(KEY, ['y'])
+
+    def time_read_categorical(self, rows, data_format):
+        self.categorical[KEY]
+
+
+class PersistentWrite(object):
+    ''' Writes to a new store for each sample (number = 1), so stored
+    entries don't accumulate across repeats. '''
+
+    params = ([10 ** 4, 10 ** 5, 10 ** 6], ['fixed', 'table'])
+    param_names = ['rows', 'data_format']
+    number = 1
+    repeat = 10
+    warmup_time = 0
+    timeout = 300
+
+    def setup(self, rows, data_format):
+        self.location = tempfile.mkdtemp()
+        self.data = frame(rows)
+        self.store = PersistentDict(self.location, data_format=data_format)
+
+    def teardown(self, rows, data_format):
+        shutil.rmtree(self.location, ignore_errors=True)
+
+    def time_write(self, rows, data_format):
+        self.store[KEY] = self.data
@@ -0,0 +1,57 @@
+''' Deterministic synthetic workloads shared by the benchmarks. '''
+
+import random
+
+import numpy as np
+import pandas as pd
+
+from split_query.core import And, Attribute, Ge, In, Le, Lt, Or
+
+TAGS = ['tag{:03d}'.format(i) for i in range(200)]
+
+
+def attributes(count):
+    return [Attribute('x{}'.format(i)) for i in range(count)]
+
+
+def random_block(rng, attrs):
+    ''' Conjunction of a random range on each attribute. '''
+    clauses = []
+    for attr in attrs:
+        lower = rng.randint(0, 900)
+        clauses.append(Ge(attr, lower))
+        clauses.append(Lt(attr, lower + rng.randint(10, 100)))
+    return And(clauses)
+
+
+def random_expression(clauses, n_attributes, seed=0):
+    ''' Disjunction of :clauses random blocks over :n_attributes. '''
+    rng = random.Random(seed)
+    attrs = attributes(n_attributes)
+    return Or([random_block(rng, attrs) for _ in range(clauses)])
+
+
+def partition_keys(count, width=10):
+    ''' Disjoint interval cache keys covering [0, count * width). '''
+    x = Attribute('x')
+    return [And([Ge(x, i * width), Lt(x, (i + 1) * width)]) for i in range(count)]
+
+
+def frame(rows, seed=0):
+    ''' Sorted numeric key x, random values y, and tag strings. '''
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame(dict(
+        x=np.arange(rows, dtype=np.int64),
+        y=rng.normal(size=rows),
+        tag=np.array(TAGS, dtype=object)[rng.randint(0, len(TAGS), size=rows)]))
+
+
+def range_query(rows, fraction=0.01):
+    ''' Narrow window on x in the middle of a frame of :rows. '''
+    x = Attribute('x')
+    start = rows // 2
+    return And([Ge(x, start), Le(x, start + int(rows * fraction))])
+
+
+def tag_query(count=20):
+    return In(Attribute('tag'), TAGS[:count])
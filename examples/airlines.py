@@ -102,7 +102,7 @@ def expr_to_years(expression):
 
 
 @dataset(name='How Late Are My Airlines', attributes=COLUMNS)
-@cache_persistent('airline-data')
+@cache_persistent('airline-data', categorical=['UniqueCarrier', 'Origin', 'Dest'])
 class AirlineData(object):
     ''' Airlines!! '''
 
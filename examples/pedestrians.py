@@ -6,7 +6,16 @@ import requests
 import pandas as pd
 from dateutil.parser import parse as parse_dt
 
+from split_query.core import Categorical
 from split_query.decorators import dataset, cache_persistent, remote_parameters, range_parameter, tag_parameter
+from split_query.prefetch import SlidingWindowPrefetch
+from split_query.transport import Transport
+
+# Shared keep-alive connections; up to 4 concurrent requests, each retried
+# on connection errors, timeouts and transient (429/5xx) responses.
+TRANSPORT = Transport(
+    max_workers=4, retries=3, timeout=60,
+    retry_on=(requests.ConnectionError, requests.Timeout, requests.HTTPError))
 
 
 MAP_ID_NAME = {
@@ -68,7 +77,7 @@ def soda_query(domain, endpoint, **params):
     ''' Formatting of domain, endpoint and parameters. '''
     url = 'https://{0}/resource/{1}.json'.format(domain, endpoint)
     params = {'$' + key: value for key, value in params.items()}
-    response = requests.get(url=url, params=params)
+    response = TRANSPORT.get(url, params=params)
     data = response.json()
     if response.status_code == 200:
         return data
@@ -83,6 +92,14 @@ def soda_query(domain, endpoint, **params):
             raise SoQLError('SoQL unknown error: {}'.format(data))
 
 
+def year_start(dt):
+    return datetime(dt.year, 1, 1, 0, 0, 0)
+
+
+def next_year(dt):
+    return datetime(dt.year + 1, 1, 1, 0, 0, 0)
+
+
 def parse_remote(entry):
     return {
         'datetime': parse_dt(entry['daet_time']),
@@ -103,14 +120,17 @@ def paged_get(domain, endpoint, where, page=5000):
 
 @dataset(
     name='Melbourne Pedestrian Counters',
-    attributes=['datetime', 'hourly_count', 'sensor'])
-@cache_persistent('melb_pedestrians')
+    attributes=['datetime', 'hourly_count', 'sensor'],
+    types={'sensor': Categorical(MAP_NAME_ID)})
+@cache_persistent(
+    'melb_pedestrians', sort_key='datetime', categorical=['sensor'],
+    prefetch=lambda: SlidingWindowPrefetch('datetime', round_down=year_start, offset=next_year))
 @remote_parameters(
     range_parameter(
         'datetime', key_lower='from_dt', key_upper='to_dt',
-        round_down=lambda dt: datetime(dt.year, 1, 1, 0, 0, 0),
-        offset=lambda dt: datetime(dt.year + 1, 1, 1, 0, 0, 0)),
-    tag_parameter('sensor', single=True))
+        round_down=year_start, offset=next_year),
+    tag_parameter('sensor', single=True, domain=MAP_NAME_ID),
+    transport=TRANSPORT)
 class PedestrianDataset(object):
     ''' This docstring will be displayed in the dataset object repr. '''
 
@@ -138,4 +158,4 @@ if __name__ == '__main__':
     filtered = pedestrians[
         pedestrians.datetime.between(datetime(2013, 2, 3), datetime(2017, 10, 3)) &
         pedestrians.sensor.isin(['Town Hall (West)', 'Southbank'])]
-    print(filtered.get().groupby('sensor').datetime.agg(['min', 'max', 'count']))
+    print(filtered.agg({'datetime': ['min', 'max', 'count']}, by='sensor'))
@@ -15,6 +15,7 @@ AUTHOR = 'Simon Bowly'
 REQUIRED = [
     'appdirs',
     'future',
+    'futures; python_version < "3"',
     'iso8601',
     'pandas',
     'pytz',
@@ -43,6 +44,9 @@ setup(
     url=URL,
     packages=['split_query', 'split_query.core'],
     install_requires=REQUIRED,
+    entry_points={
+        'console_scripts': ['split-query-warm=split_query.warm:main'],
+    },
     include_package_data=True,
     license='MIT',
     classifiers=[
@@ -1,24 +1,52 @@
 
 from builtins import super
 from contextlib import closing
+from queue import Queue
+import atexit
 import collections
+import functools
 import json
 import logging
 import os
 import shelve
+import threading
 import uuid
+import weakref
 
+from future.utils import raise_from
 import pandas as pd
 
 from .core import And, Or, Not, to_dnf_simplified, default, object_hook
-from .engine import query_df
+from .engine import (
+    combine_aggregates, concat_results, is_categorical, may_match, normalise_aggregates, partial_aggregate,
+    partition_statistics, query_df, required_columns)
+from .estimate import estimate_count
+from . import instrument
 
 
-def simplify(expression):
+class CacheFillError(Exception):
+    ''' Raised when a remote fails (or returns incomplete data) while the
+    cache is being filled. Entries received before the failure are kept in
+    the cache; :missing is the part of the query still to be fetched, and
+    :fetched lists the entries received. Running the query again fetches
+    only the missing part. '''
+
+    def __init__(self, missing, fetched, cause=None):
+        super().__init__('Cache fill incomplete ({} entries fetched), missing: {}{}'.format(
+            len(fetched), repr(missing), '' if cause is None else ' ({!r})'.format(cause)))
+        self.missing = missing
+        self.fetched = fetched
+        self.cause = cause
+
+
+def simplify(expression, types=None):
     ''' Speeds up cache return for repeated calls. '''
-    result = to_dnf_simplified(expression)
-    if type(result) is Or and len(result.clauses) == 1:
-        return result.clauses[0]
+    with instrument.span('simplify'):
+        result = to_dnf_simplified(expression, types=types)
+    if type(result) is Or:
+        instrument.count('dnf_clauses', len(result.clauses))
+        if len(result.clauses) == 1:
+            return result.clauses[0]
     return result
 
 
@@ -26,78 +54,724 @@ class MinimalCache(object):
     ''' Cache implementation that uses cached data as much as possible
     (minimal download policy). Uses a simple iterative algorithm, subtracting
     each cached dataset in sequence from the required data. The :cache object
-    must implement the dictionary interface (getitem/setitem/keys). '''
+    must implement the dictionary interface (getitem/setitem/keys). Optional
+    :types (attribute -> dtype) are used when simplifying expressions. If the
+    cache keeps statistics of its entries (a statistics method, see
+    engine.partition_statistics), entries which cannot contain matching
+    records are skipped without being read, and counts of complete entries
+    are taken from the statistics. If :sort_key names a column, new entries
+    are sorted on it before they are written, so filters on that column can
+    use a binary search (see engine.query_df). If :result_bytes is given,
+    assembled results of get are kept in a ResultCache of that size. An
+    optional :prefetch policy (see prefetch.SlidingWindowPrefetch) observes
+    each completed query and may fill the cache ahead of the next. Aggregates
+    of complete entries, and count estimates of partial entries, are kept for
+    the max_aggregates most recently used (entry, aggregate or filter). '''
+
+    max_aggregates = 1024
 
-    def __init__(self, remote, cache):
+    def __init__(self, remote, cache, types=None, sort_key=None, result_bytes=None,
+                 prefetch=None):
         self.remote = remote
         self.cache = cache
+        self.types = types
+        self.sort_key = sort_key
+        self.results = None if result_bytes is None else ResultCache(result_bytes)
+        self.prefetch = prefetch
+        self.flights = SingleFlight()
         # Tracks most recent execution path.
         self.tracking = []
+        # Aggregates of complete cache entries, by (entry, aggregate spec),
+        # and estimates by (entry, ('estimate', filter)), least recently
+        # used first.
+        self.aggregates = collections.OrderedDict()
+        self.aggregates_lock = threading.Lock()
 
-    def get(self, expression):
+    def get(self, expression, columns=None):
         ''' Sequentially eliminates parts of the input query with overlapping
-        data from the cache. Queries the remote for any missing entries. '''
-        plan = []
+        data from the cache. Queries the remote for any missing entries.
+        Optional :columns projects the result; cache entries are read with
+        only the needed columns if the cache supports it (a read method), but
+        the remote is always asked for complete records, since the cache
+        stores whole partitions. With a result cache, a repeated query (equal
+        after simplification, with the same columns) returns a view of the
+        previous result without planning, and a narrower query (e.g. a drill
+        down adding a filter) is answered by filtering a recent result. '''
+        if self.results is not None:
+            key = (simplify(expression, self.types), None if columns is None else tuple(columns))
+            result = self.results.get(key)
+            if result is not None:
+                self.tracking = [('result', expression, key[0])]
+                instrument.count('result_hits')
+                return result
+            derived = self.results.derive(key[0], columns, self.types)
+            if derived is not None:
+                source, result = derived
+                self.tracking = [('subset', expression, source)]
+                instrument.count('result_subset_hits')
+                self.results.put(key, result)
+                return result
+        chunks = list(self.iter_get(expression, columns=columns))
+        if len(chunks) == 0:
+            # Nothing to read (e.g. an empty expression).
+            result = pd.DataFrame(columns=columns or [])
+        else:
+            with instrument.span('concat'):
+                result = concat_results(chunks)
+        if self.results is not None:
+            self.results.put(key, result)
+        return result
+
+    def iter_get(self, expression, columns=None):
+        ''' Generator version of get: yields filtered chunks of the result in
+        plan order, as soon as each cached or remote piece is available.
+        Only one chunk is held at a time, so a long remote iterator is
+        written to the cache and passed on incrementally. '''
+        for _, _, load in self._iter_plan(expression, columns):
+            yield load()
+
+    def agg(self, expression, spec, by=None):
+        ''' Aggregate the result of :expression without assembling it.
+        :spec maps columns to aggregate function names (count, sum, min, max,
+        mean) and :by gives optional group columns, as in pandas
+        df.groupby(by).agg(spec). Partial aggregates are computed per cache
+        entry and combined; aggregates of entries which are entirely within
+        the query are kept, so repeat calls do not read them again. '''
+        spec = normalise_aggregates(spec)
+        groups = [] if by is None else ([by] if isinstance(by, str) else list(by))
+        columns = groups + sorted(set(column for column, _ in spec).difference(groups))
+        key = None if by is None else tuple(groups)
+        partials = [
+            self._partial(partition, filter_query, load, (spec, key), lambda data: (
+                partial_aggregate(data, spec, by)))
+            for partition, filter_query, load in self._iter_plan(expression, columns)]
+        if len(partials) == 0:
+            # Nothing to read (e.g. an empty expression).
+            partials = [partial_aggregate(pd.DataFrame(columns=columns), spec, by)]
+        return combine_aggregates(partials, spec, by)
+
+    def count(self, expression):
+        ''' Number of records matching :expression, counted per cache entry
+        (counts of entries entirely within the query are kept). '''
+        return sum(
+            self._partial(partition, filter_query, load, 'count', len)
+            for partition, filter_query, load in self._iter_plan(expression, None))
+
+    def known_count(self, expression):
+        ''' Number of records matching :expression if it can be answered from
+        cache statistics alone (no remote query or data reads), else None. '''
+        plan, remainder, _ = self._plan_cache(expression)
+        if remainder is not False:
+            return None
+        total = 0
+        for partition, filter_query in plan:
+            statistics = self._statistics(partition)
+            if statistics is None:
+                return None
+            if not self._covers(partition, filter_query):
+                if may_match(statistics, filter_query):
+                    return None
+            else:
+                total += statistics['rows']
+        return total
+
+    def estimate_count(self, expression):
+        ''' Estimated number of records matching :expression, from the
+        sketches in cache statistics (see estimate). None if part of the
+        query is not cached, or an entry has no statistics. No data is read
+        and the remote is not queried. '''
+        plan, remainder, _ = self._plan_cache(expression)
+        if remainder is not False:
+            return None
+        total = 0.0
+        for partition, filter_query in plan:
+            statistics = self._statistics(partition)
+            if statistics is None:
+                return None
+            if self._covers(partition, filter_query):
+                total += statistics['rows']
+            elif may_match(statistics, filter_query):
+                # Kept, as the estimate is repeated for each display of a dataset.
+                total += self._memoised(
+                    (partition, ('estimate', filter_query)),
+                    lambda: estimate_count(statistics, filter_query, types=self.types))
+        return int(round(total))
+
+    def fill(self, expression):
+        ''' Fetch any part of :expression which is not cached, without
+        reading cached data. Returns the number of new cache entries. '''
         tracking = []
-        for cached_query in self.cache.keys():
+        for _ in self._iter_plan(expression, None, tracking=tracking):
+            pass
+        return sum(1 for kind, _, _ in tracking if kind == 'remote')
+
+    def _covers(self, partition, filter_query):
+        ''' True if every record of the cache entry matches :filter_query. '''
+        return simplify(And([partition, Not(filter_query)]), self.types) is False
+
+    def _statistics(self, partition):
+        if hasattr(self.cache, 'statistics'):
+            return self.cache.statistics(partition)
+        return None
+
+    def _partial(self, partition, filter_query, load, key, func):
+        ''' Apply :func to a plan step, memoising the result if the step
+        covers the whole cache entry. '''
+        if not self._covers(partition, filter_query):
+            return func(load())
+        if key == 'count':
+            statistics = self._statistics(partition)
+            if statistics is not None:
+                return statistics['rows']
+        return self._memoised((partition, key), lambda: func(load()))
+
+    def _memoised(self, memo_key, compute):
+        ''' Value of compute() kept in the aggregates LRU under :memo_key
+        (which starts with the cache entry it describes). '''
+        with self.aggregates_lock:
+            if memo_key in self.aggregates:
+                # Move to the most recently used end.
+                value = self.aggregates.pop(memo_key)
+                self.aggregates[memo_key] = value
+                return value
+        value = compute()
+        with self.aggregates_lock:
+            self.aggregates[memo_key] = value
+            while len(self.aggregates) > self.max_aggregates:
+                self.aggregates.popitem(last=False)
+        return value
+
+    def _plan_cache(self, expression):
+        ''' Plans the cached part of a query. Returns a list of (cache entry,
+        filter) steps, the remainder to be fetched from the remote (False if
+        none) and the tracking record. '''
+        with instrument.span('plan'):
+            return self._plan_steps(expression)
+
+    def _plan_steps(self, expression):
+        tracking = []
+        plan = []
+        # Keys are copied, as other threads may add entries while planning.
+        for cached_query in list(self.cache.keys()):
             # If the cache element overlaps the current expression, add it
             # to the partial data and replace expression with remainder.
             tracking.append(('cache', expression, cached_query))
-            intersection = simplify(And([expression, cached_query]))
+            intersection = simplify(And([expression, cached_query]), self.types)
             if intersection is not False:
                 plan.append((cached_query, expression))
-                expression = simplify(And([expression, Not(cached_query)]))
+                expression = simplify(And([expression, Not(cached_query)]), self.types)
             # If there is no remainder, we can stop.
             if expression is False:
                 break
+        return plan, expression, tracking
+
+    def _iter_plan(self, expression, columns, tracking=None):
+        ''' Runs the query plan, yielding (cache entry, filter, load) for each
+        step, where load() returns the filtered data for the step. Data is
+        only read from the cache when load is called. The remainder is
+        fetched through the in-flight registry (see SingleFlight): parts
+        already being fetched by another query are waited for, then planned
+        again against the cache. Steps are recorded in self.tracking and a
+        completed query is passed to the prefetch policy (if any), unless a
+        separate :tracking list is given (for background fills). '''
+        query = expression
+        foreground = tracking is None
+        generation = self.flights.generation
+        plan, expression, planned = self._plan_cache(expression)
+        if foreground:
+            tracking = self.tracking = planned
         else:
-            # No break: there is missing data to be retrieved from remote.
+            tracking.extend(planned)
+        steps = 0
+        for step in self._cached_steps(plan, tracking, columns):
+            steps += 1
+            yield step
+        while expression is not False:
+            claimed = self.flights.claim(expression, generation, self.types)
+            if claimed is None:
+                # Other fetches completed since planning: plan again.
+                generation = self.flights.generation
+                plan, expression, replanned = self._plan_cache(expression)
+                tracking.extend(replanned)
+                for step in self._cached_steps(plan, tracking, columns):
+                    steps += 1
+                    yield step
+                continue
+            flight, waits = claimed
+            if flight is not None:
+                try:
+                    for step in self._remote_steps(flight.expression, tracking, columns):
+                        steps += 1
+                        yield step
+                finally:
+                    self.flights.release(flight)
+                expression = simplify(And([expression, Not(flight.expression)]), self.types)
+            for waited in waits:
+                tracking.append(('wait', expression, waited.expression))
+                instrument.count('remote_waits')
+                waited.wait()
+        if steps == 0:
+            # Every entry was skipped: an empty step gives the schema.
+            skipped = [(cached_query, filter_query)
+                       for kind, filter_query, cached_query in tracking if kind == 'skip']
+            if skipped:
+                cached_query, filter_query = skipped[-1]
+                yield cached_query, filter_query, functools.partial(
+                    self._load_empty, cached_query, filter_query, columns)
+        if foreground and self.prefetch is not None:
+            self.prefetch.observe(self, query)
+
+    def _cached_steps(self, plan, tracking, columns):
+        ''' Plan steps reading cache entries. Entries whose statistics rule
+        out any matching records are skipped (their part of the query is
+        still accounted for). '''
+        for cached_query, filter_query in plan:
+            statistics = self._statistics(cached_query)
+            if statistics is not None and not may_match(statistics, filter_query):
+                tracking.append(('skip', filter_query, cached_query))
+                instrument.count('cache_skips')
+                continue
+            instrument.count('cache_hits')
+            yield cached_query, filter_query, functools.partial(
+                self._load, cached_query, filter_query, columns)
+
+    def _remote_steps(self, expression, tracking, columns):
+        ''' Plan steps fetching :expression from the remote, writing each
+        new entry to the cache as it arrives. If the remote fails part way,
+        entries already written are kept and CacheFillError reports the
+        part still missing. '''
+        instrument.count('cache_misses')
+        fetched = []
+        try:
+            for step in self._fill(expression, tracking, columns, fetched):
+                yield step
+        except CacheFillError:
+            raise
+        except Exception as e:
+            missing = simplify(And([expression, Not(Or(fetched))]), self.types)
+            tracking.append(('failed', missing, None))
+            raise_from(CacheFillError(missing, fetched, e), e)
+
+    def _fill(self, expression, tracking, columns, fetched):
+        with instrument.span('remote'):
             remote_result = self.remote.get(expression)
-            # Response should be a single (query, data) tuple of an iterable
-            # of the entries matching that spec.
-            if isinstance(remote_result, tuple):
-                assert len(remote_result) == 2
-                remote_result = [remote_result]
-            # Continues the query planning process as above, while writing
-            # new data to the cache.
-            for remote_query, remote_data in remote_result:
-                # Input new data, add to the plan if useful.
-                assert remote_query not in self.cache.keys()
-                self.cache[remote_query] = remote_data
+        # Response should be a single (query, data) tuple of an iterable
+        # of the entries matching that spec.
+        if isinstance(remote_result, tuple):
+            assert len(remote_result) == 2
+            remote_result = [remote_result]
+        remote_result = instrument.timed_iter('remote', remote_result)
+        # Continues the query planning process as above, while writing
+        # new data to the cache.
+        for remote_query, remote_data in remote_result:
+            instrument.count('remote_entries')
+            remote_data = self._encode(self._sort(remote_data))
+            # Input new data, add to the plan if useful. A remote may
+            # return queries which are already cached (e.g. widened
+            # buckets); the existing entry is reused, not rewritten.
+            with self.flights.write_lock:
+                written = remote_query not in self.cache.keys()
+                if written:
+                    self.cache[remote_query] = remote_data
+            if written:
                 tracking.append(('remote', expression, remote_query))
-                intersection = simplify(And([expression, remote_query]))
-                if intersection is not False:
-                    plan.append((remote_query, expression))
-                    expression = simplify(And([expression, Not(remote_query)]))
-            # Don't break when complete (this would skip caching some remote
-            # data), but verify completeness after loop.
-            assert expression is False, expression
-        # Assemble result from the plan.
-        self.tracking = tracking
-        return pd.concat(
-            query_df(self.cache[cached_query], filter_query)
-            for cached_query, filter_query in plan)
+                if self.results is not None:
+                    self.results.invalidate(remote_query, self.types)
+            else:
+                tracking.append(('reuse', expression, remote_query))
+            fetched.append(remote_query)
+            intersection = simplify(And([expression, remote_query]), self.types)
+            if intersection is not False:
+                # Filter new data in memory instead of reading it back from
+                # the cache (write-through).
+                yield remote_query, expression, functools.partial(
+                    self._load, remote_query, expression, columns, remote_data)
+                expression = simplify(And([expression, Not(remote_query)]), self.types)
+        # Don't stop when complete (this would skip caching some remote
+        # data), but verify completeness after loop.
+        if expression is not False:
+            raise CacheFillError(expression, fetched)
+
+    def _encode(self, data):
+        ''' Encode new data as the cache stores it (e.g. categorical
+        columns), so fresh and cached results are consistent. '''
+        if data is None or not hasattr(self.cache, 'encode'):
+            return data
+        return self.cache.encode(data)
+
+    def _sort(self, data):
+        ''' Sort new data on the sort key (if any) before caching. '''
+        if self.sort_key is None or data is None or self.sort_key not in data.columns:
+            return data
+        return data.sort_values(self.sort_key, kind='mergesort')
+
+    def _sorted_on(self, cached_query):
+        ''' Sort key of a cache entry, if its statistics show it is sorted
+        (entries written before a sort key was set may not be). '''
+        if self.sort_key is None:
+            return None
+        statistics = self._statistics(cached_query)
+        if statistics is None:
+            return None
+        if statistics['columns'].get(self.sort_key, dict()).get('sorted'):
+            return self.sort_key
+        return None
+
+    def _load(self, cached_query, filter_query, columns, data=None):
+        ''' Filtered data for a plan step, read from the cache unless the
+        :data has just been received from the remote (then already sorted). '''
+        if data is None:
+            sort_key = self._sorted_on(cached_query)
+            data = self._read(cached_query, filter_query, columns)
+        else:
+            sort_key = self.sort_key if self.sort_key in data.columns else None
+        return query_df(data, filter_query, columns, sort_key=sort_key)
+
+    def _load_empty(self, cached_query, filter_query, columns):
+        ''' No records, with the columns and types of a cache entry. '''
+        data = self._read(cached_query, filter_query, columns).iloc[:0]
+        return query_df(data, filter_query, columns)
+
+    def _read(self, cached_query, filter_query, columns):
+        ''' Read a cache entry, loading only the columns needed to filter and
+        project it if the cache supports partial reads. '''
+        with instrument.span('read'):
+            if columns is not None and hasattr(self.cache, 'read'):
+                data = self.cache.read(cached_query, required_columns(filter_query, columns))
+            else:
+                data = self.cache[cached_query]
+        if instrument.enabled():
+            instrument.count('bytes_read', int(data.memory_usage(index=True).sum()))
+        return data
+
+    def flush(self):
+        ''' Wait for any pending cache writes to complete. '''
+        if hasattr(self.cache, 'flush'):
+            self.cache.flush()
 
     def clear_cache(self):
+        with self.aggregates_lock:
+            self.aggregates.clear()
+        if self.results is not None:
+            self.results.clear()
         if hasattr(self.cache, 'clear_cache'):
             self.cache.clear_cache()
 
 
+class _Flight(object):
+    ''' A remote request in progress. '''
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.done = threading.Event()
+
+    def wait(self):
+        self.done.wait()
+
+
+class SingleFlight(object):
+    ''' Registry of remote requests in progress for a cache, so concurrent
+    queries never send duplicate or overlapping requests. A query claims
+    its remainder less the parts already in flight, and waits for those
+    flights to finish (their data is then in the cache). The generation
+    counts completed flights: a claim made with a stale generation is
+    refused, since the remainder must be planned again against entries
+    written since. write_lock guards the check and write of cache entries,
+    which different flights may both receive (e.g. widened buckets).
+    Remotes which widen queries to fixed buckets (decorators.ParameterWrapper)
+    also claim each bucket (claim_buckets), so non-overlapping queries
+    within one bucket send it once. '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.flights = []
+        self.buckets = dict()
+        self.generation = 0
+
+    def claim(self, expression, generation, types=None):
+        ''' Returns (own flight or None, flights to wait for), or None if
+        :generation is stale. '''
+        with self.lock:
+            if generation != self.generation:
+                return None
+            waits = []
+            for flight in self.flights:
+                if simplify(And([expression, flight.expression]), types) is not False:
+                    waits.append(flight)
+                    expression = simplify(And([expression, Not(flight.expression)]), types)
+                    if expression is False:
+                        return None, waits
+            flight = _Flight(expression)
+            self.flights.append(flight)
+            return flight, waits
+
+    def release(self, flight):
+        ''' Mark :flight complete (whether or not it succeeded). Waiters plan
+        again, so parts a failed flight did not fetch are requested again. '''
+        with self.lock:
+            self.flights.remove(flight)
+            self.generation += 1
+        flight.done.set()
+
+    def claim_buckets(self, buckets):
+        ''' Claims the :buckets (exact cache keys) not already in flight.
+        Returns (own flights, flights to wait for). '''
+        with self.lock:
+            own, waits = [], []
+            for bucket in buckets:
+                flight = self.buckets.get(bucket)
+                if flight is None:
+                    flight = self.buckets[bucket] = _Flight(bucket)
+                    own.append(flight)
+                else:
+                    waits.append(flight)
+            return own, waits
+
+    def release_bucket(self, flight):
+        ''' Mark a bucket flight complete, after its entry is written (or
+        the fetch failed). '''
+        with self.lock:
+            del self.buckets[flight.expression]
+        flight.done.set()
+
+
+class ResultCache(object):
+    ''' Assembled query results, keyed by (simplified expression, columns),
+    within a budget of :max_bytes (deep memory usage). Least recently used
+    results are evicted first; results larger than the budget are not kept.
+    get returns a shallow copy sharing the cached data, which callers should
+    treat as read-only (with pandas copy-on-write, changes are not seen by
+    the cache). Queries subsumed by a kept result can be derived from it
+    (see derive); only the :candidates most recently used results are
+    checked, as each check is a simplification. Methods are locked, as
+    background fills (prefetch) and concurrent queries share the cache. '''
+
+    def __init__(self, max_bytes, candidates=8):
+        self.max_bytes = max_bytes
+        self.candidates = candidates
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.entries = collections.OrderedDict()
+            self.nbytes = 0
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            # Move to the most recently used end.
+            data, size = self.entries.pop(key)
+            self.entries[key] = data, size
+        return data.copy(deep=False)
+
+    def put(self, key, data):
+        ''' Keep :data as the result for :key. A shallow copy is kept, so the
+        caller's frame is not shared with later hits. '''
+        size = int(data.memory_usage(index=True, deep=True).sum())
+        data = data.copy(deep=False)
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            while self.nbytes + size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.nbytes -= evicted
+            self.entries[key] = data, size
+            self.nbytes += size
+
+    def derive(self, expression, columns=None, types=None):
+        ''' Answer :expression (projected to :columns) by filtering a kept
+        result of a broader query, which has every column needed. Returns
+        (broader expression, data) or None. '''
+        needed = None if columns is None else set(required_columns(expression, columns))
+        with self.lock:
+            keys = list(reversed(self.entries))[:self.candidates]
+        for key in keys:
+            source, source_columns = key
+            if source_columns is not None and (needed is None or not needed.issubset(source_columns)):
+                continue
+            if simplify(And([expression, Not(source)]), types) is False:
+                data = self.get(key)
+                if data is None:
+                    # Invalidated since the keys were listed.
+                    continue
+                return source, query_df(data, expression, columns)
+        return None
+
+    def invalidate(self, expression, types=None):
+        ''' Drop results of queries overlapping :expression (e.g. a newly
+        written cache entry). '''
+        with self.lock:
+            keys = list(self.entries)
+        overlapping = [
+            key for key in keys if simplify(And([key[0], expression]), types) is not False]
+        with self.lock:
+            for key in overlapping:
+                if key in self.entries:
+                    self.nbytes -= self.entries.pop(key)[1]
+
+
+class CategoryDictionary(object):
+    ''' Store-wide dictionaries of values for the given categorical :columns.
+    Dictionaries are append-only, so the integer code of a value never
+    changes and data encoded at any time can be decoded with the current
+    dictionary. Optional :values gives existing dictionaries by column.
+    Encoding is locked, as concurrent fills may add values; stores hold the
+    lock while saving a changed dictionary. '''
+
+    def __init__(self, columns, values=None):
+        self.lock = threading.RLock()
+        values = values or dict()
+        self.values = {column: list(values.get(column, [])) for column in columns}
+        self.codes = {
+            column: {value: code for code, value in enumerate(column_values)}
+            for column, column_values in self.values.items()}
+
+    def encode(self, data):
+        ''' Return :data with categorical columns converted to pandas
+        categoricals using the shared dictionary (which is extended with any
+        new values). Returns the names of columns whose dictionary changed. '''
+        with self.lock:
+            return self._encode(data)
+
+    def _encode(self, data):
+        data = data.copy(deep=False)
+        changed = []
+        for column in self.values:
+            if column not in data.columns:
+                continue
+            series = data[column]
+            if is_categorical(series):
+                categories = list(series.cat.categories)
+                if categories == self.values[column][:len(categories)]:
+                    # Already encoded with this dictionary.
+                    data[column] = series.cat.set_categories(self.values[column])
+                    continue
+                series = series.astype(object)
+            new_values = [
+                value for value in pd.unique(series.dropna())
+                if value not in self.codes[column]]
+            if len(new_values) > 0:
+                for value in new_values:
+                    self.codes[column][value] = len(self.values[column])
+                    self.values[column].append(value)
+                changed.append(column)
+            data[column] = pd.Categorical(series, categories=self.values[column])
+        return data, changed
+
+    def to_codes(self, data):
+        ''' Replace encoded categorical columns by their integer codes. '''
+        data = data.copy(deep=False)
+        for column in self.values:
+            if column in data.columns and is_categorical(data[column]):
+                data[column] = data[column].cat.codes
+        return data
+
+    def from_codes(self, data):
+        ''' Inverse of to_codes, giving categoricals with the current (full)
+        dictionary, so all entries have the same categories. '''
+        for column in self.values:
+            if column not in data.columns:
+                continue
+            if is_categorical(data[column]):
+                if len(data[column].cat.categories) == len(self.values[column]):
+                    continue
+                codes = data[column].cat.codes.values
+            elif data[column].dtype.kind in 'iu':
+                codes = data[column].values
+            else:
+                # Written before the column was declared categorical.
+                continue
+            data[column] = pd.Categorical.from_codes(codes, categories=self.values[column])
+        return data
+
+
+class InMemoryDict(dict):
+    ''' dict which also keeps statistics of each entry (see
+    engine.partition_statistics) for query planning. Optional :categorical
+    columns are stored as pandas categoricals with a shared dictionary (see
+    CategoryDictionary). '''
+
+    def __init__(self, categorical=None):
+        super().__init__()
+        self.stats = dict()
+        self.dictionary = None if categorical is None else CategoryDictionary(categorical)
+
+    def encode(self, data):
+        ''' Encode categorical columns as they will be stored. '''
+        if self.dictionary is None:
+            return data
+        return self.dictionary.encode(data)[0]
+
+    def __getitem__(self, expression):
+        data = super().__getitem__(expression)
+        if self.dictionary is None:
+            return data
+        return self.dictionary.from_codes(data.copy(deep=False))
+
+    def __setitem__(self, expression, data):
+        data = self.encode(data)
+        self.stats[expression] = partition_statistics(data)
+        super().__setitem__(expression, data)
+
+    def statistics(self, expression):
+        return self.stats.get(expression)
+
+
 class PersistentDict(object):
     ''' dict-like interface which keeps a contents file using shelve and
     writes data using hdf5. Expression keys are serialised to JSON (shelf data
     must be binary-encodable). Implementation assumes only one PersistentDict
     is accessing the store at a time (loads shelf on start then updates the
-    local copy only when modifying). '''
+    local copy only when modifying). Data is written in the given hdf5
+    :data_format; 'table' format allows reading a subset of columns
+    ('fixed' entries are read whole and projected in memory, which is
+    logged once per store).
+    Statistics of each entry are kept in a second shelf, so the planner can
+    use them without reading data. Optional :categorical columns are written
+    as integer codes of a store-wide dictionary, kept in a third shelf, and
+    read as pandas categoricals (see CategoryDictionary). '''
 
-    def __init__(self, location, protocol=None):
+    def __init__(self, location, protocol=None, data_format='fixed', categorical=None):
         self.location = location
         self.contents_file = os.path.join(self.location, 'contents')
+        self.statistics_file = os.path.join(self.location, 'statistics')
+        self.dictionary_file = os.path.join(self.location, 'dictionary')
         self.protocol = protocol
+        self.data_format = data_format
+        self.full_reads = False
         if not os.path.exists(self.location):
             os.makedirs(self.location)
         with closing(shelve.open(self.contents_file, protocol=self.protocol)) as shelf:
             self.local_contents = self.decode_shelf(shelf)
+        with closing(shelve.open(self.statistics_file, protocol=self.protocol)) as shelf:
+            self.local_statistics = self.decode_shelf(shelf)
+        self.dictionary = None
+        if categorical is not None:
+            with closing(shelve.open(self.dictionary_file, protocol=self.protocol)) as shelf:
+                self.dictionary = CategoryDictionary(categorical, dict(shelf.items()))
+
+    def encode(self, data):
+        ''' Encode categorical columns as they will be stored. '''
+        if self.dictionary is None:
+            return data
+        with self.dictionary.lock:
+            data, changed = self.dictionary.encode(data)
+            if len(changed) > 0:
+                # Dictionary is saved before any data using the new codes.
+                with closing(shelve.open(self.dictionary_file, protocol=self.protocol)) as shelf:
+                    for column in changed:
+                        shelf[column] = self.dictionary.values[column]
+        return data
+
+    def _decode(self, data):
+        if self.dictionary is None:
+            return data
+        return self.dictionary.from_codes(data)
 
     @staticmethod
     def decode_shelf(shelf):
@@ -105,6 +779,11 @@ class PersistentDict(object):
             json.loads(key, object_hook=object_hook): data_id
             for key, data_id in shelf.items()}
 
+    def statistics(self, expression):
+        ''' Statistics recorded when the entry was written (None for entries
+        written before statistics were kept). '''
+        return self.local_statistics.get(expression)
+
     def keys(self):
         ''' Update local_contents and return expression keys. '''
         return self.local_contents.keys()
@@ -114,19 +793,55 @@ class PersistentDict(object):
         is not in the local copy of contents, update local copy before
         attempting to get the data identifier. '''
         data_id = self.local_contents[expression]
-        return pd.read_hdf(os.path.join(self.location, data_id))
+        return self._decode(pd.read_hdf(os.path.join(self.location, data_id)))
+
+    def read(self, expression, columns=None):
+        ''' As for getitem, but loads only the given :columns if the data
+        was written in table format. '''
+        if columns is None:
+            return self[expression]
+        data_file = os.path.join(self.location, self.local_contents[expression])
+        try:
+            data = pd.read_hdf(data_file, columns=list(columns))
+        except TypeError:
+            # Fixed format data: columns can't be selected when reading.
+            if not self.full_reads:
+                self.full_reads = True
+                logging.info(
+                    'Cache entries in %s are in fixed format and are read whole; '
+                    'write with data_format=\'table\' to read only the needed columns.',
+                    self.location)
+            data = pd.read_hdf(data_file)[list(columns)]
+        return self._decode(data)
 
     def __setitem__(self, expression, data):
         ''' Write a new expression key to contents shelf with a unique data
         identifier, write data to file given by the identifier. Updates
         local_contents after adding the new key. Data is written first, so if
-        there are errors in data writing, the contents will not be updated. '''
+        there are errors in data writing, the contents will not be updated.
+        Each entry is committed atomically: data is written to a partial file
+        which is renamed into place, and the contents shelf (written last)
+        is the commit record. '''
         data_id = str(uuid.uuid4())
-        data.to_hdf(os.path.join(self.location, data_id), key='main', complevel=3)
+        data = self.encode(data)
+        stored = data if self.dictionary is None else self.dictionary.to_codes(data)
+        data_file = os.path.join(self.location, data_id)
+        partial_file = data_file + '.partial'
+        try:
+            stored.to_hdf(partial_file, key='main', complevel=3, format=self.data_format)
+            os.rename(partial_file, data_file)
+        except Exception:
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+            raise
         if not os.path.exists(self.location):
             os.makedirs(self.location)
+        key = json.dumps(expression, default=default)
+        statistics = partition_statistics(data)
+        with closing(shelve.open(self.statistics_file, protocol=self.protocol)) as shelf:
+            shelf[key] = statistics
+        self.local_statistics[expression] = statistics
         with closing(shelve.open(self.contents_file, protocol=self.protocol)) as shelf:
-            key = json.dumps(expression, default=default)
             shelf[key] = data_id
             self.local_contents = self.decode_shelf(shelf)
 
@@ -135,17 +850,237 @@ class PersistentDict(object):
             data_file = os.path.join(self.location, data_id)
             if os.path.exists(data_file):
                 os.remove(data_file)
-        if os.path.exists(self.contents_file):
-            os.remove(self.contents_file)
+        for shelf_file in [self.contents_file, self.statistics_file, self.dictionary_file]:
+            if os.path.exists(shelf_file):
+                os.remove(shelf_file)
         self.local_contents = dict()
+        self.local_statistics = dict()
+        if self.dictionary is not None:
+            self.dictionary = CategoryDictionary(self.dictionary.values.keys())
+
+
+# Queued to stop a background writer thread.
+_STOP = object()
+
+
+def _stop(queue, ref):
+    ''' Stop the thread of a collected writer, after its queued writes. '''
+    queue.put(_STOP)
+
+
+# Live background writers, closed at exit so pending writes complete.
+_WRITERS = weakref.WeakSet()
+
+
+def _close_writers():
+    for writer in list(_WRITERS):
+        try:
+            writer.close()
+        except Exception:
+            logging.exception('Background cache writes failed at exit.')
+
+
+atexit.register(_close_writers)
+_exit_registered = []
+
+
+def _register_exit():
+    ''' Register _close_writers again after the first write, so it runs
+    before exit handlers of storage libraries imported on first use (e.g.
+    pytables closes open files at exit). '''
+    if not _exit_registered:
+        _exit_registered.append(True)
+        atexit.register(_close_writers)
+
+
+def _write_loop(ref, queue, store, store_lock):
+    ''' Background writer thread. Holds a weak reference to the writer, so
+    an unused writer can be collected; its queued writes still complete. '''
+    while True:
+        item = queue.get()
+        try:
+            if item is _STOP:
+                return
+            expression, entry = item
+            writer = ref()
+            if writer is not None and not writer._queued(expression, entry):
+                continue
+            try:
+                with store_lock:
+                    store[expression] = entry[0]
+            except Exception as e:
+                logging.exception('Background cache write failed: {}'.format(repr(expression)))
+                if writer is not None:
+                    writer._written(expression, entry, e)
+            else:
+                _register_exit()
+                if writer is not None:
+                    writer._written(expression, entry, None)
+        finally:
+            # Not kept while waiting, so the writer can be collected.
+            writer = None
+            queue.task_done()
+
+
+class BackgroundWriter(object):
+    ''' dict-like wrapper which writes to an underlying :store (such as a
+    PersistentDict) on a background thread. Pending entries are held in
+    memory (with their statistics) and served from there until written, so
+    keys and data are available immediately. Store access is serialised
+    with a separate lock, as the underlying store (shelve, hdf5) need not be
+    thread-safe. Keys and statistics are kept by the writer, so planning
+    never waits for a disk write.
+    An entry whose write fails stays pending (and is served from memory);
+    it is retried on flush, which raises the error if it fails again. close
+    completes pending writes and stops the thread (done at exit for writers
+    still open). '''
+
+    def __init__(self, store):
+        self.store = store
+        self.pending = dict()
+        self.stored = collections.OrderedDict.fromkeys(store.keys())
+        self.stored_statistics = dict()
+        self.errors = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.store_lock = threading.Lock()
+        self.queue = Queue()
+        self.worker = threading.Thread(target=_write_loop, args=(
+            weakref.ref(self, functools.partial(_stop, self.queue)),
+            self.queue, store, self.store_lock))
+        self.worker.daemon = True
+        self.worker.start()
+        _WRITERS.add(self)
+
+    def _queued(self, expression, entry):
+        ''' True if :entry is still to be written for :expression (it is
+        not if replaced, or dropped by clear_cache). '''
+        with self.lock:
+            return self.pending.get(expression) is entry
+
+    def _written(self, expression, entry, error):
+        with self.lock:
+            if self.pending.get(expression) is not entry:
+                return
+            if error is None:
+                del self.pending[expression]
+                self.errors.pop(expression, None)
+                self.stored[expression] = None
+                self.stored_statistics[expression] = entry[1]
+            else:
+                self.errors[expression] = error
+
+    def keys(self):
+        with self.lock:
+            return list(self.stored) + [
+                expression for expression in self.pending if expression not in self.stored]
+
+    def __getitem__(self, expression):
+        with self.lock:
+            if expression in self.pending:
+                return self.pending[expression][0]
+        with self.store_lock:
+            return self.store[expression]
+
+    def read(self, expression, columns=None):
+        with self.lock:
+            entry = self.pending.get(expression)
+        if entry is not None:
+            return entry[0] if columns is None else entry[0][list(columns)]
+        with self.store_lock:
+            if hasattr(self.store, 'read'):
+                return self.store.read(expression, columns)
+            data = self.store[expression]
+        return data if columns is None else data[list(columns)]
+
+    def encode(self, data):
+        # Store encoding is locked by its dictionary, not the store lock,
+        # so it does not wait for a disk write.
+        if not hasattr(self.store, 'encode'):
+            return data
+        return self.store.encode(data)
+
+    def statistics(self, expression):
+        with self.lock:
+            if expression in self.pending:
+                return self.pending[expression][1]
+            if expression in self.stored_statistics:
+                return self.stored_statistics[expression]
+        if not hasattr(self.store, 'statistics'):
+            return None
+        with self.store_lock:
+            statistics = self.store.statistics(expression)
+        with self.lock:
+            self.stored_statistics[expression] = statistics
+        return statistics
+
+    def __setitem__(self, expression, data):
+        entry = (data, partition_statistics(data))
+        with self.lock:
+            self.pending[expression] = entry
+            self.errors.pop(expression, None)
+        if self.worker.is_alive():
+            self.queue.put((expression, entry))
+        else:
+            # Closed: write in the foreground.
+            with self.store_lock:
+                self.store[expression] = data
+            self._written(expression, entry, None)
+
+    def flush(self):
+        ''' Block until all pending writes are in the underlying store.
+        Failed writes are retried; if any fail again, the first error is
+        raised (the entries stay pending). '''
+        with self.lock:
+            failed = [(expression, self.pending[expression]) for expression in self.errors]
+            self.errors.clear()
+        for item in failed:
+            self.queue.put(item)
+        self.queue.join()
+        with self.lock:
+            errors = list(self.errors.values())
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        ''' Complete pending writes and stop the background thread. '''
+        if not self.worker.is_alive():
+            return
+        try:
+            self.flush()
+        finally:
+            self.queue.put(_STOP)
+            self.worker.join()
+            _WRITERS.discard(self)
+
+    def clear_cache(self):
+        self.flush()
+        with self.lock:
+            self.pending.clear()
+            self.stored.clear()
+            self.stored_statistics.clear()
+        with self.store_lock:
+            if hasattr(self.store, 'clear_cache'):
+                self.store.clear_cache()
 
 
-def minimal_cache_inmemory(remote):
-    return MinimalCache(remote, dict())
+def minimal_cache_inmemory(remote, types=None, sort_key=None, categorical=None,
+                           result_bytes=None, prefetch=None):
+    return MinimalCache(
+        remote, InMemoryDict(categorical=categorical), types=types, sort_key=sort_key,
+        result_bytes=result_bytes, prefetch=prefetch)
 
 
-def minimal_cache_persistent(remote, location, **kwargs):
-    return MinimalCache(remote, PersistentDict(location, **kwargs))
+def minimal_cache_persistent(remote, location, types=None, write_behind=False,
+                             sort_key=None, result_bytes=None, prefetch=None, **kwargs):
+    ''' If :write_behind is set, new data is written to disk on a background
+    thread (see BackgroundWriter), so a query which needs remote data does not
+    wait for the disk write. '''
+    cache = PersistentDict(location, **kwargs)
+    if write_behind:
+        cache = BackgroundWriter(cache)
+    return MinimalCache(
+        remote, cache, types=types, sort_key=sort_key, result_bytes=result_bytes,
+        prefetch=prefetch)
 
 
 # if cached_query == expression:
@@ -2,6 +2,7 @@
 expressions. Other components (caches, engines, interfaces, etc) should
 communicate by passing core expression objects. '''
 
+from .dtypes import Categorical, Date, Integer
 from .expand import to_dnf_simplified
 from .expressions import Attribute, And, Or, Not, Eq, Le, Lt, Ge, Gt, Eq, In
 from .logic import simplify_tree
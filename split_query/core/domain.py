@@ -1,11 +1,14 @@
 '''
 Algorithms to simplify domain relationships in conditional expressions.
     - simplify_flat_and
+    - simplify_flat_or
 '''
 
+import bisect
 import collections
 
-from .expressions import And, Not, Le, Lt, Ge, Gt, Eq, In
+from .dtypes import Categorical, DiscreteType
+from .expressions import And, Or, Not, Le, Lt, Ge, Gt, Eq, In
 
 
 # Placeholder expression object, never returned as part of an expression.
@@ -81,7 +84,52 @@ def _normalise_output(clause):
 HANDLED_CLAUSES = (Le, Lt, Ge, Gt, In, NotIn)
 
 
-def simplify_flat_and(expression):
+def _tighten_discrete(dtype, lower_bound, upper_bound, in_clause):
+    ''' Apply a DiscreteType to the constraints on one attribute. Bounds are
+    moved to grid values (and past any excluded values), values which cannot
+    occur are removed from In/NotIn clauses. '''
+    if lower_bound is not None:
+        lower_bound = dtype.tighten_lower(lower_bound)
+    if upper_bound is not None:
+        upper_bound = dtype.tighten_upper(upper_bound)
+    if in_clause is not None:
+        in_clause = type(in_clause)(
+            in_clause.attribute, [v for v in in_clause.valueset if dtype.is_valid(v)])
+    if type(in_clause) is NotIn:
+        # Each step consumes an excluded value, so these terminate.
+        excluded = set(in_clause.valueset)
+        while lower_bound is not None and lower_bound.value in excluded:
+            lower_bound = Ge(lower_bound.attribute, lower_bound.value + dtype.step)
+        while upper_bound is not None and upper_bound.value in excluded:
+            upper_bound = Le(upper_bound.attribute, upper_bound.value - dtype.step)
+    return lower_bound, upper_bound, in_clause
+
+
+def _restrict_categorical(dtype, lower_bound, upper_bound, in_clause):
+    ''' Apply a Categorical type to the constraints on one attribute. Returns
+    the new set clause: values outside the domain are dropped, NotIn sets are
+    rewritten as In sets where that is smaller, and None is returned if the
+    set covers the whole domain (no constraint). '''
+    if in_clause is None:
+        return None
+    values = [
+        value for value in dtype.values
+        if (lower_bound is None or _satisfies(value, lower_bound)) and
+        (upper_bound is None or _satisfies(value, upper_bound))]
+    if type(in_clause) is In:
+        included = set(in_clause.valueset)
+        remaining = [value for value in values if value in included]
+    else:
+        excluded = set(in_clause.valueset).intersection(dtype.valueset)
+        remaining = [value for value in values if value not in excluded]
+        if len(remaining) > len(excluded):
+            return NotIn(in_clause.attribute, excluded) if len(excluded) > 0 else None
+    if len(remaining) == len(dtype.values):
+        return None
+    return In(in_clause.attribute, remaining)
+
+
+def simplify_flat_and(expression, types=None):
     ''' Simplify Le/Lt/Ge/Gt/Eq/In expressions joined by And relation. Clauses
     are grouped by attribute and redundant expressions are eliminated or
     reduced where possible.
@@ -97,6 +145,12 @@ def simplify_flat_and(expression):
     A 'simple' expression is any Eq/In/Le/Lt/Ge/Gt relation, or any of those
     relations within an (arbitrarily deep) Not clause. Hence the ideal use case
     is to run this algorithm on each component of an expression in DNF form.
+
+    Optional :types maps attributes to declared types (see dtypes). Bounds on
+    discrete attributes are tightened to grid values, so empty ranges such as
+    (x > 3) & (x < 4) for an Integer attribute are reduced to False. Sets on
+    categorical attributes are reduced using the known domain, so a set
+    covering the whole domain is True.
     '''
     assert type(expression) is And
 
@@ -136,6 +190,13 @@ def simplify_flat_and(expression):
             elif type(clause) in (In, NotIn):
                 in_clause = clause if in_clause is None else _simplify_in(in_clause, clause)
 
+        dtype = None if types is None else types.get(attribute)
+        if isinstance(dtype, DiscreteType):
+            lower_bound, upper_bound, in_clause = _tighten_discrete(
+                dtype, lower_bound, upper_bound, in_clause)
+        elif isinstance(dtype, Categorical):
+            in_clause = _restrict_categorical(dtype, lower_bound, upper_bound, in_clause)
+
         # Process the resulting bounds on this attribute, adding the tightest
         # bounds to output_clauses. If there are any conflicts found, the
         # process can be short-circuited, ignoring other expressions and
@@ -190,8 +251,316 @@ def simplify_flat_and(expression):
             elif upper_bound is not None:
                 output_clauses.append(upper_bound)
 
-    # Return composed result.
+    # Return composed result. May be empty if declared types showed that all
+    # constraints were redundant.
     output_clauses = [_normalise_output(cl) for cl in output_clauses + other_clauses]
-    assert len(output_clauses) > 0
+    if len(output_clauses) == 0:
+        return True
     assert not any(cl in (True, False) for cl in output_clauses)
     return And(output_clauses) if len(output_clauses) > 1 else output_clauses[0]
+
+
+# Constraint on a single attribute within a conjunction, as a tuple
+# (lower, upper, kind, values): lower/upper are Ge/Gt and Le/Lt relations or
+# None, kind is In/NotIn or None, values is a frozenset (None if no kind).
+_UNBOUNDED = (None, None, None, None)
+
+
+class _Conjunction(object):
+    ''' Working representation of one clause of a flat Or expression. The
+    original expression is retained until the clause is changed, so that
+    untouched clauses are returned exactly as they were given. '''
+
+    def __init__(self, specs, others, expression=None):
+        self.specs = specs
+        self.others = others
+        self.expression = expression
+
+    @classmethod
+    def from_expression(cls, expression):
+        clauses = expression.clauses if type(expression) is And else [expression]
+        specs = dict()
+        others = []
+        for clause in (_normalise_input(cl) for cl in clauses):
+            if type(clause) not in HANDLED_CLAUSES:
+                others.append(clause)
+                continue
+            lower, upper, kind, values = specs.get(clause.attribute, _UNBOUNDED)
+            if type(clause) in (Ge, Gt):
+                lower = clause
+            elif type(clause) in (Le, Lt):
+                upper = clause
+            else:
+                kind, values = type(clause), frozenset(clause.valueset)
+            specs[clause.attribute] = (lower, upper, kind, values)
+        return cls(specs, frozenset(others), expression)
+
+    def key_without(self, attribute):
+        ''' Hashable description of all constraints except those on :attribute. '''
+        return (
+            frozenset(item for item in self.specs.items() if item[0] != attribute),
+            self.others)
+
+    def replace(self, attribute, spec):
+        specs = dict(self.specs)
+        if spec == _UNBOUNDED:
+            specs.pop(attribute, None)
+        else:
+            specs[attribute] = spec
+        return _Conjunction(specs, self.others)
+
+    def to_expression(self):
+        if self.expression is not None:
+            return self.expression
+        output_clauses = []
+        for attribute, (lower, upper, kind, values) in self.specs.items():
+            output_clauses.extend(cl for cl in (lower, upper) if cl is not None)
+            if kind is not None:
+                output_clauses.append(_normalise_output(kind(attribute, values)))
+        output_clauses.extend(self.others)
+        if len(output_clauses) == 0:
+            return True
+        return And(output_clauses) if len(output_clauses) > 1 else output_clauses[0]
+
+
+def _lower_contains(outer, inner):
+    ''' Return whether lower bound :outer is no tighter than :inner. '''
+    if outer is None:
+        return True
+    if inner is None:
+        return False
+    if inner.value == outer.value:
+        return type(outer) is Ge or type(inner) is Gt
+    return inner.value > outer.value
+
+
+def _upper_contains(outer, inner):
+    ''' Return whether upper bound :outer is no tighter than :inner. '''
+    if outer is None:
+        return True
+    if inner is None:
+        return False
+    if inner.value == outer.value:
+        return type(outer) is Le or type(inner) is Lt
+    return inner.value < outer.value
+
+
+def _value_in_spec(value, spec):
+    lower, upper, kind, values = spec
+    return (
+        (lower is None or _satisfies(value, lower)) and
+        (upper is None or _satisfies(value, upper)) and
+        (kind is not In or value in values) and
+        (kind is not NotIn or value not in values))
+
+
+def _spec_contains(outer, inner):
+    ''' Return whether every value allowed by :inner is allowed by :outer.
+    May give false negatives, never false positives. '''
+    if inner[2] is In:
+        return all(_value_in_spec(value, outer) for value in inner[3])
+    if outer[2] is In:
+        return False
+    if not (_lower_contains(outer[0], inner[0]) and _upper_contains(outer[1], inner[1])):
+        return False
+    if outer[2] is NotIn:
+        excluded = inner[3] if inner[2] is NotIn else frozenset()
+        inner_range = (inner[0], inner[1], None, None)
+        return all(
+            value in excluded or not _value_in_spec(value, inner_range)
+            for value in outer[3])
+    return True
+
+
+def _subsumes(outer, inner):
+    ''' Return whether conjunction :inner is contained in :outer. '''
+    if not outer.others.issubset(inner.others):
+        return False
+    return all(
+        attribute in inner.specs and _spec_contains(spec, inner.specs[attribute])
+        for attribute, spec in outer.specs.items())
+
+
+def _touches(upper, lower, dtype=None):
+    ''' Return whether an interval ending at :upper overlaps or is adjacent to
+    an interval starting at :lower (so their union is a single interval). '''
+    if upper is None or lower is None:
+        return True
+    if isinstance(dtype, DiscreteType) and type(upper) is Le and type(lower) is Ge:
+        # Consecutive grid values, e.g. (x <= 3) and (x >= 4) for integers.
+        return lower.value <= upper.value + dtype.step
+    if lower.value == upper.value:
+        return not (type(upper) is Lt and type(lower) is Gt)
+    return lower.value < upper.value
+
+
+def _merge_specs(specs, dtype=None):
+    ''' Merge constraints on a single attribute, taken from clauses which are
+    otherwise identical. Returns the list of merged constraints. '''
+    in_specs = [spec for spec in specs if spec[2] is In]
+    ranges = [spec for spec in specs if spec[2] is None]
+    result = [spec for spec in specs if spec[2] is NotIn]
+    if len(in_specs) > 0:
+        values = frozenset().union(*(spec[3] for spec in in_specs))
+        if isinstance(dtype, Categorical) and values.issuperset(dtype.valueset):
+            # Union covers the whole domain: attribute is unconstrained.
+            ranges.append(_UNBOUNDED)
+        else:
+            result.append((None, None, In, values))
+    # Sweep intervals in order of lower bound (unbounded first).
+    ranges.sort(key=lambda spec: (
+        spec[0] is not None,
+        None if spec[0] is None else spec[0].value,
+        type(spec[0]) is Gt))
+    current = None
+    for spec in ranges:
+        if current is None:
+            current = spec
+        elif _touches(current[1], spec[0], dtype):
+            upper = current[1] if _upper_contains(current[1], spec[1]) else spec[1]
+            current = (current[0], upper, None, None)
+        else:
+            result.append(current)
+            current = spec
+    if current is not None:
+        result.append(current)
+    return result
+
+
+def _merge_on_attribute(conjunctions, attribute, dtype=None):
+    ''' Merge conjunctions which differ only in their constraint on :attribute.
+    Grouping on the remaining constraints means each group is merged with a
+    sort and sweep rather than by pairwise comparison. '''
+    groups = collections.OrderedDict()
+    for conjunction in conjunctions:
+        groups.setdefault(conjunction.key_without(attribute), []).append(conjunction)
+    result = []
+    for group in groups.values():
+        if len(group) == 1:
+            result.extend(group)
+            continue
+        merged = _merge_specs(
+            [cj.specs.get(attribute, _UNBOUNDED) for cj in group], dtype)
+        if len(merged) == len(group):
+            result.extend(group)
+        else:
+            result.extend(group[0].replace(attribute, spec) for spec in merged)
+    return result
+
+
+def _lower_key(bound):
+    return (0, ) if bound is None else (1, bound.value)
+
+
+def _upper_key(bound):
+    return (1, ) if bound is None else (0, bound.value)
+
+
+class _IntervalIndex(object):
+    ''' Index of conjunctions sharing a set of constrained attributes, sorted
+    by lower bound on one range attribute. A conjunction can only be contained
+    in one whose interval on that attribute contains its own, so candidates
+    are found by bisecting on the lower bound and checking the running maximum
+    upper bound, rather than scanning every conjunction. '''
+
+    def __init__(self, conjunctions, positions):
+        self.attribute = next((
+            attribute for position in positions
+            for attribute, spec in conjunctions[position].specs.items()
+            if spec[2] is None), None)
+        entries, self.unordered = [], []
+        for position in positions:
+            spec = conjunctions[position].specs.get(self.attribute, _UNBOUNDED)
+            if self.attribute is None or spec[2] is not None:
+                self.unordered.append(position)
+            else:
+                entries.append((_lower_key(spec[0]), _upper_key(spec[1]), position))
+        entries.sort(key=lambda entry: entry[0])
+        self.lower_keys = [entry[0] for entry in entries]
+        self.upper_keys = [entry[1] for entry in entries]
+        self.positions = [entry[2] for entry in entries]
+        self.max_upper = []
+        for key in self.upper_keys:
+            self.max_upper.append(key if len(self.max_upper) == 0 else max(key, self.max_upper[-1]))
+
+    def candidates(self, conjunction):
+        ''' Positions of conjunctions which might contain :conjunction. '''
+        for position in self.unordered:
+            yield position
+        spec = conjunction.specs.get(self.attribute)
+        if spec is None or spec[2] is In:
+            for position in self.positions:
+                yield position
+            return
+        lower, upper = _lower_key(spec[0]), _upper_key(spec[1])
+        end = bisect.bisect_right(self.lower_keys, lower)
+        while end > 0 and self.max_upper[end - 1] >= upper:
+            end -= 1
+            if self.upper_keys[end] >= upper:
+                yield self.positions[end]
+
+
+def _remove_subsumed(conjunctions):
+    ''' Drop any conjunction contained in another. Conjunctions are indexed by
+    their set of constrained attributes: a conjunction can only be contained
+    in one which constrains a subset of its attributes, so only those index
+    entries are checked (each through an _IntervalIndex). '''
+    groups = collections.defaultdict(list)
+    for position, conjunction in enumerate(conjunctions):
+        groups[(frozenset(conjunction.specs), conjunction.others)].append(position)
+    index = [
+        (attributes, others, _IntervalIndex(conjunctions, positions))
+        for (attributes, others), positions in groups.items()]
+    removed = set()
+    for position, conjunction in enumerate(conjunctions):
+        attributes = frozenset(conjunction.specs)
+        for candidate_attributes, candidate_others, candidates in index:
+            if not (candidate_attributes.issubset(attributes) and
+                    candidate_others.issubset(conjunction.others)):
+                continue
+            if any(
+                    other != position and other not in removed and
+                    _subsumes(conjunctions[other], conjunction)
+                    for other in candidates.candidates(conjunction)):
+                removed.add(position)
+                break
+    return [cj for position, cj in enumerate(conjunctions) if position not in removed]
+
+
+def simplify_flat_or(expression, types=None):
+    ''' Remove redundancy between the clauses of an Or expression, where each
+    clause is an output of simplify_flat_and (flat And or simple expression).
+
+        - Clauses contained in another clause are removed (absorption).
+        - Clauses which differ only in their constraint on one attribute are
+        merged where the union is a single constraint (overlapping or
+        adjacent intervals, In sets).
+
+    Output is logically equivalent to the input, and disjoint clauses remain
+    disjoint. Clauses which are not changed are returned as given. Optional
+    :types are used to merge consecutive ranges of discrete attributes.
+    '''
+    assert type(expression) is Or
+    if any(clause is True for clause in expression.clauses):
+        return True
+    conjunctions = [
+        _Conjunction.from_expression(clause)
+        for clause in expression.clauses if clause is not False]
+    attributes = list(collections.OrderedDict.fromkeys(
+        attribute for cj in conjunctions for attribute in cj.specs))
+    while True:
+        count = len(conjunctions)
+        for attribute in attributes:
+            conjunctions = _merge_on_attribute(
+                conjunctions, attribute, None if types is None else types.get(attribute))
+        if len(conjunctions) == count:
+            break
+    conjunctions = _remove_subsumed(conjunctions)
+    clauses = [cj.to_expression() for cj in conjunctions]
+    if any(clause is True for clause in clauses):
+        return True
+    if len(clauses) == 0:
+        return False
+    if len(clauses) == 1:
+        return clauses[0]
+    return Or(clauses)
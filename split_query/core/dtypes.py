@@ -0,0 +1,106 @@
+''' Optional type declarations for attributes. By default the domain
+simplifier treats values as points on a continuous ordered domain, so it
+cannot know that (x > 3) & (x < 4) is empty for an integer attribute.
+Declaring types as a dictionary keyed by attribute allows the simplifier to
+tighten bounds and recognise complete valuesets:
+
+    types = {
+        Attribute('count'): Integer(), Attribute('day'): Date(),
+        Attribute('sensor'): Categorical(['a', 'b', 'c'])}
+    to_dnf_simplified(expression, types=types)
+
+'''
+
+import collections
+import datetime
+import math
+
+from .expressions import Ge, Le
+
+
+class DiscreteType(object):
+    ''' Base class for attribute types whose values lie on a regular grid.
+    Subclasses implement floor (the greatest grid value <= value) and set
+    step (the distance between grid values). '''
+
+    step = None
+
+    def floor(self, value):
+        raise NotImplementedError()
+
+    def is_valid(self, value):
+        ''' Return whether :value can occur for an attribute of this type. '''
+        return self.floor(value) == value
+
+    def tighten_lower(self, bound):
+        ''' Return an equivalent Ge bound on a grid value for a Ge/Gt bound. '''
+        floor = self.floor(bound.value)
+        if floor == bound.value and type(bound) is Ge:
+            return bound
+        return Ge(bound.attribute, floor + self.step)
+
+    def tighten_upper(self, bound):
+        ''' Return an equivalent Le bound on a grid value for a Le/Lt bound. '''
+        floor = self.floor(bound.value)
+        if floor == bound.value:
+            return bound if type(bound) is Le else Le(bound.attribute, floor - self.step)
+        return Le(bound.attribute, floor)
+
+    def __eq__(self, other):
+        return type(self) == type(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.__class__.__name__)
+
+    def __repr__(self):
+        return '{}()'.format(self.__class__.__name__)
+
+
+class Integer(DiscreteType):
+    ''' Attribute taking integer values. '''
+
+    step = 1
+
+    def floor(self, value):
+        return int(math.floor(value))
+
+
+class Date(DiscreteType):
+    ''' Attribute taking date values, given as dates or datetimes at midnight
+    (tz-aware datetimes are floored in their own timezone). '''
+
+    step = datetime.timedelta(days=1)
+
+    def floor(self, value):
+        if isinstance(value, datetime.datetime):
+            value = value.replace(hour=0, minute=0, second=0, microsecond=0)
+            if hasattr(value, 'nanosecond'):
+                # pandas Timestamp
+                value = value.replace(nanosecond=0)
+        return value
+
+
+class Categorical(object):
+    ''' Attribute taking values from a known, finite domain. In sets which
+    cover the whole domain are redundant, and NotIn sets can be rewritten as
+    (smaller) In sets of the remaining values. Declared order of values is
+    kept when building sets from the domain. '''
+
+    def __init__(self, values):
+        self.values = tuple(collections.OrderedDict.fromkeys(values))
+        self.valueset = frozenset(self.values)
+
+    def __eq__(self, other):
+        return isinstance(other, Categorical) and self.valueset == other.valueset
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(('categorical', self.valueset))
+
+    def __repr__(self):
+        return 'Categorical({})'.format(repr(list(self.values)))
@@ -1,13 +1,90 @@
 
 import itertools
 
-from .domain import simplify_flat_and
+from .domain import simplify_flat_and, simplify_flat_or
 from .expressions import And, Not, Or
 from .logic import *
 
 # Issue: heuristic returns overlapping partials?
 
-def to_dnf_simplified(expression, use_truth_table=False):
+
+def _simplify_conjunction(clauses, types=None):
+    ''' Domain simplify a conjunction of simple expressions. Returns a tuple
+    of simple expressions (empty if the conjunction is True) or False. '''
+    result = simplify_flat_and(And(clauses), types=types)
+    if result is False:
+        return False
+    if result is True:
+        return ()
+    return result.clauses if type(result) is And else (result, )
+
+
+def _unique(clauses):
+    ''' Drop repeated conjunctions (ignoring order), keeping the first. '''
+    seen = set()
+    result = []
+    for clause in clauses:
+        key = frozenset(clause)
+        if key not in seen:
+            seen.add(key)
+            result.append(clause)
+    return result
+
+
+def _expand_distributive(expression, types=None):
+    ''' Recursive step of to_dnf_expand_distributive. Input must be in
+    negation normal form. Returns a list of simplified conjunctions (tuples
+    of simple expressions), where an empty tuple is a True conjunction. '''
+    if expression is True:
+        return [()]
+    if expression is False:
+        return []
+    if type(expression) is Or:
+        result = []
+        for clause in expression.clauses:
+            expanded = _expand_distributive(clause, types)
+            if () in expanded:
+                return [()]
+            result.extend(expanded)
+        return _unique(result)
+    if type(expression) is And:
+        result = [()]
+        for clause in expression.clauses:
+            expanded = _expand_distributive(clause, types)
+            # Simplify each product as it is formed, so conflicting
+            # combinations are dropped before they can multiply further.
+            result = _unique(
+                conjunction for conjunction in (
+                    _simplify_conjunction(left + right, types)
+                    for left, right in itertools.product(result, expanded))
+                if conjunction is not False)
+            if len(result) == 0:
+                return []
+        return result
+    conjunction = _simplify_conjunction((expression, ), types)
+    return [] if conjunction is False else [conjunction]
+
+
+def to_dnf_expand_distributive(expression, types=None):
+    ''' Convert any expression to DNF by pushing negations to the leaves then
+    distributing And over Or recursively. Each conjunction is domain
+    simplified as it is built, so the expansion is pruned at every level
+    instead of enumerating every truth assignment. Clauses of the result are
+    not guaranteed to be disjoint (see to_dnf_expand_truth_table). '''
+    clauses = _expand_distributive(push_negation(simplify_tree(expression)), types)
+    return simplify_tree(Or(
+        And(clause) if len(clause) != 1 else clause[0]
+        for clause in clauses))
+
+
+def _prune_clauses(expression, types=None):
+    ''' Remove subsumed clauses and merge adjacent clauses of a DNF result. '''
+    if type(expression) is Or:
+        return simplify_flat_or(expression, types=types)
+    return expression
+
+
+def to_dnf_simplified(expression, use_truth_table=False, types=None):
     if use_truth_table:
         # Force full expansion (for independent blocks).
         dnf = to_dnf_expand_truth_table(expression)
@@ -15,17 +92,12 @@ def to_dnf_simplified(expression, use_truth_table=False):
         expression = simplify_tree(expression)
         if is_simple(expression):
             # Really just needs normalisation.
-            return simplify_flat_and(And([expression]))
+            return simplify_flat_and(And([expression]), types=types)
         elif is_flat_and(expression):
-            return simplify_flat_and(expression)
-        elif is_dnf(expression):
-            dnf = expression
+            return simplify_flat_and(expression, types=types)
         else:
-            try:
-                dnf = to_dnf_expand_heuristic(expression)
-            except:
-                # Fallback to the slow way.
-                dnf = to_dnf_expand_truth_table(expression)
-    return simplify_tree(Or(
-        simplify_flat_and(clause) if type(clause) is And else clause
-        for clause in dnf.clauses))
+            # Conjunctions are already simplified by the expansion.
+            return _prune_clauses(to_dnf_expand_distributive(expression, types), types)
+    return _prune_clauses(simplify_tree(Or(
+        simplify_flat_and(clause, types=types) if type(clause) is And else clause
+        for clause in dnf.clauses)), types)
@@ -1,6 +1,10 @@
 ''' Library of immutable objects used to describe the content of a query. '''
 
 from builtins import super
+import datetime
+
+import numpy as np
+import pandas as pd
 
 
 class Expression(object):
@@ -24,12 +28,26 @@ class Attribute(Expression):
         return hash(self.name)
 
 
+def normalise_value(value):
+    ''' Datetime values (datetime.datetime, numpy.datetime64) are held as
+    pandas Timestamps: int64 nanoseconds, with the timezone (if any) kept.
+    Comparisons in the simplifier and engine then work on integers, and
+    equal instants compare and hash equal however they were given. '''
+    if isinstance(value, (datetime.datetime, np.datetime64)) and type(value) is not pd.Timestamp:
+        try:
+            return pd.Timestamp(value)
+        except (OverflowError, ValueError):
+            # Not representable as a Timestamp; kept as given.
+            pass
+    return value
+
+
 class ConditionalRelation(Expression):
     ''' Class representing a condition on values in the data. '''
 
     def __init__(self, attribute, value):
         self.attribute = attribute
-        self.value = value
+        self.value = normalise_value(value)
 
     def __repr__(self):
         return '{}({},{})'.format(
@@ -75,7 +93,7 @@ class In(ConditionalRelation):
     ''' Binary expression: attribute is in [values]. '''
 
     def __init__(self, attribute, valueset):
-        super().__init__(attribute, tuple(valueset))
+        super().__init__(attribute, tuple(normalise_value(value) for value in valueset))
 
     @property
     def valueset(self):
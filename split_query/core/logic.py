@@ -42,6 +42,31 @@ def simplify_tree(expression):
     return expression
 
 
+def push_negation(expression):
+    ''' Apply De Morgan's laws to move every Not relation down to the leaves
+    of the tree (negation normal form). Double negations cancel, and negated
+    boolean literals are resolved. Negated relations are left as Not(relation)
+    for the domain simplifier to normalise. '''
+    if isinstance(expression, Not):
+        clause = expression.clause
+        if isinstance(clause, Not):
+            return push_negation(clause.clause)
+        if isinstance(clause, And):
+            return Or(push_negation(Not(cl)) for cl in clause.clauses)
+        if isinstance(clause, Or):
+            return And(push_negation(Not(cl)) for cl in clause.clauses)
+        if clause is True:
+            return False
+        if clause is False:
+            return True
+        return expression
+    if isinstance(expression, And):
+        return And(push_negation(cl) for cl in expression.clauses)
+    if isinstance(expression, Or):
+        return Or(push_negation(cl) for cl in expression.clauses)
+    return expression
+
+
 def get_variables(expression):
     ''' Extracts objects which are linked in the expression by And, Or,
     Not relations. '''
@@ -1,9 +1,15 @@
 ''' Serialisation hooks, compatible with msgpack and json. Converts expressions
-based on frozenset and frozendict classes into lists and dicts. '''
+based on frozenset and frozendict classes into lists and dicts. Datetimes are
+written as integer nanoseconds (UTC for tz-aware values) with the timezone
+name or offset, or as ISO strings if out of range for int64 nanoseconds
+(the format used for all datetimes by earlier versions). '''
 
 import datetime
+import numbers
 
 import iso8601
+import pandas as pd
+import pytz
 
 from .expressions import (
     Attribute, And, Or, Not,
@@ -26,10 +32,38 @@ def default(obj):
     if isinstance(obj, Not):
         return dict(expr='not', clause=obj.clause)
     if isinstance(obj, datetime.datetime):
-        return {'dt': True, 'data': obj.isoformat(), 'naive': obj.tzinfo is None}
+        try:
+            return {'ts': int(pd.Timestamp(obj).value), 'tz': _zone(obj.tzinfo)}
+        except (OverflowError, ValueError):
+            # Outside the range of int64 nanoseconds, or a zone which can't
+            # be stored by name or fixed offset.
+            return {'dt': True, 'data': obj.isoformat(), 'naive': obj.tzinfo is None}
     return obj
 
 
+def _zone(tzinfo):
+    ''' Timezone name, or fixed UTC offset in minutes, or None if naive.
+    Raises ValueError for other zones (e.g. dateutil tzfiles). '''
+    if tzinfo is None:
+        return None
+    name = getattr(tzinfo, 'zone', None) or getattr(tzinfo, 'key', None)
+    if name is not None:
+        return name
+    offset = tzinfo.utcoffset(None)
+    if offset is None:
+        raise ValueError('No name or fixed offset for zone {}'.format(repr(tzinfo)))
+    return int(offset.total_seconds() // 60)
+
+
+def _timestamp(value, zone):
+    timestamp = pd.Timestamp(value)
+    if zone is None:
+        return timestamp
+    if isinstance(zone, numbers.Integral):
+        zone = pytz.FixedOffset(zone)
+    return timestamp.tz_localize('UTC').tz_convert(zone)
+
+
 def object_hook(obj):
     ''' Dictionary representations converted to expression objects where possible. '''
     if 'expr' in obj:
@@ -53,6 +87,8 @@ def object_hook(obj):
             return Or(obj['clauses'])
         if obj['expr'] == 'not':
             return Not(obj['clause'])
+    if 'ts' in obj and 'tz' in obj and len(obj) == 2:
+        return _timestamp(obj['ts'], obj['tz'])
     if 'dt' in obj and obj['dt'] is True:
         parsed = iso8601.parse_date(obj['data'])
         return parsed.replace(tzinfo=None) if obj['naive'] else parsed
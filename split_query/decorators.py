@@ -4,73 +4,228 @@ import os
 
 import appdirs
 
-from .cache import minimal_cache_inmemory, minimal_cache_persistent
+from .cache import MinimalCache, minimal_cache_inmemory, minimal_cache_persistent
+from .core import Attribute
 from .interface import DataSet
-from .extract import split_parameters
-
-
-def cache_inmemory():
+from .engine import query_df
+from .extract import batch_parameters, split_parameters
+
+
+def _bind_cache(cache):
+    ''' Switch a ParameterWrapper remote to cache-aware mode, so buckets
+    already held by the cache are not fetched again. '''
+    if isinstance(cache.remote, ParameterWrapper):
+        cache.remote.cache = cache.cache
+        cache.remote.flights = cache.flights
+    return cache
+
+
+def cache_inmemory(sort_key=None, categorical=None, result_bytes=None, prefetch=None):
+    ''' Cache in memory. Optional :sort_key is a column cached data is sorted
+    on, for faster range filters on it. :categorical columns (e.g. tags) are
+    dictionary encoded as pandas categoricals. :result_bytes sets the size of
+    a cache of assembled results (see cache.ResultCache). :prefetch is a
+    function returning a prefetch policy (see prefetch), called for each
+    cache instance. '''
     def _decorator(cls):
         @functools.wraps(cls)
         def _decorated(*args, **kwargs):
-            return minimal_cache_inmemory(cls(*args, **kwargs))
+            return _bind_cache(minimal_cache_inmemory(
+                cls(*args, **kwargs), sort_key=sort_key, categorical=categorical,
+                result_bytes=result_bytes, prefetch=None if prefetch is None else prefetch()))
         return _decorated
     return _decorator
 
 
-def cache_persistent(store_name):
+def cache_persistent(store_name, write_behind=False, sort_key=None, categorical=None,
+                     result_bytes=None, prefetch=None, data_format='table'):
+    ''' Cache in the user data directory under :store_name. With
+    :write_behind, disk writes happen on a background thread. Data is
+    written in hdf5 :data_format; the default 'table' format lets selected
+    columns be read alone (entries written before in 'fixed' format are
+    read whole). Optional
+    :sort_key is a column cached data is sorted on, :categorical columns
+    are stored as codes of a store-wide dictionary, :result_bytes sets the
+    size of an in-memory cache of assembled results, and :prefetch returns
+    a prefetch policy for each cache instance. '''
     base_name = 'split-query'
     location = appdirs.user_data_dir(os.path.join(base_name, store_name))
     def _decorator(cls):
         @functools.wraps(cls)
         def _decorated(*args, **kwargs):
-            return minimal_cache_persistent(
-                cls(*args, **kwargs), location, protocol=2)
+            return _bind_cache(minimal_cache_persistent(
+                cls(*args, **kwargs), location, protocol=2, data_format=data_format,
+                write_behind=write_behind, sort_key=sort_key, categorical=categorical,
+                result_bytes=result_bytes, prefetch=None if prefetch is None else prefetch()))
         return _decorated
     return _decorator
 
 
-def dataset(name, attributes):
+def dataset(name, attributes, types=None):
+    ''' Wraps a backend class in a DataSet. Optional :types maps attribute
+    names to declared types (core.dtypes), which are passed on to a cache
+    backend for use in simplification. '''
     def _decorator(cls):
         @functools.wraps(cls)
         def _decorated(*args, **kwargs):
             backend = cls(*args, **kwargs)
             description = cls.__doc__.strip()
-            return DataSet(name, attributes, backend, description=description)
+            if types is not None and isinstance(backend, MinimalCache):
+                backend.types = {Attribute(attr): dtype for attr, dtype in types.items()}
+            return DataSet(name, attributes, backend, description=description, types=types)
         return _decorated
     return _decorator
 
 
-def tag_parameter(attr, key=None, single=False):
+def tag_parameter(attr, key=None, single=False, domain=None, max_tags=None):
+    ''' Optional :domain lists every value the tag can take. It is used to
+    simplify remote queries, and to extract all values where the tag is not
+    filtered. If the remote accepts a set of values (single=False), :max_tags
+    limits the number of values per call and data is cached per value. '''
     key = (key or attr) if single else key + '_values'
-    return dict(type='tag', attr=attr, key=key, single=single)
+    params = dict(type='tag', attr=attr, key=key, single=single)
+    if domain is not None:
+        params.update(domain=list(domain))
+    if max_tags is not None:
+        if single:
+            raise ValueError('max_tags requires a remote accepting multiple tags (single=False).')
+        params.update(max_tags=max_tags)
+    return params
 
 
-def range_parameter(attr, key_lower=None, key_upper=None, round_down=None, offset=None):
+def range_parameter(attr, key_lower=None, key_upper=None, round_down=None, offset=None,
+                    max_span=None):
+    ''' Optional :round_down and :offset split ranges into buckets, which are
+    cached individually. If given, :max_span is the largest range (upper -
+    lower) the remote accepts in one call, and contiguous buckets are merged
+    into calls up to that span. '''
     params = dict(
         type='range', attr=attr,
         key_lower=key_lower or attr + '_lower',
         key_upper=key_upper or attr + '_upper')
     if round_down is not None:
         params.update(round_down=round_down, offset=offset)
+    if max_span is not None:
+        if round_down is None:
+            raise ValueError('max_span requires round_down and offset.')
+        params.update(max_span=max_span)
     return params
 
 
-class ParameterWrapper(object):
+def columns_parameter(key='columns'):
+    ''' Declares that the remote accepts a list of columns to return, passed
+    as keyword :key. Columns needed to split the result by the other
+    parameters are always requested. '''
+    return dict(type='columns', key=key)
 
-    def __init__(self, obj, parameters):
-        self.obj = obj
-        self.parameters = parameters
 
-    def get(self, expression):
-        for subquery, kwargs in split_parameters(expression, self.parameters):
-            yield subquery, self.obj.get(**kwargs)
-
-
-def remote_parameters(*parameters):
+class ParameterWrapper(object):
+    ''' Remote which splits expressions into parameterised calls to the get
+    method of :obj. Calls are batched where the parameters allow, and the
+    result of each call is split back into the fine-grained subqueries so
+    they are cached separately. If :cache is given (cache-aware mode),
+    subqueries which are already keys of the cache are not requested again;
+    they are returned with None in place of data so the cache reuses its
+    existing entry. With the cache's in-flight registry :flights (see
+    cache.SingleFlight), each subquery is claimed before it is requested, so
+    concurrent queries sharing a bucket request it once: the others wait and
+    reuse the entry (or request it themselves if that fetch failed). If
+    :transport is given (see transport.Transport), calls run concurrently
+    with retries, and the subqueries of successful calls are returned even
+    if another call fails. '''
+
+    def __init__(self, obj, parameters, cache=None, transport=None, flights=None):
+        self.obj = obj
+        self.parameters = [param for param in parameters if param['type'] != 'columns']
+        self.columns_key = next((
+            param['key'] for param in parameters if param['type'] == 'columns'), None)
+        self.cache = cache
+        self.transport = transport
+        self.flights = flights
+
+    def get(self, expression, columns=None):
+        ''' Yields (subquery, data) pairs. Optional :columns is passed to the
+        remote if it accepts a column list (see columns_parameter). '''
+        if columns is not None and self.columns_key is not None:
+            columns = list(columns)
+            columns = columns + sorted(
+                set(param['attr'] for param in self.parameters).difference(columns))
+        else:
+            columns = None
+        results = list(split_parameters(expression, self.parameters))
+        while results:
+            claims, waits = dict(), []
+            if self.cache is not None:
+                if self.flights is not None:
+                    claims, waits = self._claim(results)
+                # Checked after claiming, so buckets written by fetches which
+                # completed before the claim are seen.
+                cached = set(self.cache.keys())
+                missing = []
+                for subquery, kwargs in results:
+                    if subquery in cached:
+                        self._release(claims, subquery)
+                        yield subquery, None
+                    elif self.flights is None or subquery in claims:
+                        missing.append((subquery, kwargs))
+                results = missing
+            try:
+                for subquery, data in self._fetch(results, columns):
+                    yield subquery, data
+                    self._release(claims, subquery)
+            finally:
+                for subquery in list(claims):
+                    self._release(claims, subquery)
+            # Subqueries fetched by other queries: reuse them once written, or
+            # request them if the other fetch failed.
+            results = []
+            for (subquery, kwargs), flight in waits:
+                flight.wait()
+                results.append((subquery, kwargs))
+
+    def _claim(self, results):
+        ''' Claim :results in the in-flight registry. Returns (own flights
+        by subquery, [((subquery, kwargs), flight)] in flight elsewhere). '''
+        own, waits = self.flights.claim_buckets([subquery for subquery, _ in results])
+        claims = {flight.expression: flight for flight in own}
+        waiting = {flight.expression: flight for flight in waits}
+        return claims, [
+            (result, waiting[result[0]]) for result in results if result[0] in waiting]
+
+    def _release(self, claims, subquery):
+        if subquery in claims:
+            self.flights.release_bucket(claims.pop(subquery))
+
+    def _fetch(self, results, columns):
+        ''' Yields (subquery, data) from batched calls for :results. '''
+        calls = []
+        for kwargs, subqueries in batch_parameters(results, self.parameters):
+            if columns is not None:
+                kwargs = dict(kwargs)
+                kwargs[self.columns_key] = columns
+            calls.append((subqueries, kwargs))
+        if self.transport is None:
+            responses = ((subqueries, self.obj.get(**kwargs)) for subqueries, kwargs in calls)
+        else:
+            responses = self.transport.map(self.obj.get, calls)
+        for subqueries, data in responses:
+            if len(subqueries) == 1:
+                yield subqueries[0][0], data
+            else:
+                for subquery, _ in subqueries:
+                    yield subquery, query_df(data, subquery)
+
+
+def remote_parameters(*parameters, **kwargs):
+    ''' Wraps a class whose get method takes the given :parameters as
+    keyword arguments (see ParameterWrapper). Optional keyword transport
+    runs the calls through a transport.Transport. '''
+    transport = kwargs.pop('transport', None)
+    if kwargs:
+        raise TypeError('Unexpected arguments: {}'.format(', '.join(kwargs)))
     def _decorator(cls):
         @functools.wraps(cls)
         def wrapped(*args, **kwargs):
-            return ParameterWrapper(cls(*args, **kwargs), parameters)
+            return ParameterWrapper(cls(*args, **kwargs), parameters, transport=transport)
         return wrapped
     return _decorator
@@ -1,9 +1,75 @@
 
 import functools
+import operator
 
+import numpy as np
 import pandas as pd
 
 from .core import And, Eq, Ge, Gt, In, Le, Lt, Not, Or
+from .core.logic import get_variables
+from .estimate import column_sketch
+from .instrument import span
+
+
+def is_categorical(series):
+    return isinstance(series.dtype, pd.api.types.CategoricalDtype)
+
+
+def _map_categorical(series, query):
+    ''' Evaluate a relation on a categorical column: the relation is applied
+    to the (small) set of categories, then rows are matched on integer codes
+    instead of comparing values. '''
+    categories = pd.DataFrame({query.attribute.name: series.cat.categories})
+    matched = np.flatnonzero(map_query_df(categories, query).values)
+    return pd.Series(np.isin(series.cat.codes.values, matched), index=series.index)
+
+
+_OPERATORS = {Eq: operator.eq, Le: operator.le, Lt: operator.lt, Ge: operator.ge, Gt: operator.gt}
+_NAT = np.iinfo(np.int64).min
+
+
+def _datetime_codes(series, values):
+    ''' int64 views of a datetime64 column and of Timestamp :values in the
+    column's resolution (UTC for tz-aware columns), or None if the values
+    can't be compared this way (mixed naive/tz-aware, or not exactly
+    representable in the column's resolution). '''
+    if series.dtype.kind != 'M':
+        return None
+    aware = getattr(series.dtype, 'tz', None) is not None
+    column = np.asarray(series.values)
+    unit = np.datetime_data(column.dtype)[0]
+    codes = []
+    for value in values:
+        if not isinstance(value, pd.Timestamp) or value is pd.NaT:
+            return None
+        if (value.tzinfo is not None) != aware:
+            return None
+        try:
+            nanoseconds = int(value.value)
+        except (OverflowError, ValueError):
+            return None
+        code = np.datetime64(nanoseconds, 'ns').astype('M8[{}]'.format(unit))
+        if code.astype('M8[ns]').astype(np.int64) != nanoseconds:
+            return None
+        codes.append(int(code.astype(np.int64)))
+    return column.view(np.int64), codes
+
+
+def _map_datetime(series, query):
+    ''' Evaluate a relation on a datetime64 column as an integer comparison,
+    or return None if the generic comparison must be used. '''
+    values = query.valueset if isinstance(query, In) else (query.value, )
+    result = _datetime_codes(series, values)
+    if result is None:
+        return None
+    column, codes = result
+    if isinstance(query, In):
+        matched = np.isin(column, codes)
+    else:
+        matched = _OPERATORS[type(query)](column, codes[0])
+        if isinstance(query, (Le, Lt)):
+            matched &= column != _NAT
+    return pd.Series(matched, index=series.index)
 
 
 def map_query_df(df, query):
@@ -11,6 +77,14 @@ def map_query_df(df, query):
     Returns an index on the dataframe. '''
     if isinstance(query, bool):
         return pd.Series(index=df.index, data=query)
+    if (isinstance(query, (Eq, Le, Ge, Lt, Gt, In)) and
+            is_categorical(df[query.attribute.name])):
+        return _map_categorical(df[query.attribute.name], query)
+    if (isinstance(query, (Eq, Le, Ge, Lt, Gt, In)) and
+            df[query.attribute.name].dtype.kind == 'M'):
+        result = _map_datetime(df[query.attribute.name], query)
+        if result is not None:
+            return result
     if isinstance(query, Eq):
         return df[query.attribute.name] == query.value
     if isinstance(query, Le):
@@ -36,6 +110,252 @@ def map_query_df(df, query):
     raise ValueError('Unhandled expression in map_query_df')
 
 
-def query_df(df, query):
-    ''' Use index from map_query_df to return filtered dataframe. '''
-    return df[map_query_df(df, query)]
+def filter_columns(query):
+    ''' Names of the columns needed to evaluate :query. '''
+    return {variable.attribute.name for variable in get_variables(query)}
+
+
+def required_columns(query, columns):
+    ''' Columns which must be read to return :columns of the rows matching
+    :query (output columns first, in order, then filter columns). None if all
+    columns are required. '''
+    if columns is None:
+        return None
+    columns = list(columns)
+    return columns + sorted(filter_columns(query).difference(columns))
+
+
+def range_hull(query, name):
+    ''' Returns (lower, upper) bounds on column :name implied by :query (None
+    where unbounded): any row matching :query lies within the bounds. '''
+    if query is False:
+        return None, None
+    if isinstance(query, (Eq, Le, Lt, Ge, Gt, In)) and query.attribute.name == name:
+        if isinstance(query, Eq):
+            return query.value, query.value
+        if isinstance(query, (Le, Lt)):
+            return None, query.value
+        if isinstance(query, (Ge, Gt)):
+            return query.value, None
+        return min(query.valueset), max(query.valueset)
+    if isinstance(query, And):
+        lower, upper = None, None
+        for clause in query.clauses:
+            clause_lower, clause_upper = range_hull(clause, name)
+            if clause_lower is not None and (lower is None or clause_lower > lower):
+                lower = clause_lower
+            if clause_upper is not None and (upper is None or clause_upper < upper):
+                upper = clause_upper
+        return lower, upper
+    if isinstance(query, Or):
+        hulls = [range_hull(clause, name) for clause in query.clauses]
+        lowers = [lower for lower, _ in hulls]
+        uppers = [upper for _, upper in hulls]
+        return (
+            None if None in lowers else min(lowers),
+            None if None in uppers else max(uppers))
+    return None, None
+
+
+def _sorted_slice(df, query, sort_key):
+    ''' Slice of :df (sorted on column :sort_key) containing all rows which
+    may match :query, found by binary search. '''
+    try:
+        lower, upper = range_hull(query, sort_key)
+        column = df[sort_key]
+        start = 0 if lower is None else column.searchsorted(lower, side='left')
+        stop = len(df) if upper is None else column.searchsorted(upper, side='right')
+    except (TypeError, ValueError, KeyError):
+        # Values not comparable with the column: scan everything.
+        return df
+    return df.iloc[start:max(start, stop)]
+
+
+def query_df(df, query, columns=None, sort_key=None):
+    ''' Use index from map_query_df to return filtered dataframe. Optional
+    :columns projects the result (filter columns need not be included). If
+    :df is sorted on column :sort_key, range clauses on that column are used
+    to slice the dataframe before filtering (an O(log n) search instead of
+    comparing every row). '''
+    with span('filter'):
+        if sort_key is not None and query is not False and len(df) > 0:
+            df = _sorted_slice(df, query, sort_key)
+        if columns is None:
+            return df[map_query_df(df, query)]
+        return df.loc[map_query_df(df, query), list(columns)]
+
+
+def concat_results(chunks):
+    ''' Concatenate result chunks. Categorical columns whose categories
+    extend each other (an append-only dictionary, as used by the caches) are
+    kept categorical, with the longest set of categories. '''
+    chunks = list(chunks)
+    categories = dict()
+    for chunk in chunks:
+        for name in chunk.columns:
+            if is_categorical(chunk[name]):
+                current = chunk[name].cat.categories
+                if len(current) > len(categories.get(name, [])):
+                    categories[name] = current
+    aligned = []
+    for chunk in chunks:
+        updates = {
+            name: chunk[name].cat.set_categories(values)
+            for name, values in categories.items()
+            if name in chunk.columns and is_categorical(chunk[name]) and
+            len(chunk[name].cat.categories) < len(values)}
+        aligned.append(chunk.assign(**updates) if updates else chunk)
+    return pd.concat(aligned)
+
+
+# Aggregates which can be computed per partition and combined: each output
+# function maps to the partial aggregates it is computed from, and each
+# partial aggregate to the function which combines partials.
+_PARTIALS = {
+    'count': ('count', ), 'sum': ('sum', ), 'min': ('min', ), 'max': ('max', ),
+    'mean': ('sum', 'count')}
+_COMBINE = {'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'}
+
+
+def normalise_aggregates(spec):
+    ''' Normalise a pandas-style aggregation :spec (dict mapping columns to a
+    function name or list of names) to a tuple of (column, function) pairs. '''
+    result = []
+    for column in sorted(spec):
+        functions = spec[column]
+        if not isinstance(functions, (list, tuple)):
+            functions = [functions]
+        for function in functions:
+            if function not in _PARTIALS:
+                raise ValueError('Unsupported aggregate: {}'.format(function))
+            result.append((column, function))
+    return tuple(result)
+
+
+def partial_aggregate(df, spec, by=None):
+    ''' Compute partial aggregates of :df for the normalised :spec, as a
+    dataframe with (column, partial) columns and one row per group of :by
+    (a single row if :by is None). Partials of separate partitions can be
+    combined with combine_aggregates. '''
+    partials = sorted(set(
+        (column, partial) for column, function in spec
+        for partial in _PARTIALS[function]))
+    if by is None:
+        return pd.DataFrame(
+            {key: [getattr(df[key[0]], key[1])()] for key in partials},
+            columns=pd.MultiIndex.from_tuples(partials))
+    grouped = df.groupby(by)
+    return pd.DataFrame(
+        {key: getattr(grouped[key[0]], key[1])() for key in partials},
+        columns=pd.MultiIndex.from_tuples(partials))
+
+
+def combine_aggregates(partials, spec, by=None):
+    ''' Combine partial aggregates computed by partial_aggregate. Returns a
+    series indexed by (column, function) if :by is None, otherwise a
+    dataframe indexed by group with (column, function) columns. '''
+    partials = pd.concat(partials)
+    if by is None:
+        partials.index = [0] * len(partials)
+    levels = list(range(partials.index.nlevels))
+    combined = pd.DataFrame(
+        {key: getattr(partials[key].groupby(level=levels), _COMBINE[key[1]])()
+         for key in partials.columns},
+        columns=partials.columns)
+    result = pd.DataFrame(
+        {(column, function): (
+            combined[(column, 'sum')] / combined[(column, 'count')]
+            if function == 'mean' else combined[(column, function)])
+         for column, function in spec},
+        columns=pd.MultiIndex.from_tuples(spec))
+    if by is None:
+        return result.iloc[0]
+    return result
+
+
+def aggregate(df, spec, by=None):
+    ''' Aggregate a single dataframe (same output as combine_aggregates). '''
+    spec = normalise_aggregates(spec)
+    return combine_aggregates([partial_aggregate(df, spec, by)], spec, by)
+
+
+def partition_statistics(df, max_distinct=20):
+    ''' Summary of a dataframe used to skip it when planning queries: the
+    number of rows and, per column, the number of nulls, whether the column
+    is sorted, min/max (for orderable columns), the set of distinct values (if there are at most
+    :max_distinct) and a sketch for estimation (see estimate). '''
+    columns = dict()
+    for name in df.columns:
+        column = df[name]
+        if is_categorical(column):
+            # Summarise values, not category codes.
+            column = column.astype(object)
+        series = column.dropna()
+        stats = dict(nulls=len(df) - len(series))
+        try:
+            stats.update(sorted=bool(column.is_monotonic_increasing))
+        except TypeError:
+            stats.update(sorted=False)
+        if len(series) > 0:
+            try:
+                stats.update(min=series.min(), max=series.max())
+            except TypeError:
+                pass
+        try:
+            values = series.unique()
+        except TypeError:
+            values = None
+        if values is not None and len(values) <= max_distinct:
+            stats.update(values=frozenset(values))
+        stats.update(sketch=column_sketch(series, max_distinct=max_distinct))
+        columns[name] = stats
+    return dict(rows=len(df), columns=columns)
+
+
+def _relation_may_match(stats, name, relation):
+    ''' Evaluate a (possibly negated) relation on column :name against the
+    column :stats. Distinct values are checked exactly using the engine;
+    otherwise only min/max bounds are used, which can't exclude negations. '''
+    if 'values' in stats:
+        values = list(stats['values']) + ([None] if stats['nulls'] > 0 else [])
+        return len(query_df(pd.DataFrame({name: values}), relation)) > 0
+    if isinstance(relation, Not) or 'min' not in stats:
+        return True
+    low, high = stats['min'], stats['max']
+    if isinstance(relation, Eq):
+        return low <= relation.value <= high
+    if isinstance(relation, Le):
+        return low <= relation.value
+    if isinstance(relation, Lt):
+        return low < relation.value
+    if isinstance(relation, Ge):
+        return high >= relation.value
+    if isinstance(relation, Gt):
+        return high > relation.value
+    if isinstance(relation, In):
+        return any(low <= value <= high for value in relation.valueset)
+    return True
+
+
+def may_match(statistics, query):
+    ''' Returns False if no rows of a dataframe summarised by :statistics
+    (see partition_statistics) can match :query. True means rows may match;
+    unknown columns or incomparable values are never ruled out. '''
+    if statistics['rows'] == 0 or query is False:
+        return False
+    if query is True:
+        return True
+    if isinstance(query, And):
+        return all(may_match(statistics, clause) for clause in query.clauses)
+    if isinstance(query, Or):
+        return any(may_match(statistics, clause) for clause in query.clauses)
+    relation = query.clause if isinstance(query, Not) else query
+    if isinstance(relation, (And, Or, Not)):
+        return True
+    name = relation.attribute.name
+    if name not in statistics['columns']:
+        return True
+    try:
+        return bool(_relation_may_match(statistics['columns'][name], name, query))
+    except TypeError:
+        return True
@@ -0,0 +1,237 @@
+''' Cardinality estimation from sketches of cached data. Each cache entry keeps
+a sketch of every column (see column_sketch, recorded with the entry
+statistics when data enters the cache):
+
+    counts: exact value counts, if there are few distinct values.
+    quantiles: equi-depth histogram boundaries, for orderable columns.
+    hll: HyperLogLog registers estimating the number of distinct values.
+
+estimate_fraction gives the fraction of an entry's records matching an
+expression, assuming independent attributes. Expressions are converted to
+DNF: disjoint clauses (from a truth table expansion, used for expressions
+with few variables) are summed, otherwise overlapping clauses are combined
+as independent events.
+'''
+
+import bisect
+import datetime
+import numbers
+
+import numpy as np
+import pandas as pd
+
+from .core import And, Ge, Gt, In, Le, Lt, Not, Or, to_dnf_simplified
+from .core.logic import get_variables
+
+# Selectivity used for range relations on columns without a histogram.
+DEFAULT_RANGE_SELECTIVITY = 1.0 / 3
+# Expressions with at most this many distinct relations are expanded to
+# disjoint clauses using a truth table.
+MAX_TRUTH_TABLE_VARIABLES = 8
+
+
+class HyperLogLog(object):
+    ''' Distinct value counter using 2 ** :precision registers. '''
+
+    def __init__(self, precision=8, registers=None):
+        self.precision = precision
+        if registers is None:
+            registers = np.zeros(2 ** precision, dtype=np.uint8)
+        self.registers = registers
+
+    @classmethod
+    def from_series(cls, series, precision=8):
+        sketch = cls(precision)
+        if len(series) == 0:
+            return sketch
+        hashes = pd.util.hash_pandas_object(series, index=False).values
+        index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+        rest = hashes << np.uint64(precision)
+        # Position of the leading 1 bit of the remaining hash bits.
+        with np.errstate(divide='ignore'):
+            leading = 63 - np.floor(np.log2(rest.astype(np.float64)))
+        rank = np.where(rest == 0, 64 - precision, np.clip(leading, 0, 64 - precision)) + 1
+        np.maximum.at(sketch.registers, index, rank.astype(np.uint8))
+        return sketch
+
+    def count(self):
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size ** 2 / np.sum(2.0 ** -self.registers.astype(np.float64))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * size and zeros > 0:
+            # Small range correction (linear counting).
+            estimate = size * np.log(float(size) / zeros)
+        return float(estimate)
+
+
+def column_sketch(series, buckets=16, max_distinct=20):
+    ''' Sketch of a column for estimation (see module docstring). Nulls are
+    excluded; :series is assumed to be non-null values. '''
+    sketch = dict(hll=HyperLogLog.from_series(series))
+    try:
+        counts = series.value_counts()
+    except TypeError:
+        counts = None
+    if counts is not None and len(counts) <= max_distinct:
+        sketch['counts'] = dict(counts.items())
+    if len(series) > 0:
+        try:
+            ordered = series.sort_values()
+        except TypeError:
+            ordered = None
+        if ordered is not None:
+            positions = np.round(np.linspace(0, len(ordered) - 1, buckets + 1)).astype(int)
+            sketch['quantiles'] = ordered.iloc[positions].tolist()
+    return sketch
+
+
+def _position(value):
+    ''' Numeric position of a value for interpolation within a histogram
+    bucket, or None if values of this type can't be interpolated. '''
+    if isinstance(value, (datetime.datetime, datetime.date, np.datetime64)):
+        return float(pd.Timestamp(value).value)
+    if isinstance(value, (numbers.Number, np.number)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+def _cdf(quantiles, value, inclusive):
+    ''' Estimated fraction of values <= :value (< if not :inclusive) from
+    equi-depth histogram boundaries. '''
+    buckets = len(quantiles) - 1
+    if buckets == 0:
+        below = value >= quantiles[0] if inclusive else value > quantiles[0]
+        return 1.0 if below else 0.0
+    low = bisect.bisect_left(quantiles, value)
+    high = bisect.bisect_right(quantiles, value)
+    if low != high:
+        # Value is a bucket boundary.
+        return float(high - 1 if inclusive else max(low - 1, 0)) / buckets
+    if low == 0:
+        return 0.0
+    if low > buckets:
+        return 1.0
+    lower, upper = _position(quantiles[low - 1]), _position(quantiles[low])
+    position = _position(value)
+    if None in (lower, upper, position) or upper == lower:
+        within = 0.5
+    else:
+        within = (position - lower) / (upper - lower)
+    return (low - 1 + within) / buckets
+
+
+class _Constraint(object):
+    ''' Constraints of a DNF conjunction on a single attribute. '''
+
+    def __init__(self):
+        self.lower = None
+        self.upper = None
+        self.values = None
+        self.excluded = set()
+
+    def add(self, relation):
+        if isinstance(relation, Not):
+            clause = relation.clause
+            self.excluded.update(clause.valueset if isinstance(clause, In) else [clause.value])
+        elif isinstance(relation, (Ge, Gt)):
+            self.lower = relation
+        elif isinstance(relation, (Le, Lt)):
+            self.upper = relation
+        else:
+            valueset = relation.valueset if isinstance(relation, In) else {relation.value}
+            self.values = set(valueset) if self.values is None else self.values & set(valueset)
+
+    def within_bounds(self, value):
+        if self.lower is not None:
+            if value < self.lower.value or (type(self.lower) is Gt and value == self.lower.value):
+                return False
+        if self.upper is not None:
+            if value > self.upper.value or (type(self.upper) is Lt and value == self.upper.value):
+                return False
+        return True
+
+
+def _point_fraction(stats, value, nonnull):
+    ''' Estimated fraction of all rows equal to :value. '''
+    sketch = stats.get('sketch', dict())
+    if 'counts' in sketch:
+        return float(sketch['counts'].get(value, 0)) / stats['total']
+    if 'values' in stats and value not in stats['values']:
+        return 0.0
+    distinct = sketch['hll'].count() if 'hll' in sketch else 0
+    return nonnull / max(distinct, 1.0)
+
+
+def _constraint_fraction(stats, constraint):
+    ''' Estimated fraction of all rows satisfying an attribute constraint. '''
+    nonnull = 1.0 - float(stats['nulls']) / stats['total'] if stats['total'] else 0.0
+    if constraint.values is not None:
+        return min(nonnull, sum(
+            _point_fraction(stats, value, nonnull) for value in constraint.values
+            if value not in constraint.excluded and constraint.within_bounds(value)))
+    sketch = stats.get('sketch', dict())
+    if 'counts' in sketch:
+        fraction = float(sum(
+            count for value, count in sketch['counts'].items()
+            if value not in constraint.excluded and constraint.within_bounds(value))
+            ) / stats['total']
+        return fraction
+    if constraint.lower is None and constraint.upper is None:
+        fraction = nonnull
+    elif 'quantiles' in sketch:
+        quantiles = sketch['quantiles']
+        upper = 1.0 if constraint.upper is None else _cdf(
+            quantiles, constraint.upper.value, type(constraint.upper) is Le)
+        lower = 0.0 if constraint.lower is None else _cdf(
+            quantiles, constraint.lower.value, type(constraint.lower) is Gt)
+        fraction = nonnull * max(upper - lower, 0.0)
+    else:
+        fraction = nonnull * DEFAULT_RANGE_SELECTIVITY
+    excluded = sum(
+        _point_fraction(stats, value, nonnull) for value in constraint.excluded
+        if constraint.within_bounds(value))
+    return max(fraction - excluded, 0.0)
+
+
+def _conjunction_fraction(statistics, conjunction):
+    clauses = conjunction.clauses if isinstance(conjunction, And) else [conjunction]
+    constraints = dict()
+    for relation in clauses:
+        attribute = (relation.clause if isinstance(relation, Not) else relation).attribute
+        constraints.setdefault(attribute.name, _Constraint()).add(relation)
+    fraction = 1.0
+    for name, constraint in constraints.items():
+        if name not in statistics['columns']:
+            continue
+        stats = dict(statistics['columns'][name], total=statistics['rows'])
+        try:
+            fraction *= _constraint_fraction(stats, constraint)
+        except TypeError:
+            # Incomparable values: no estimate for this attribute.
+            pass
+    return fraction
+
+
+def estimate_fraction(statistics, expression, types=None):
+    ''' Estimated fraction of the records of a cache entry, summarised by
+    :statistics (see engine.partition_statistics), which match :expression. '''
+    if statistics['rows'] == 0:
+        return 0.0
+    disjoint = len(get_variables(expression)) <= MAX_TRUTH_TABLE_VARIABLES
+    dnf = to_dnf_simplified(expression, use_truth_table=disjoint, types=types)
+    if dnf is True or dnf is False:
+        return float(dnf)
+    clauses = dnf.clauses if isinstance(dnf, Or) else [dnf]
+    fractions = [_conjunction_fraction(statistics, clause) for clause in clauses]
+    if disjoint:
+        return min(sum(fractions), 1.0)
+    remaining = 1.0
+    for fraction in fractions:
+        remaining *= 1.0 - min(fraction, 1.0)
+    return 1.0 - remaining
+
+
+def estimate_count(statistics, expression, types=None):
+    ''' Estimated number of records of a cache entry matching :expression. '''
+    return statistics['rows'] * estimate_fraction(statistics, expression, types=types)
@@ -1,7 +1,9 @@
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from itertools import product, chain
-from .core import And, Or, Not, In, Eq, Le, Lt, Ge, Gt, to_dnf_simplified, simplify_tree
+from .core import (
+    And, Or, Not, In, Eq, Le, Lt, Ge, Gt, Attribute, Categorical,
+    to_dnf_simplified, simplify_tree)
 
 
 def extract_parameters(expression, parameters):
@@ -20,6 +22,13 @@ def extract_parameters(expression, parameters):
         - dict(attr='x', type='tag', key='xtag', single=True)
         Separates the values of the In clause to a separate result for each
         value, with the key 'xtag'.
+        - dict(attr='x', type='tag', key='xtags', single=False, max_tags=n)
+        As for single=False, but separates the values into a result for each
+        value (passed as a one element set). See batch_parameters.
+        - dict(attr='x', type='tag', ..., domain=[v1, v2, ...])
+        Tag with a known domain of values. If x is not constrained by the
+        expression, every value in the domain is extracted. A negated set is
+        replaced by the remaining values of the domain.
         - dict(attr='y', type='range', key_lower='from_y', key_upper='to_y')
         Extract bounds from Ge/Gt/Le/Lt expressions, pass with given keys.
 
@@ -28,12 +37,14 @@ def extract_parameters(expression, parameters):
     if len(parameters) == 0:
         raise ValueError('At least one parameter must be specified.')
 
-    if isinstance(expression, And):
-        attribute_mapping = defaultdict(list)
-        for clause in expression.clauses:
+    attribute_mapping = defaultdict(list)
+    for clause in (expression.clauses if isinstance(expression, And) else [expression]):
+        if clause is True:
+            continue
+        if isinstance(clause, Not):
+            attribute_mapping[clause.clause.attribute.name].append(clause)
+        else:
             attribute_mapping[clause.attribute.name].append(clause)
-    elif any(isinstance(expression, t) for t in [In, Eq, Le, Lt, Ge, Gt]):
-        attribute_mapping = {expression.attribute.name: [expression]}
 
     results = None
 
@@ -41,14 +52,25 @@ def extract_parameters(expression, parameters):
         clauses = attribute_mapping[parameter['attr']]
 
         if parameter['type'] == 'tag':
+            domain = parameter.get('domain')
+            if len(clauses) == 0 and domain is not None:
+                clauses = [In(Attribute(parameter['attr']), domain)]
             assert len(clauses) == 1
             clause = next(iter(clauses))
+            if isinstance(clause, Not) and domain is not None:
+                negated = clause.clause
+                excluded = set(negated.valueset if type(negated) is In else [negated.value])
+                clause = In(negated.attribute, [v for v in domain if v not in excluded])
             assert type(clause) in (In, Eq)
             valueset = clause.valueset if type(clause) is In else [clause.value]
             if parameter['single']:
                 new_results = [
                     ([In(clause.attribute, [value])], {parameter['key']: value})
                     for value in valueset]
+            elif parameter.get('max_tags') is not None:
+                new_results = [
+                    ([In(clause.attribute, [value])], {parameter['key']: {value}})
+                    for value in valueset]
             else:
                 new_results = [([In(clause.attribute, valueset)], {parameter['key']: set(valueset)})]
 
@@ -96,21 +118,34 @@ def extract_parameters(expression, parameters):
         for clauses, kwargs in results]
 
 
-def split_parameters(expression, parameters):
+def parameter_types(parameters):
+    ''' Attribute types implied by the parameters (tags with a domain). '''
+    return {
+        Attribute(param['attr']): Categorical(param['domain'])
+        for param in parameters if param.get('domain') is not None}
+
+
+def split_parameters(expression, parameters, types=None):
     ''' Adds some wrapping around extract_parameters to trim unnecessary
-    filters and expand to DNF form. '''
+    filters and expand to DNF form. Optional :types are used in simplifying,
+    along with any domains given for tag parameters. '''
 
     # Retain only filters which affect the given parameters.
     attributes = [param['attr'] for param in parameters]
 
     # Break query into subqueries for extract_parameters.
-    expanded = to_dnf_simplified(expression, use_truth_table=True)
-    if isinstance(expanded, And):
-        subqueries = [expanded]
-    elif isinstance(expanded, Or):
+    types = dict(types or {})
+    types.update(parameter_types(parameters))
+    expanded = to_dnf_simplified(expression, use_truth_table=True, types=types)
+    if isinstance(expanded, Or):
         subqueries = list(expanded.clauses)
-    else:
+    elif expanded is False:
+        subqueries = []
+    elif expanded is True and not all(
+            param.get('domain') is not None for param in parameters):
         raise ValueError('Expression may be too broad.')
+    else:
+        subqueries = [expanded]
 
     # Creates a generator broken down into DNF clause subqueries, then by
     # parameter settings. Should be no overlap, since DNF gives disjoint
@@ -118,3 +153,84 @@ def split_parameters(expression, parameters):
     return chain(*(
         extract_parameters(subquery, parameters)
         for subquery in subqueries))
+
+
+def _freeze(value):
+    return frozenset(value) if isinstance(value, (set, frozenset)) else value
+
+
+def _group_batches(batches, keys):
+    ''' Group batches by the kwargs other than :keys. '''
+    groups = OrderedDict()
+    for batch in batches:
+        kwargs = batch[0]
+        group_key = tuple(sorted(
+            (key, _freeze(value)) for key, value in kwargs.items() if key not in keys))
+        groups.setdefault(group_key, []).append(batch)
+    return groups.values()
+
+
+def _merge_range_batches(batches, parameter):
+    ''' Merge batches with contiguous ranges while the span stays within the
+    max_span of the parameter. '''
+    key_lower, key_upper = parameter['key_lower'], parameter['key_upper']
+    result = []
+    for kwargs, buckets in sorted(batches, key=lambda batch: batch[0][key_lower]):
+        if len(result) > 0:
+            last_kwargs, last_buckets = result[-1]
+            if (last_kwargs[key_upper] == kwargs[key_lower] and
+                    kwargs[key_upper] - last_kwargs[key_lower] <= parameter['max_span']):
+                result[-1] = (
+                    dict(last_kwargs, **{key_upper: kwargs[key_upper]}),
+                    last_buckets + buckets)
+                continue
+        result.append((kwargs, buckets))
+    return result
+
+
+def _merge_tag_batches(batches, parameter):
+    ''' Merge batches into sets of at most max_tags values. '''
+    key = parameter['key']
+    result = []
+    for kwargs, buckets in batches:
+        if len(result) > 0:
+            last_kwargs, last_buckets = result[-1]
+            values = set(last_kwargs[key]).union(kwargs[key])
+            if len(values) <= parameter['max_tags']:
+                result[-1] = (dict(last_kwargs, **{key: values}), last_buckets + buckets)
+                continue
+        result.append((kwargs, buckets))
+    return result
+
+
+def batch_parameters(results, parameters):
+    ''' Group fine-grained results of split_parameters into as few remote
+    calls as the parameters allow. Declared capabilities:
+
+        - Range parameter with max_span (requires round_down/offset):
+        contiguous buckets are merged while upper - lower <= max_span.
+        - Tag parameter with max_tags (single=False): values are merged into
+        sets of at most max_tags values.
+
+    Batches are merged along one parameter at a time, between batches whose
+    other arguments are identical. Repeated results are removed. Returns a
+    list of (kwargs, results) pairs: the arguments for one remote call and the
+    (subquery, kwargs) results it covers, so data can still be cached against
+    each fine-grained subquery.
+    '''
+    batches = []
+    seen = set()
+    for subquery, kwargs in results:
+        if subquery not in seen:
+            seen.add(subquery)
+            batches.append((kwargs, [(subquery, kwargs)]))
+    for parameter in parameters:
+        if parameter['type'] == 'range' and parameter.get('max_span') is not None:
+            keys, merge = (parameter['key_lower'], parameter['key_upper']), _merge_range_batches
+        elif parameter['type'] == 'tag' and parameter.get('max_tags') is not None:
+            keys, merge = (parameter['key'], ), _merge_tag_batches
+        else:
+            continue
+        batches = list(chain(*(
+            merge(group, parameter) for group in _group_batches(batches, keys))))
+    return batches
@@ -0,0 +1,167 @@
+''' Instrumentation of the query path: timing spans and counters, published to
+pluggable subscribers. With no subscribers, span() returns a shared no-op
+context manager and count() returns immediately, so instrumented code pays
+only for a check of the subscriber list.
+
+    collector = MemoryCollector()
+    subscribe(collector)
+    dataset.get()
+    collector.summary()
+
+Spans: simplify, plan, read (cache store reads), remote (remote calls and
+each remote result), filter (engine query_df), concat.
+Counters: dnf_clauses, cache_hits, cache_misses, cache_skips, remote_entries,
+bytes_read.
+'''
+
+from builtins import super
+import collections
+import logging
+import threading
+import time
+
+_subscribers = []
+
+
+def subscribe(subscriber):
+    ''' Add a subscriber (an object with span and count methods). '''
+    _subscribers.append(subscriber)
+    return subscriber
+
+
+def unsubscribe(subscriber):
+    _subscribers.remove(subscriber)
+
+
+def enabled():
+    ''' True if any subscriber is registered. Use to skip work which is
+    only needed for instrumentation (e.g. measuring data size). '''
+    return len(_subscribers) > 0
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+
+    def __init__(self, name, tags):
+        self.name = name
+        self.tags = tags
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        duration = time.time() - self.start
+        for subscriber in list(_subscribers):
+            subscriber.span(self.name, duration, self.tags)
+        return False
+
+
+def span(name, **tags):
+    ''' Context manager timing the enclosed block as span :name. '''
+    if not _subscribers:
+        return _NULL_SPAN
+    return _Span(name, tags)
+
+
+def count(name, value=1, **tags):
+    ''' Increment counter :name by :value. '''
+    if not _subscribers:
+        return
+    for subscriber in list(_subscribers):
+        subscriber.count(name, value, tags)
+
+
+def timed_iter(name, iterable, **tags):
+    ''' Yield from :iterable, timing each step as span :name (for lazy
+    remote results, where the work happens during iteration). '''
+    if not _subscribers:
+        for item in iterable:
+            yield item
+        return
+    iterator = iter(iterable)
+    while True:
+        with span(name, **tags):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class LoggingSubscriber(object):
+    ''' Logs each span and counter update. '''
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger('split_query.instrument')
+        self.level = level
+
+    def span(self, name, duration, tags):
+        self.logger.log(self.level, 'span %s %.6fs %s', name, duration, tags)
+
+    def count(self, name, value, tags):
+        self.logger.log(self.level, 'count %s +%s %s', name, value, tags)
+
+
+class MemoryCollector(object):
+    ''' Keeps span durations and counter totals in memory. '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.spans = collections.defaultdict(list)
+            self.counters = collections.defaultdict(int)
+
+    def span(self, name, duration, tags):
+        with self.lock:
+            self.spans[name].append(duration)
+
+    def count(self, name, value, tags):
+        with self.lock:
+            self.counters[name] += value
+
+    def summary(self):
+        ''' Dict of span name -> (count, total seconds), and counter totals. '''
+        with self.lock:
+            return dict(
+                spans={name: (len(durations), sum(durations))
+                       for name, durations in self.spans.items()},
+                counters=dict(self.counters))
+
+
+class PrometheusText(MemoryCollector):
+    ''' Collector rendering totals in the Prometheus text exposition format
+    (spans as <prefix>_<name>_seconds summaries, counters as
+    <prefix>_<name>_total). '''
+
+    def __init__(self, prefix='split_query'):
+        self.prefix = prefix
+        super().__init__()
+
+    def render(self):
+        summary = self.summary()
+        lines = []
+        for name, (calls, total) in sorted(summary['spans'].items()):
+            metric = '{}_{}_seconds'.format(self.prefix, name)
+            lines.append('# TYPE {} summary'.format(metric))
+            lines.append('{}_sum {:.6f}'.format(metric, total))
+            lines.append('{}_count {}'.format(metric, calls))
+        for name, value in sorted(summary['counters'].items()):
+            metric = '{}_{}_total'.format(self.prefix, name)
+            lines.append('# TYPE {} counter'.format(metric))
+            lines.append('{} {}'.format(metric, value))
+        return '\n'.join(lines) + '\n'
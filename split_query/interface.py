@@ -5,6 +5,7 @@ as if it is contained in a single dataframe. '''
 from .core.expressions import Attribute, And
 from .core.logic import simplify_tree
 from .core.wrappers import AttributeContainer, ExpressionContainer
+from .engine import aggregate
 
 
 class DataSet(object):
@@ -29,14 +30,54 @@ class DataSet(object):
         # Returns a new DataSet with the additional filter expression Eq(x, 5).
         dataset[dataset.x > 5]
 
+    Retrieving data:
+
+        # Complete result as a dataframe.
+        dataset.get()
+        # Result in chunks, as they are read from cache or remote.
+        for chunk in dataset.iter_get(): ...
+        # Aggregates, computed per partition by capable backends.
+        dataset.count()
+        dataset.agg({'x': ['min', 'max', 'count']}, by='y')
+
+    Column projection:
+
+        # Returns a new DataSet which retrieves only columns x and y.
+        dataset[['x', 'y']]
+        dataset.select('x', 'y')
+
+    Attribute types (optional, see core.dtypes):
+
+        # Declared types are kept by name, for backends which simplify
+        # expressions using them (see decorators.dataset).
+        dataset = DataSet(..., types={'x': Integer()})
+
     '''
 
-    def __init__(self, name, attributes, backend, expr=True, description=None):
+    def __init__(self, name, attributes, backend, expr=True, description=None, types=None,
+                 columns=None):
         self.name = name
         self.attributes = {name: Attribute(name) for name in attributes}
         self.backend = backend
         self.expr = expr
         self.desc = description
+        self.types = dict() if types is None else dict(types)
+        for attr in self.types:
+            if attr not in self.attributes:
+                raise KeyError('Type declared for unknown attribute: {}'.format(attr))
+        self.columns = None if columns is None else list(columns)
+        for attr in self.columns or []:
+            if attr not in self.attributes:
+                raise KeyError('Unknown attribute selected: {}'.format(attr))
+
+    def _copy(self, **kwargs):
+        ''' New DataSet with the same backend, updating the given fields. '''
+        fields = dict(
+            name=self.name, backend=self.backend, attributes=self.attributes.keys(),
+            expr=self.expr, description=self.desc, types=self.types,
+            columns=self.columns)
+        fields.update(kwargs)
+        return self.__class__(**fields)
 
     def __getattr__(self, attr):
         if attr in self.attributes:
@@ -47,15 +88,30 @@ class DataSet(object):
         if isinstance(expr, str) and expr in self.attributes:
             return AttributeContainer(self.attributes[expr])
         if isinstance(expr, ExpressionContainer):
-            return self.__class__(
-                name=self.name, backend=self.backend,
-                attributes=self.attributes.values(),
-                expr=simplify_tree(And([self.expr, expr.wrapped])),
-                description=self.desc)
+            return self._copy(expr=simplify_tree(And([self.expr, expr.wrapped])))
+        if isinstance(expr, list):
+            return self.select(*expr)
         raise KeyError(repr(expr))
 
+    def select(self, *columns):
+        ''' Return a new DataSet which retrieves only the given columns. '''
+        return self._copy(columns=columns)
+
     def __dir__(self):
-        return list(self.attributes.keys()) + ['get']
+        return list(self.attributes.keys()) + ['agg', 'count', 'get', 'iter_get', 'select']
+
+    def _records(self):
+        ''' Record count for display, if the backend knows it (or can
+        estimate it, shown as ~count) without running the query. '''
+        if hasattr(self.backend, 'known_count'):
+            count = self.backend.known_count(self.expr)
+            if count is not None:
+                return count
+        if hasattr(self.backend, 'estimate_count'):
+            count = self.backend.estimate_count(self.expr)
+            if count is not None:
+                return '~{}'.format(count)
+        return 'unknown'
 
     def _repr_html_(self):
         header = (
@@ -63,12 +119,40 @@ class DataSet(object):
             ('' if self.desc is None else '<div>{}</div>'.format(self.desc)) +
             '<br style="line-height: 0px" />' +
             '<div><b>Filter:</b> {}</div>'.format(repr(self.expr)) +
-            '<div><b>Records:</b> {}</div>'.format(-1) +
+            '<div><b>Records:</b> {}</div>'.format(self._records()) +
             '<br style="line-height: 0px" />' +
             '<div>Mock data:</div>')
         return header
         # data = self.backend.mock_data()
         # return header + data._repr_html_()
 
+    def _backend_kwargs(self):
+        ''' Projection is only passed to the backend when it is set. '''
+        return dict() if self.columns is None else dict(columns=self.columns)
+
     def get(self):
-        return self.backend.get(self.expr)
+        return self.backend.get(self.expr, **self._backend_kwargs())
+
+    def agg(self, spec, by=None):
+        ''' Aggregate the filtered data, with :spec and optional group columns
+        :by as for pandas df.groupby(by).agg(spec). Supported functions are
+        count, sum, min, max and mean. Backends which aggregate per partition
+        (see MinimalCache.agg) never assemble the full result. '''
+        if hasattr(self.backend, 'agg'):
+            return self.backend.agg(self.expr, spec, by=by)
+        return aggregate(self.get(), spec, by=by)
+
+    def count(self):
+        ''' Number of records matching the filter. '''
+        if hasattr(self.backend, 'count'):
+            return self.backend.count(self.expr)
+        return len(self.get())
+
+    def iter_get(self):
+        ''' Yield the result as a sequence of dataframes, for backends which
+        can stream partial results (otherwise a single dataframe). '''
+        if hasattr(self.backend, 'iter_get'):
+            for chunk in self.backend.iter_get(self.expr, **self._backend_kwargs()):
+                yield chunk
+        else:
+            yield self.backend.get(self.expr, **self._backend_kwargs())
@@ -0,0 +1,99 @@
+''' Prefetch policies for MinimalCache. A policy is given each completed
+query (observe) and may fill the cache in the background with data it
+expects to be queried next (see MinimalCache.fill).
+
+    cache = minimal_cache_persistent(
+        remote, location, prefetch=SlidingWindowPrefetch(
+            'datetime', round_down=lambda dt: dt.replace(hour=0, minute=0),
+            offset=lambda dt: dt + timedelta(days=1)))
+
+'''
+
+import logging
+import threading
+
+from .core import And, Attribute, Gt, Le, Not, simplify_tree
+from .engine import range_hull
+from . import instrument
+
+
+def _split_window(expression, name):
+    ''' Split a conjunction into (lower, upper) bounds on attribute :name
+    and a tuple of the other clauses. None if :expression is not a
+    conjunction bounding :name on both sides. '''
+    clauses = expression.clauses if isinstance(expression, And) else (expression, )
+    others = []
+    for clause in clauses:
+        relation = clause.clause if isinstance(clause, Not) else clause
+        if isinstance(relation, (And, Not)) or not hasattr(relation, 'attribute'):
+            return None
+        if relation.attribute.name != name:
+            others.append(clause)
+    lower, upper = range_hull(expression, name)
+    if lower is None or upper is None:
+        return None
+    return (lower, upper), tuple(others)
+
+
+class SlidingWindowPrefetch(object):
+    ''' Detects a window on range attribute :name moving forward (both
+    bounds increasing between consecutive queries, other filters unchanged)
+    and fetches the data ahead of it in the background. With :round_down
+    and :offset (as for decorators.range_parameter), the next :buckets
+    buckets after the one containing the upper bound are fetched; otherwise
+    the window is projected forward :buckets steps of its last movement.
+    One prefetch runs at a time; windows observed while one is running are
+    not prefetched. Failed prefetches are logged and dropped. '''
+
+    def __init__(self, name, round_down=None, offset=None, buckets=1):
+        self.name = name
+        self.attribute = Attribute(name)
+        self.round_down = round_down
+        self.offset = offset
+        self.buckets = buckets
+        self.last = None
+        self.lock = threading.Lock()
+        self.worker = None
+
+    def ahead(self, expression):
+        ''' Expression to prefetch after :expression is queried, if the
+        window has moved forward since the last query, else None. '''
+        window = _split_window(simplify_tree(expression), self.name)
+        last, self.last = self.last, window
+        if window is None or last is None:
+            return None
+        (lower, upper), others = window
+        (last_lower, last_upper), last_others = last
+        if others != last_others or not (lower > last_lower and upper > last_upper):
+            return None
+        if self.round_down is not None:
+            end = self.round_down(upper)
+            for _ in range(self.buckets + 1):
+                end = self.offset(end)
+        else:
+            end = upper + (upper - last_upper) * self.buckets
+        return And((Gt(self.attribute, upper), Le(self.attribute, end)) + others)
+
+    def observe(self, cache, expression):
+        ''' Called by :cache after a query; starts a background fill of the
+        data ahead of a moving window. '''
+        with self.lock:
+            ahead = self.ahead(expression)
+            if ahead is None or (self.worker is not None and self.worker.is_alive()):
+                return
+            instrument.count('prefetches')
+            self.worker = threading.Thread(target=self._fill, args=(cache, ahead))
+            self.worker.daemon = True
+            self.worker.start()
+
+    def _fill(self, cache, expression):
+        try:
+            cache.fill(expression)
+        except Exception:
+            logging.exception('Prefetch failed: {}'.format(repr(expression)))
+
+    def wait(self):
+        ''' Block until a running prefetch completes. '''
+        worker = self.worker
+        if worker is not None:
+            worker.join()
@@ -0,0 +1,263 @@
+''' Replay of recorded query traces against cache configurations, using a
+local stand-in for the remote. A trace is a list of events (dicts):
+
+    get: a backend query, with expression, columns and seconds taken.
+    remote: a remote call, with expression, rows, bytes and seconds taken.
+
+Record a trace from a live dataset, then compare caches offline:
+
+    recorder = TraceRecorder()
+    dataset = recorder.record(dataset)
+    ...                                     # dataset.get() calls
+    recorder.save('trace.jsonl')
+
+    remote = SyntheticRemote('datetime', start, timedelta(hours=1),
+                             tags={'sensor': sensors})
+    report = replay(load_trace('trace.jsonl'), {
+        'inmemory': minimal_cache_inmemory,
+        'sorted': lambda remote: minimal_cache_inmemory(remote, sort_key='datetime'),
+    }, remote)
+
+Traces are saved as JSON lines, serialising expressions with core.serialise.
+The stand-in remote does not sleep: its cost is simulated (see
+SyntheticRemote) and added to the measured time of each replayed query.
+'''
+
+import itertools
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from .core import And, Attribute, Ge, In, Lt, default, object_hook
+from .engine import query_df, range_hull
+
+
+def _size(data):
+    return int(data.memory_usage(index=True).sum())
+
+
+class _RecordingBackend(object):
+    ''' Backend wrapper recording get calls to a TraceRecorder. '''
+
+    def __init__(self, backend, recorder):
+        self.backend = backend
+        self.recorder = recorder
+
+    def __getattr__(self, attr):
+        return getattr(self.backend, attr)
+
+    def get(self, expression, columns=None):
+        kwargs = dict() if columns is None else dict(columns=columns)
+        start = time.time()
+        result = self.backend.get(expression, **kwargs)
+        self.recorder.events.append(dict(
+            event='get', expression=expression,
+            columns=None if columns is None else list(columns),
+            seconds=time.time() - start))
+        return result
+
+
+class _RecordingRemote(object):
+    ''' Remote wrapper recording each call (including iteration over a lazy
+    result, which is materialised) to a TraceRecorder. '''
+
+    def __init__(self, remote, recorder):
+        self.remote = remote
+        self.recorder = recorder
+
+    def __getattr__(self, attr):
+        return getattr(self.remote, attr)
+
+    def get(self, expression):
+        start = time.time()
+        result = self.remote.get(expression)
+        if isinstance(result, tuple):
+            result = [result]
+        result = list(result)
+        frames = [data for _, data in result if data is not None]
+        self.recorder.events.append(dict(
+            event='remote', expression=expression,
+            rows=sum(len(data) for data in frames),
+            bytes=sum(_size(data) for data in frames),
+            seconds=time.time() - start))
+        return result
+
+
+class TraceRecorder(object):
+    ''' Records queries and remote calls as trace events. Wrap a dataset's
+    backend with record (or any backend with backend), and optionally the
+    remote behind a cache with remote, to record remote timings. '''
+
+    def __init__(self):
+        self.events = []
+
+    def backend(self, backend):
+        return _RecordingBackend(backend, self)
+
+    def remote(self, remote):
+        return _RecordingRemote(remote, self)
+
+    def record(self, dataset):
+        ''' Return a copy of :dataset whose get calls are recorded. '''
+        return dataset._copy(backend=self.backend(dataset.backend))
+
+    def save(self, path):
+        save_trace(self.events, path)
+
+
+def save_trace(events, path):
+    with open(path, 'w') as outfile:
+        for event in events:
+            outfile.write(json.dumps(event, default=default) + '\n')
+
+
+def load_trace(path):
+    with open(path) as infile:
+        return [json.loads(line, object_hook=object_hook) for line in infile if line.strip()]
+
+
+def fit_remote_cost(events):
+    ''' Least squares fit of (seconds per call, seconds per row) to the
+    remote events of a trace, for use as SyntheticRemote costs. '''
+    remote = [event for event in events if event['event'] == 'remote']
+    if len(remote) == 0:
+        return 0.0, 0.0
+    rows = np.array([event['rows'] for event in remote], dtype=np.float64)
+    seconds = np.array([event['seconds'] for event in remote], dtype=np.float64)
+    if len(remote) == 1 or np.all(rows == rows[0]):
+        return float(seconds.mean()), 0.0
+    matrix = np.vstack([np.ones_like(rows), rows]).T
+    (latency, row_cost), _, _, _ = np.linalg.lstsq(matrix, seconds, rcond=None)
+    return max(float(latency), 0.0), max(float(row_cost), 0.0)
+
+
+def _unit_hash(values, seed):
+    ''' Deterministic floats in [0, 1) from integer :values (splitmix64). '''
+    with np.errstate(over='ignore'):
+        z = values.astype(np.uint64) + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) / float(2 ** 53)
+
+
+class SyntheticRemote(object):
+    ''' Stand-in remote returning deterministic data for any expression
+    which bounds the :key attribute. Records lie on a grid of :key values
+    (:start plus multiples of :step), with one record per combination of
+    :tags values (dict of attribute -> values) at each point, and a seeded
+    random 'value' column. The same record always has the same value, so
+    results do not depend on how queries are split.
+
+    Calls are not delayed; each costs :latency seconds plus :row_cost per
+    row returned, accumulated in the simulated attribute. Counters calls,
+    rows and bytes describe the data returned since the last reset. '''
+
+    def __init__(self, key, start, step, tags=None, seed=0, latency=0.0, row_cost=0.0):
+        self.key = key
+        self.start = start
+        self.step = step
+        self.tags = [(name, list(values)) for name, values in sorted((tags or dict()).items())]
+        self.seed = seed
+        self.latency = latency
+        self.row_cost = row_cost
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.rows = 0
+        self.bytes = 0
+        self.simulated = 0.0
+
+    def _grid(self, lower, upper):
+        ''' Range of grid indices within [lower, upper]. '''
+        first = int(np.ceil((lower - self.start) / self.step))
+        last = int(np.floor((upper - self.start) / self.step))
+        return np.arange(first, last + 1, dtype=np.int64)
+
+    def generate(self, expression):
+        ''' All grid records within the bounds of :expression on the key
+        (not yet filtered by the rest of the expression). '''
+        lower, upper = range_hull(expression, self.key)
+        if lower is None or upper is None:
+            raise ValueError('Synthetic remote requires bounds on {}: {}'.format(
+                self.key, repr(expression)))
+        index = self._grid(lower, upper)
+        combinations = list(itertools.product(*[values for _, values in self.tags]))
+        points = np.repeat(index, len(combinations))
+        combination = np.tile(np.arange(len(combinations)), len(index))
+        columns = {self.key: [self.start + self.step * int(i) for i in points]}
+        for position, (name, _) in enumerate(self.tags):
+            columns[name] = [combinations[c][position] for c in combination]
+        columns['value'] = _unit_hash(points * len(combinations) + combination, self.seed)
+        return pd.DataFrame(columns, columns=[self.key] + [name for name, _ in self.tags] + ['value'])
+
+    def get(self, expression):
+        data = query_df(self.generate(expression), expression).reset_index(drop=True)
+        self.calls += 1
+        self.rows += len(data)
+        self.bytes += _size(data)
+        self.simulated += self.latency + self.row_cost * len(data)
+        return expression, data
+
+
+def sliding_window_trace(key, start, width, step, count, tags=None, active=None, churn=0):
+    ''' Trace of :count queries over a window of :width on :key, moving by
+    :step each time. If :tags (attribute -> values) is given, each query also
+    selects :active of the values of each tag attribute, with :churn values
+    replaced by others in each query (sensors coming and going). '''
+    attribute = Attribute(key)
+    selected = {
+        name: list(values[:active or len(values)])
+        for name, values in (tags or dict()).items()}
+    events = []
+    for i in range(count):
+        lower = start + step * i
+        clauses = [Ge(attribute, lower), Lt(attribute, lower + width)]
+        for name in sorted(selected):
+            clauses.append(In(Attribute(name), selected[name]))
+            values = tags[name]
+            for _ in range(churn):
+                # Drop the oldest selected value, add the next unselected one.
+                remaining = [value for value in values if value not in selected[name]]
+                if not remaining:
+                    break
+                selected[name] = selected[name][1:] + [remaining[i % len(remaining)]]
+        events.append(dict(event='get', expression=And(clauses), columns=None, seconds=None))
+    return events
+
+
+def replay(events, configurations, remote):
+    ''' Replay the get events of a trace against each cache configuration
+    (name -> function of a remote, returning a backend). Returns a dataframe
+    with a row per configuration: queries, hit_ratio (queries answered
+    without a remote call), remote calls, rows and bytes, and percentiles of
+    query latency (measured time plus simulated remote time) in seconds. '''
+    queries = [event for event in events if event['event'] == 'get']
+    report = []
+    for name, factory in configurations.items():
+        remote.reset()
+        backend = factory(remote)
+        latencies = []
+        hits = 0
+        for event in queries:
+            calls, simulated = remote.calls, remote.simulated
+            kwargs = dict() if event.get('columns') is None else dict(columns=event['columns'])
+            start = time.time()
+            backend.get(event['expression'], **kwargs)
+            latencies.append(time.time() - start + remote.simulated - simulated)
+            if remote.calls == calls:
+                hits += 1
+        if hasattr(backend, 'flush'):
+            backend.flush()
+        percentiles = np.percentile(latencies, [50, 90, 99]) if latencies else [np.nan] * 3
+        report.append(dict(
+            configuration=name, queries=len(queries),
+            hit_ratio=float(hits) / len(queries) if queries else np.nan,
+            remote_calls=remote.calls, remote_rows=remote.rows, remote_bytes=remote.bytes,
+            p50=percentiles[0], p90=percentiles[1], p99=percentiles[2]))
+    return pd.DataFrame(report, columns=[
+        'configuration', 'queries', 'hit_ratio', 'remote_calls', 'remote_rows',
+        'remote_bytes', 'p50', 'p90', 'p99']).set_index('configuration')
@@ -0,0 +1,134 @@
+''' Transport layer for remotes making many parameterised calls (see
+decorators.remote_parameters): calls run on a bounded thread pool, each
+retried with jittered exponential backoff, and HTTP requests share a
+keep-alive session pool with a per-request timeout.
+
+    TRANSPORT = Transport(max_workers=4, retries=3, timeout=30)
+
+    @remote_parameters(..., transport=TRANSPORT)
+    class Remote(object):
+        def get(self, **kwargs):
+            return TRANSPORT.get(url, params=kwargs).json()
+
+A call which still fails after its retries does not stop the others: the
+results of every successful call are returned first, so they are cached,
+and the error is raised after them (a later query fetches only the failed
+part). The requests package is only needed for Transport.get.
+'''
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    requests = None
+
+# Errors retried by default: I/O and, if requests is installed, connection,
+# timeout and HTTP status errors (see Transport.get). Others (e.g. a
+# TypeError from bad arguments) are raised at once.
+TRANSIENT_ERRORS = (IOError, OSError)
+if requests is not None:
+    TRANSIENT_ERRORS += (
+        requests.ConnectionError, requests.Timeout, requests.HTTPError)
+
+
+class Transport(object):
+    ''' Runs remote calls with at most :max_workers at a time, retrying each
+    up to :retries times on :retry_on exceptions (by default
+    TRANSIENT_ERRORS; callers may widen it). The delay before retry n
+    (from 0) is uniform on [0, min(:max_backoff, :backoff * 2 ** n)] ("full
+    jitter", so retries of concurrent calls are spread out). :timeout is
+    passed to HTTP requests made through get. Optional :session_factory
+    creates the shared session (by default a requests.Session with a
+    connection pool of :max_workers). '''
+
+    def __init__(self, max_workers=4, retries=3, backoff=0.5, max_backoff=30.0,
+                 timeout=None, retry_on=TRANSIENT_ERRORS, session_factory=None):
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.retry_on = retry_on
+        self.session_factory = session_factory
+        self._session = None
+        self._lock = threading.Lock()
+        # Bounds concurrent calls across all queries using this transport.
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self.sleep = time.sleep
+
+    @property
+    def session(self):
+        ''' Shared keep-alive session, created on first use. '''
+        with self._lock:
+            if self._session is None:
+                self._session = (self.session_factory or self._requests_session)()
+            return self._session
+
+    def _requests_session(self):
+        if requests is None:
+            raise ImportError('Transport.get requires the requests package.')
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get(self, url, **kwargs):
+        ''' HTTP GET through the shared session, with the transport timeout
+        (unless given). Responses with a transient error status (429 or 5xx)
+        raise, so they are retried when made within call; other responses
+        are returned for the caller to check. '''
+        kwargs.setdefault('timeout', self.timeout)
+        response = self.session.get(url, **kwargs)
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
+    def delay(self, attempt):
+        ''' Jittered backoff before retry :attempt. '''
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def call(self, func, *args, **kwargs):
+        ''' Call :func, retrying failures with backoff. '''
+        attempt = 0
+        while True:
+            try:
+                with self._slots:
+                    return func(*args, **kwargs)
+            except self.retry_on as e:
+                if attempt >= self.retries:
+                    raise
+                delay = self.delay(attempt)
+                logging.warning('Remote call failed (%s), retry %d in %.2fs.', e, attempt + 1, delay)
+                self.sleep(delay)
+                attempt += 1
+
+    def map(self, func, calls):
+        ''' Run func(**kwargs) for each (key, kwargs) of :calls concurrently,
+        yielding (key, result) as each call completes. If any call fails
+        after its retries, the first error is raised once every other call
+        has finished and its result has been yielded. '''
+        calls = list(calls)
+        if len(calls) == 0:
+            return
+        errors = []
+        pool = ThreadPoolExecutor(max_workers=min(self.max_workers, len(calls)))
+        try:
+            futures = {
+                pool.submit(self.call, func, **kwargs): key for key, kwargs in calls}
+            for future in as_completed(futures):
+                error = future.exception()
+                if error is not None:
+                    errors.append(error)
+                else:
+                    yield futures[future], future.result()
+        finally:
+            pool.shutdown(wait=True)
+        if errors:
+            raise errors[0]
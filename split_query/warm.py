@@ -0,0 +1,150 @@
+''' Cache warming: fill the cache of a dataset for known query families
+ahead of time (e.g. the last 90 days for all sensors, before business
+hours). Expressions are split into the buckets the remote is called with
+(see decorators.remote_parameters), buckets which are not already cached
+are fetched with bounded parallelism, and progress and the resulting
+coverage are reported.
+
+    report = warm(dataset, [expression, ...], workers=4)
+
+From the command line, with a JSON spec:
+
+    split-query-warm spec.json
+
+    {
+        "dataset": "pedestrians:PedestrianDataset",
+        "workers": 4,
+        "queries": [
+            {"window": {"attribute": "datetime", "days": 90}},
+            {"expression": <expression serialised with core.serialise>}
+        ]
+    }
+
+A window query covers the given number of days up to now, and may be
+combined with a serialised "where" expression (e.g. a sensor filter). The
+dataset is given as module:callable, returning a DataSet (or backend).
+'''
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import datetime
+import importlib
+import json
+import logging
+import sys
+
+from .core import And, Attribute, Ge, Le, object_hook
+from .decorators import ParameterWrapper
+from .extract import split_parameters
+
+
+def _backend(dataset):
+    ''' MinimalCache behind a DataSet (or the backend itself). '''
+    return getattr(dataset, 'backend', dataset)
+
+
+def _buckets(backend, expressions):
+    ''' Subqueries the remote is called with for :expressions (unique, in
+    order), or the expressions themselves if the remote is not split by
+    parameters. '''
+    buckets = []
+    for expression in expressions:
+        if isinstance(backend.remote, ParameterWrapper):
+            buckets.extend(
+                subquery for subquery, _ in
+                split_parameters(expression, backend.remote.parameters, types=backend.types))
+        else:
+            buckets.append(expression)
+    seen = set()
+    return [bucket for bucket in buckets if not (bucket in seen or seen.add(bucket))]
+
+
+def _cached(backend, expression):
+    ''' True if :expression is answered by the cache alone. '''
+    return backend._plan_cache(expression)[1] is False
+
+
+def warm(dataset, expressions, workers=4, progress=None):
+    ''' Fetch every bucket of :expressions which is not already cached,
+    running at most :workers fetches at a time. Optional :progress is called
+    as progress(done, total, bucket, error) after each fetch. Returns a
+    report dict: buckets (total), cached (before warming), fetched, failed
+    (list of (bucket, error)) and coverage (fraction of buckets cached after
+    warming). A failed bucket does not stop the others. '''
+    backend = _backend(dataset)
+    buckets = _buckets(backend, expressions)
+    missing = [bucket for bucket in buckets if not _cached(backend, bucket)]
+    logging.info('Warming %d of %d buckets.', len(missing), len(buckets))
+    failed = []
+    fetched = 0
+    if missing:
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            futures = {pool.submit(backend.fill, bucket): bucket for bucket in missing}
+            for done, future in enumerate(as_completed(futures), 1):
+                bucket, error = futures[future], future.exception()
+                if error is None:
+                    fetched += 1
+                    logging.info('Warmed %d/%d: %r', done, len(missing), bucket)
+                else:
+                    failed.append((bucket, error))
+                    logging.warning('Failed %d/%d: %r (%s)', done, len(missing), bucket, error)
+                if progress is not None:
+                    progress(done, len(missing), bucket, error)
+        finally:
+            pool.shutdown(wait=True)
+    backend.flush()
+    covered = sum(1 for bucket in buckets if _cached(backend, bucket))
+    return dict(
+        buckets=len(buckets), cached=len(buckets) - len(missing), fetched=fetched,
+        failed=failed, coverage=float(covered) / len(buckets) if buckets else 1.0)
+
+
+def parse_spec(spec, now=None):
+    ''' Expressions of the queries in a warming :spec (see module
+    docstring). Windows end at :now (default: the current time). '''
+    now = datetime.datetime.now() if now is None else now
+    expressions = []
+    for query in spec['queries']:
+        query = json.loads(json.dumps(query), object_hook=object_hook)
+        if 'window' in query:
+            window = query['window']
+            attribute = Attribute(window['attribute'])
+            clauses = [
+                Ge(attribute, now - datetime.timedelta(days=window['days'])),
+                Le(attribute, now)]
+            if 'where' in query:
+                clauses.append(query['where'])
+            expressions.append(And(clauses))
+        else:
+            expressions.append(query['expression'])
+    return expressions
+
+
+def load_dataset(path):
+    ''' Create the dataset named module:callable. '''
+    module_name, _, name = path.partition(':')
+    return getattr(importlib.import_module(module_name), name)()
+
+
+def main(argv=None):
+    ''' Command line entry point (split-query-warm). '''
+    parser = argparse.ArgumentParser(description='Fill a dataset cache from a warming spec.')
+    parser.add_argument('spec', help='JSON warming spec')
+    parser.add_argument('--dataset', help='module:callable creating the dataset (overrides spec)')
+    parser.add_argument('--workers', type=int, help='concurrent fetches (overrides spec)')
+    parser.add_argument('--quiet', action='store_true', help='only print the report')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO)
+    with open(args.spec) as infile:
+        spec = json.load(infile)
+    dataset = load_dataset(args.dataset or spec['dataset'])
+    report = warm(
+        dataset, parse_spec(spec), workers=args.workers or spec.get('workers', 4))
+    print('buckets: {buckets}, already cached: {cached}, fetched: {fetched}, '
+          'failed: {0}, coverage: {coverage:.1%}'.format(len(report['failed']), **report))
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
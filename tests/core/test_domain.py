@@ -1,10 +1,14 @@
 
+from datetime import datetime
+
+import pandas as pd
 import pytest
 
 from hypothesis import event, given, strategies as st
 
-from split_query.core import Attribute, And, Not
-from split_query.core.domain import simplify_flat_and
+from split_query.core import Attribute, And, Or, Not, Categorical, Date, Integer
+from split_query.core.domain import simplify_flat_and, simplify_flat_or
+from split_query.engine import map_query_df
 from split_query.core.wrappers import AttributeContainer, ExpressionContainer
 from .strategies import mixed_numeric_relation
 
@@ -97,6 +101,88 @@ def test_simplify_flat_and(expression, simplified):
         assert result == simplified
 
 
+TYPES = {Attribute('x'): Integer(), Attribute('y'): Date()}
+
+TESTCASES_TYPED = [
+    # Open integer ranges containing no integers.
+    ((x > 3) & (x < 4),             False),
+    ((x > 0) & (x < 1) & (y > datetime(2017, 1, 1)), False),
+    # Bounds tightened to integers.
+    ((x > 3) & (x <= 7.5),          (x >= 4) & (x <= 7)),
+    ((x > 3) & (x < 5),             (x == 4)),
+    # Excluded values at the bounds shrink the range.
+    ((x >= 1) & (x <= 5) & ~x.isin([1, 2, 5]), (x >= 3) & (x <= 4)),
+    ((x > 0) & (x < 3) & ~x.isin([1, 2]), False),
+    (x.isin([1, 1.5, 2]) & (x < 9), x.isin([1, 2])),
+    # Dates.
+    (
+        (y > datetime(2017, 1, 1)) & (y < datetime(2017, 1, 2)),
+        False),
+    (
+        (y > datetime(2017, 1, 1, 12)) & (y < datetime(2017, 1, 5)),
+        (y >= datetime(2017, 1, 2)) & (y <= datetime(2017, 1, 4))),
+]
+
+
+@pytest.mark.parametrize('expression, simplified', TESTCASES_TYPED)
+def test_simplify_flat_and_typed(expression, simplified):
+    expression, simplified = _unwrap(expression), _unwrap(simplified)
+    result = simplify_flat_and(expression, types=TYPES)
+    if type(simplified) is And:
+        assert type(result) is And
+        assert set(result.clauses) == set(simplified.clauses)
+    else:
+        assert result == simplified
+    # Untyped simplification never reduces these as far.
+    assert simplify_flat_and(expression) != simplified
+
+
+def test_simplify_flat_or_typed():
+    clauses = [
+        simplify_flat_and(_unwrap((x >= 1) & (x <= 3)), types=TYPES),
+        simplify_flat_and(_unwrap((x > 3) & (x < 7)), types=TYPES)]
+    assert simplify_flat_or(Or(clauses)) == Or(clauses)
+    result = simplify_flat_or(Or(clauses), types=TYPES)
+    assert _clause_set(result) == _clause_set(_unwrap((x >= 1) & (x <= 6)))
+
+
+TYPES_CATEGORICAL = {Attribute('s'): Categorical(['a', 'b', 'c', 'd', 'e'])}
+s = AttributeContainer(Attribute('s'))
+
+TESTCASES_CATEGORICAL = [
+    # Sets covering the whole domain are redundant.
+    (s.isin(list('abcde')) & (x > 1),           (x > 1)),
+    (s.isin(list('abcdez')) & ~(s == 'z'),      True),
+    # Values outside the domain are dropped.
+    (s.isin(list('az')) & (x > 1),              (s == 'a') & (x > 1)),
+    (s.isin(list('yz')) & (x > 1),              False),
+    # Large negated sets rewritten as the small remaining set.
+    (~s.isin(list('abcd')) & (x > 1),           (s == 'e') & (x > 1)),
+    (~s.isin(list('abcdz')) & (x > 1),          (s == 'e') & (x > 1)),
+    (~s.isin(list('abcde')) & (x > 1),          False),
+    # Small negated sets are kept.
+    (~s.isin(list('az')) & (x > 1),             ~(s == 'a') & (x > 1)),
+]
+
+
+@pytest.mark.parametrize('expression, simplified', TESTCASES_CATEGORICAL)
+def test_simplify_flat_and_categorical(expression, simplified):
+    expression, simplified = _unwrap(expression), _unwrap(simplified)
+    result = simplify_flat_and(expression, types=TYPES_CATEGORICAL)
+    if type(simplified) is And:
+        assert type(result) is And
+        assert set(result.clauses) == set(simplified.clauses)
+    else:
+        assert result == simplified
+
+
+def test_simplify_flat_or_categorical():
+    clauses = [
+        _unwrap(s.isin(list('abc')) & (x > 1)),
+        _unwrap(s.isin(list('de')) & (x > 1))]
+    assert simplify_flat_or(Or(clauses), types=TYPES_CATEGORICAL) == _unwrap(x > 1)
+
+
 @given(st.lists(st.one_of(
     mixed_numeric_relation('x'),
     mixed_numeric_relation('x').map(lambda e: Not(e)),
@@ -114,3 +200,86 @@ def test_simplify_flat_and_fuzz(clauses):
     else:
         if n_output < len(clauses):
             event('Shortened')
+
+
+def _unwrap(obj):
+    return obj.wrapped if type(obj) is ExpressionContainer else obj
+
+
+def _clause_set(clause):
+    return frozenset(clause.clauses if type(clause) is And else [clause])
+
+
+TESTCASES_OR = [
+    # Subsumed clause removed.
+    (
+        [(x >= 1) & (x <= 10), (x >= 2) & (x <= 5)],
+        (x >= 1) & (x <= 10)),
+    (
+        [(x >= 1) & (x <= 10) & (y == 1), (x >= 1) & (x <= 10)],
+        (x >= 1) & (x <= 10)),
+    (
+        [x.isin([1, 2]) & (y > 1), (x >= 0) & (x <= 5)],
+        (x >= 0) & (x <= 5)),
+    (
+        [(x > 0) & ~x.isin([1, 2]), (x > 0) & ~(x == 1)],
+        (x > 0) & ~(x == 1)),
+    # Adjacent and overlapping intervals merged.
+    (
+        [(x >= 1) & (x < 3) & (y == 1), (x >= 3) & (x <= 5) & (y == 1)],
+        (x >= 1) & (x <= 5) & (y == 1)),
+    (
+        [(x >= 1) & (x <= 3), (x >= 2) & (x <= 5), (x > 5) & (x < 6)],
+        (x >= 1) & (x < 6)),
+    ([(x < 1), (x >= 1)], True),
+    # Tag sets merged.
+    (
+        [(x == 1) & (y > 2), (x == 2) & (y > 2)],
+        x.isin([1, 2]) & (y > 2)),
+    # No redundancy.
+    (
+        [(x >= 1) & (x < 3), (x > 3) & (x <= 5)],
+        [(x >= 1) & (x < 3), (x > 3) & (x <= 5)]),
+    (
+        [(x >= 1) & (x <= 3) & (y == 1), (x >= 2) & (x <= 5) & (y == 2)],
+        [(x >= 1) & (x <= 3) & (y == 1), (x >= 2) & (x <= 5) & (y == 2)]),
+]
+
+
+@pytest.mark.parametrize('clauses, simplified', TESTCASES_OR)
+def test_simplify_flat_or(clauses, simplified):
+    result = simplify_flat_or(Or(simplify_flat_and(And([_unwrap(cl)])) for cl in clauses))
+    if type(simplified) is list:
+        assert type(result) is Or
+        assert (
+            set(_clause_set(cl) for cl in result.clauses) ==
+            set(_clause_set(_unwrap(cl)) for cl in simplified))
+    else:
+        simplified = _unwrap(simplified)
+        assert _clause_set(result) == _clause_set(simplified)
+
+
+# Half-integer grid so strict and non-strict bounds can be distinguished.
+POINTS = pd.DataFrame(
+    [dict(x=a * 0.5, y=b * 0.5) for a in range(-22, 23) for b in range(-22, 23)])
+
+
+@given(st.lists(
+    st.lists(st.one_of(
+        mixed_numeric_relation('x'),
+        mixed_numeric_relation('x').map(lambda e: Not(e)),
+        mixed_numeric_relation('y'),
+        ), min_size=1, max_size=3),
+    min_size=1, max_size=6))
+def test_simplify_flat_or_fuzz(clause_lists):
+    ''' Pruning never changes which points are selected, and never increases
+    the number of clauses. '''
+    clauses = [simplify_flat_and(And(clauses)) for clauses in clause_lists]
+    expression = Or(clauses)
+    result = simplify_flat_or(expression)
+    n_output = len(result.clauses) if type(result) is Or else 1
+    assert n_output <= len(clauses)
+    assert (
+        map_query_df(POINTS, result) == map_query_df(POINTS, expression)).all()
+    if n_output < len(clauses):
+        event('Shortened')
@@ -0,0 +1,94 @@
+''' Tests for DNF expansion with domain simplification. '''
+
+import itertools
+
+import pytest
+from hypothesis import event, given
+
+from split_query.core import Attribute, And, Or, Not, Le, Lt, Ge, Gt, Eq
+from split_query.core.expand import to_dnf_expand_distributive, to_dnf_simplified
+from split_query.core.logic import is_dnf
+from .strategies import continuous_numeric_relation, expression_trees
+
+x, y = Attribute('x'), Attribute('y')
+
+
+def evaluate(expression, point):
+    ''' Evaluate an expression of numeric relations at a point {name: value}. '''
+    if expression is True or expression is False:
+        return expression
+    if isinstance(expression, And):
+        return all(evaluate(cl, point) for cl in expression.clauses)
+    if isinstance(expression, Or):
+        return any(evaluate(cl, point) for cl in expression.clauses)
+    if isinstance(expression, Not):
+        return not evaluate(expression.clause, point)
+    value = point[expression.attribute.name]
+    if isinstance(expression, Eq):
+        return value == expression.value
+    if isinstance(expression, Le):
+        return value <= expression.value
+    if isinstance(expression, Lt):
+        return value < expression.value
+    if isinstance(expression, Ge):
+        return value >= expression.value
+    if isinstance(expression, Gt):
+        return value > expression.value
+    raise ValueError(expression)
+
+
+# Half-integer grid so strict and non-strict bounds can be distinguished.
+POINTS = [
+    dict(x=a * 0.5, y=b * 0.5)
+    for a, b in itertools.product(range(-22, 23), repeat=2)]
+
+
+TESTCASES = [
+    # Nested negation of a disjunction (De Morgan).
+    (
+        Not(Or([Le(x, 1), Ge(x, 3)])),
+        And([Gt(x, 1), Lt(x, 3)])),
+    # Negated conjunction distributes to a disjunction.
+    (
+        And([Ge(x, 0), Le(x, 3), Not(And([Ge(x, 1), Le(x, 2)]))]),
+        Or([And([Ge(x, 0), Lt(x, 1)]), And([Gt(x, 2), Le(x, 3)])])),
+    # Conflicting branches are pruned during expansion.
+    (
+        And([Or([Le(x, 0), Ge(x, 5)]), Or([Ge(x, 1), Le(x, -1)])]),
+        Or([Le(x, -1), Ge(x, 5)])),
+    (
+        And([Not(Or([Lt(x, 0), Gt(x, 1)])), Not(And([Ge(x, 0), Le(x, 1)]))]),
+        False),
+]
+
+
+def _clause_set(clause):
+    return frozenset(clause.clauses if isinstance(clause, And) else [clause])
+
+
+@pytest.mark.parametrize('expression, expected', TESTCASES)
+def test_to_dnf_expand_distributive(expression, expected):
+    result = to_dnf_expand_distributive(expression)
+    if isinstance(expected, Or):
+        assert isinstance(result, Or)
+        assert (
+            set(_clause_set(cl) for cl in result.clauses) ==
+            set(_clause_set(cl) for cl in expected.clauses))
+    elif isinstance(expected, And):
+        assert set(result.clauses) == set(expected.clauses)
+    else:
+        assert result == expected
+
+
+@given(expression_trees(
+    continuous_numeric_relation('x') | continuous_numeric_relation('y'),
+    max_depth=3, min_width=1, max_width=3))
+def test_to_dnf_simplified_equivalent(expression):
+    ''' Expansion gives a DNF expression which selects the same points as the
+    original expression. '''
+    result = to_dnf_simplified(expression)
+    assert result in (True, False) or is_dnf(result)
+    for point in POINTS:
+        assert evaluate(result, point) == evaluate(expression, point)
+    event('Result: {}'.format(
+        result if result in (True, False) else type(result).__name__))
@@ -1,8 +1,11 @@
 ''' Tests expression object representation and serialisation methods. '''
 
 import itertools
+from datetime import datetime
 
 from hypothesis import given
+import numpy as np
+import pandas as pd
 
 from split_query.core.expressions import Attribute, Le, Lt, Ge, Gt, Eq, In, And, Or, Not
 from .strategies import *
@@ -48,3 +51,16 @@ def test_expressions(expression):
     ''' Ensure any complex nested expression is still hashable. '''
     assert isinstance(hash(expression), int)
     assert isinstance(repr(expression), str)
+
+
+def test_datetime_normalised():
+    ''' Datetime values are held as Timestamps, equal (with equal hashes)
+    however they were given. '''
+    naive = [datetime(2017, 1, 2, 3), np.datetime64('2017-01-02T03:00'),
+             pd.Timestamp('2017-01-02 03:00')]
+    relations = [Le(Attribute('x'), value) for value in naive]
+    assert all(type(relation.value) is pd.Timestamp for relation in relations)
+    assert len(set(relations)) == 1
+    aware = Eq(Attribute('x'), pytz.timezone('Australia/Melbourne').localize(datetime(2017, 1, 2, 14)))
+    assert aware == Eq(Attribute('x'), datetime(2017, 1, 2, 3, tzinfo=pytz.utc))
+    assert In(Attribute('x'), naive).valueset == (pd.Timestamp('2017-01-02 03:00'), ) * 3
@@ -151,3 +151,26 @@ def test_heuristic(expressions):
     s1 = frozenset(frozenset(cl.clauses) for cl in expand_original.clauses)
     s2 = frozenset(frozenset(cl.clauses) for cl in expand_transformed.clauses)
     assert s1 == s2
+
+
+def _only_leaf_negation(expression):
+    if isinstance(expression, Not):
+        return not isinstance(expression.clause, LogicalRelation)
+    if isinstance(expression, And) or isinstance(expression, Or):
+        return all(_only_leaf_negation(cl) for cl in expression.clauses)
+    return True
+
+
+@given(expression_recursive(
+    st.sampled_from(list('abcd')) | st.booleans(), max_leaves=50))
+def test_push_negation(expression):
+    ''' Negations are moved to the leaves without changing the truth value
+    of the expression under any assignment. '''
+    result = push_negation(expression)
+    assert _only_leaf_negation(result)
+    variables = list(get_variables(expression))
+    for values in itertools.product([True, False], repeat=len(variables)):
+        assignments = dict(zip(variables, values))
+        assert (
+            substitution_result(result, assignments) ==
+            substitution_result(expression, assignments))
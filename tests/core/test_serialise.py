@@ -1,8 +1,13 @@
 
+from datetime import datetime
 import json
 
+from dateutil import tz
 from hypothesis import given
+import iso8601
 import msgpack
+import pandas as pd
+import pytest
 
 from split_query.core.serialise import default, object_hook
 from .strategies import *
@@ -37,3 +42,42 @@ def test_expressions(expression):
     unpacked = msgpack.unpackb(
         packed, object_hook=object_hook, encoding='utf-8')
     assert unpacked == expression
+
+
+@pytest.mark.parametrize('value, expected', [
+    (datetime(2017, 1, 2, 3), {'ts': 1483326000000000000, 'tz': None}),
+    (datetime(2017, 1, 2, 3, tzinfo=pytz.utc), {'ts': 1483326000000000000, 'tz': 'UTC'}),
+    (pytz.timezone('Australia/Melbourne').localize(datetime(2017, 1, 2, 14)),
+     {'ts': 1483326000000000000, 'tz': 'Australia/Melbourne'}),
+    (iso8601.parse_date('2017-01-02T08:30:00+05:30'),
+     {'ts': 1483326000000000000, 'tz': 330}),
+    ])
+def test_datetime_json(value, expected):
+    ''' Datetimes are written as integer nanoseconds with a timezone, and
+    read back as equal Timestamps in the same timezone. '''
+    expression = Le(Attribute('dt'), value)
+    strung = json.dumps(expression, default=default)
+    assert json.loads(strung)['value'] == expected
+    unstrung = json.loads(strung, object_hook=object_hook)
+    assert unstrung == expression
+    assert type(unstrung.value) is pd.Timestamp
+    assert unstrung.value.utcoffset() == value.utcoffset()
+
+
+def test_datetime_json_legacy():
+    ''' ISO string format written by earlier versions is still read. '''
+    strung = (
+        '{"expr": "le", "attribute": {"expr": "attr", "name": "dt"}, '
+        '"value": {"dt": true, "data": "2017-01-02T03:00:00", "naive": true}}')
+    assert json.loads(strung, object_hook=object_hook) == Le(Attribute('dt'), datetime(2017, 1, 2, 3))
+
+
+def test_datetime_json_dateutil():
+    ''' Zones without a name or fixed offset are written as ISO strings. '''
+    value = datetime(2017, 1, 2, 14, tzinfo=tz.gettz('Australia/Melbourne'))
+    expression = Ge(Attribute('dt'), value)
+    strung = json.dumps(expression, default=default)
+    assert json.loads(strung)['value']['dt'] is True
+    unstrung = json.loads(strung, object_hook=object_hook)
+    assert unstrung == expression
+    assert unstrung.value.utcoffset() == value.utcoffset()
@@ -10,17 +10,25 @@ be implementation specific).
 This test is implementation specific too: not all caches must be minimal.
 '''
 
+from builtins import super
+import functools
 import itertools
 import os
+import sys
 import tempfile
+import threading
+import time
 
 import mock
 import pandas as pd
 import pytest
 
-from split_query.cache import minimal_cache_inmemory, minimal_cache_persistent
-from split_query.core import And, Or, Not, Le, Lt, Ge, Gt, Attribute
-from split_query.engine import query_df
+from split_query.cache import (
+    BackgroundWriter, CacheFillError, ResultCache, minimal_cache_inmemory, minimal_cache_persistent, simplify)
+from split_query.core import And, Or, Not, Le, Lt, Ge, Gt, In, Attribute, Integer
+from split_query.decorators import (
+    cache_inmemory, cache_persistent, range_parameter, remote_parameters)
+from split_query.engine import normalise_aggregates, query_df
 
 
 # 2D grid source data
@@ -130,3 +138,692 @@ def test_minimal_download(cls, remote_query, sequence):
         true_result = source_query(orig_expr)
         assert sorted(result.point) == sorted(true_result.point)
         remote.get.reset_mock()
+
+
+@pytest.mark.parametrize('cls', [minimal_cache_inmemory, create_persistent])
+def test_minimal_download_typed(cls):
+    ''' With x declared as an integer, the gaps left between cached integer
+    values are recognised as empty, so no remote query is made. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    backend = cls(remote)
+    backend.types = {X: Integer()}
+    for expression in [Le(X, 0), In(X, [1, 2]), Ge(X, 3)]:
+        backend.get(expression)
+        remote.get.assert_called_once_with(expression)
+        remote.get.reset_mock()
+    result = backend.get(True)
+    remote.get.assert_not_called()
+    assert sorted(result.point) == sorted(SOURCE_2D.point)
+
+
+@pytest.mark.parametrize('cls', [minimal_cache_inmemory, create_persistent])
+def test_remote_returns_cached(cls):
+    ''' Remote returning an entry already in the cache (along with new data)
+    should have the existing entry reused rather than rewritten. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (Le(X, 2), source_query(Le(X, 2)))
+    backend = cls(remote)
+    backend.get(Le(X, 1))
+    remote.get.side_effect = remote_iter
+    result = backend.get(Ge(X, 1))
+    assert backend.tracking[-2][0] == 'reuse'
+    assert sorted(result.point) == sorted(source_query(Ge(X, 1)).point)
+    assert len(backend.cache.keys()) == 2
+
+
+@pytest.mark.parametrize('cls', [minimal_cache_inmemory, create_persistent])
+def test_iter_get_streaming(cls):
+    ''' Chunks are yielded (and cached) as the remote produces them, so the
+    first chunk is available before the remote iterator is exhausted. '''
+    progress = []
+    def remote_get(expression):
+        for value in range(5):
+            progress.append(value)
+            bucket = And([Ge(X, value), Lt(X, value + 1)])
+            yield bucket, source_query(bucket)
+        yield Ge(X, 5), source_query(Ge(X, 5))
+    remote = mock.Mock()
+    remote.get.side_effect = remote_get
+    backend = cls(remote)
+    chunks = backend.iter_get(Ge(X, 1))
+    first = next(chunks)
+    assert progress == [0, 1]
+    assert sorted(first.point) == sorted(source_query(And([Ge(X, 1), Lt(X, 2)])).point)
+    rest = list(chunks)
+    assert progress == list(range(5))
+    assert len(rest) == 4
+    # Cached chunks are streamed in plan order, without calling the remote.
+    remote.get.reset_mock()
+    expression = And([Ge(X, 1), Le(X, 2)])
+    chunks = list(backend.iter_get(expression))
+    remote.get.assert_not_called()
+    assert len(chunks) == 2
+    assert sorted(pd.concat(chunks).point) == sorted(source_query(expression).point)
+
+
+def create_write_behind(remote):
+    shelf = tempfile.mktemp()
+    return minimal_cache_persistent(remote, location=shelf, write_behind=True)
+
+
+@pytest.mark.parametrize('remote_query, sequence', TESTCASES_SEQUENCE)
+def test_minimal_download_write_behind(remote_query, sequence):
+    test_minimal_download(create_write_behind, remote_query, sequence)
+
+
+def test_write_behind_persisted():
+    ''' Data written in the background is readable from a new cache object
+    at the same location once flushed, and was not read back from disk to
+    answer the query which fetched it. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    location = tempfile.mktemp()
+    backend = minimal_cache_persistent(remote, location=location, write_behind=True)
+    with mock.patch('pandas.read_hdf') as read_hdf:
+        result = backend.get(Le(X, 2))
+        read_hdf.assert_not_called()
+    assert sorted(result.point) == sorted(source_query(Le(X, 2)).point)
+    backend.flush()
+    reopened = minimal_cache_persistent(remote, location=location)
+    assert list(reopened.cache.keys()) == [Le(X, 2)]
+    assert sorted(reopened.cache[Le(X, 2)].point) == sorted(result.point)
+
+
+class SlowStore(dict):
+    ''' Store whose writes wait for :proceed, or fail while :failing. '''
+
+    def __init__(self):
+        super().__init__()
+        self.started, self.proceed = threading.Event(), threading.Event()
+        self.proceed.set()
+        self.failing = False
+
+    def __setitem__(self, key, value):
+        self.started.set()
+        self.proceed.wait(5)
+        if self.failing:
+            raise IOError('disk full')
+        super().__setitem__(key, value)
+
+
+def test_write_behind_error():
+    ''' A failed background write is raised on flush. The entry stays
+    pending, so its data is still served, and is retried on the next flush.
+    Other writes don't raise it. '''
+    store = SlowStore()
+    store.failing = True
+    writer = BackgroundWriter(store)
+    writer[Le(X, 2)] = source_query(Le(X, 2))
+    with pytest.raises(IOError):
+        writer.flush()
+    assert list(writer.keys()) == [Le(X, 2)]
+    assert len(writer[Le(X, 2)]) == len(source_query(Le(X, 2)))
+    writer[Gt(X, 2)] = source_query(Gt(X, 2))
+    with pytest.raises(IOError):
+        writer.flush()
+    store.failing = False
+    writer.flush()
+    assert set(store) == {Le(X, 2), Gt(X, 2)} and len(writer.pending) == 0
+    # A key queued twice is written once.
+    writer[Le(X, 1)] = source_query(Le(X, 1))
+    writer[Le(X, 1)] = source_query(Le(X, 1))
+    writer.flush()
+    assert Le(X, 1) in store
+    writer.close()
+
+
+def test_write_behind_concurrent_reads():
+    ''' Pending entries, keys and statistics are available while a slow
+    write is in progress; statistics of pending entries are computed once. '''
+    store = SlowStore()
+    store.proceed.clear()
+    writer = BackgroundWriter(store)
+    writer[Le(X, 2)] = source_query(Le(X, 2))
+    store.started.wait(5)
+    writer[Gt(X, 2)] = source_query(Gt(X, 2))
+    with mock.patch('split_query.cache.partition_statistics') as statistics:
+        start = time.time()
+        assert set(writer.keys()) == {Le(X, 2), Gt(X, 2)}
+        assert writer.statistics(Gt(X, 2))['rows'] == len(source_query(Gt(X, 2)))
+        assert len(writer.read(Gt(X, 2), ['point'])) == len(source_query(Gt(X, 2)))
+        assert time.time() - start < 0.5
+        statistics.assert_not_called()
+    store.proceed.set()
+    writer.flush()
+    assert set(store) == {Le(X, 2), Gt(X, 2)}
+
+
+def test_write_behind_close():
+    ''' close completes pending writes and stops the thread; later writes
+    are made in the foreground. An unused writer's thread also stops. '''
+    store = SlowStore()
+    writer = BackgroundWriter(store)
+    writer[Le(X, 2)] = source_query(Le(X, 2))
+    writer.close()
+    assert not writer.worker.is_alive()
+    assert Le(X, 2) in store
+    writer[Gt(X, 2)] = source_query(Gt(X, 2))
+    assert Gt(X, 2) in store and len(writer.pending) == 0
+    writer = BackgroundWriter(store)
+    worker = writer.worker
+    writer[Le(X, 1)] = source_query(Le(X, 1))
+    del writer
+    worker.join(5)
+    assert not worker.is_alive()
+    assert Le(X, 1) in store
+
+
+def create_persistent_table(remote):
+    shelf = tempfile.mktemp()
+    return minimal_cache_persistent(remote, location=shelf, data_format='table')
+
+
+@pytest.mark.parametrize('cls', [
+    minimal_cache_inmemory, create_persistent, create_persistent_table,
+    create_write_behind])
+def test_columns(cls):
+    ''' Projected results; the remote is always asked for whole records. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    backend = cls(remote)
+    for expression in [Le(X, 2), And([Ge(X, 1), Lt(Y, 3)])]:
+        result = backend.get(expression, columns=['point'])
+        assert list(result.columns) == ['point']
+        assert sorted(result.point) == sorted(source_query(expression).point)
+    for call in remote.get.call_args_list:
+        assert call[1] == dict()
+    assert sorted(backend.cache[Le(X, 2)].columns) == ['point', 'x', 'y']
+
+
+def test_columns_table_read():
+    ''' Table format entries are read with only the needed columns. '''
+    location = tempfile.mktemp()
+    store = minimal_cache_persistent(None, location=location, data_format='table').cache
+    store[Le(X, 2)] = source_query(Le(X, 2))
+    assert list(store.read(Le(X, 2), ['point']).columns) == ['point']
+    # Fixed format falls back to reading all data (logged).
+    store = minimal_cache_persistent(None, location=tempfile.mktemp()).cache
+    store[Le(X, 2)] = source_query(Le(X, 2))
+    assert not store.full_reads
+    assert list(store.read(Le(X, 2), ['point']).columns) == ['point']
+    assert store.full_reads
+
+
+def test_columns_decorator_table():
+    ''' Decorated persistent caches are written in table format. '''
+    with mock.patch('appdirs.user_data_dir', return_value=tempfile.mktemp()):
+        @cache_persistent('test')
+        class Remote(object):
+            def get(self, expression):
+                return expression, source_query(expression)
+    backend = Remote()
+    assert backend.cache.data_format == 'table'
+    backend.get(Le(X, 2))
+    with mock.patch('pandas.read_hdf', wraps=pd.read_hdf) as read_hdf:
+        assert list(backend.get(Le(X, 1), columns=['point']).columns) == ['point']
+        assert read_hdf.call_args[1]['columns'] == ['point', 'x']
+    assert not backend.cache.full_reads
+
+
+@pytest.mark.parametrize('cls', [minimal_cache_inmemory, create_persistent])
+def test_aggregates(cls):
+    ''' Aggregates match pandas on the full result. Aggregates of cache
+    entries entirely within a query are computed once. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    backend = cls(remote)
+    backend.get(Le(X, 1))
+    expression = And([Le(X, 3), Ge(Y, 1)])
+    for _ in range(2):
+        result = backend.agg(expression, {'y': ['min', 'max', 'count']}, by='x')
+        expected = source_query(expression).groupby('x').agg({'y': ['min', 'max', 'count']})
+        assert (result.values == expected.values).all()
+        assert backend.count(expression) == len(source_query(expression))
+        assert backend.count(Le(X, 3)) == len(source_query(Le(X, 3)))
+    # Aggregates of the remote entry within the query are kept. Counts of
+    # entries within the query are taken from cache statistics, so counting
+    # reads no data.
+    assert list(backend.aggregates) == [(
+        And([Gt(X, 1), Le(X, 3), Ge(Y, 1)]),
+        (normalise_aggregates({'y': ['min', 'max', 'count']}), ('x', )))]
+    with mock.patch.object(backend, '_read') as read:
+        assert backend.count(Le(X, 3)) == len(source_query(Le(X, 3)))
+        read.assert_not_called()
+
+
+def test_aggregates_bounded():
+    ''' Only the most recently used aggregates of complete entries are kept. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    backend = minimal_cache_inmemory(remote)
+    backend.max_aggregates = 2
+    backend.get(True)
+    for function in ['min', 'max', 'min', 'sum']:
+        result = backend.agg(True, {'y': function})
+        assert result[('y', function)] == source_query(True).y.agg(function)
+    assert [key[1][0] for key in backend.aggregates] == [
+        normalise_aggregates({'y': 'min'}), normalise_aggregates({'y': 'sum'})]
+
+
+def test_aggregates_empty():
+    ''' An empty query gives empty results and aggregates. '''
+    remote = mock.Mock()
+    backend = minimal_cache_inmemory(remote)
+    assert backend.count(False) == 0
+    assert len(backend.get(False, columns=['x'])) == 0
+    result = backend.agg(False, {'y': ['min', 'count']})
+    assert result[('y', 'count')] == 0 and pd.isnull(result[('y', 'min')])
+    assert len(backend.agg(False, {'y': ['min', 'count']}, by='x')) == 0
+    remote.get.assert_not_called()
+
+
+@pytest.mark.parametrize('cls', [minimal_cache_inmemory, create_persistent, create_write_behind])
+def test_statistics_pruning(cls):
+    ''' Cache entries whose statistics rule out matching records are not
+    read. Counts are known without reading data when every entry in the
+    plan is either complete or ruled out. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    backend = cls(remote)
+    backend.get(Le(X, 1))
+    backend.get(Gt(X, 1))
+    assert backend.known_count(True) == 25
+    assert backend.known_count(Le(X, 1)) == 10
+    assert backend.known_count(Le(X, 2)) is None
+    assert backend.known_count(Le(X, 10)) is None
+    # Remote query needed: not known.
+    backend = cls(remote)
+    backend.get(Le(X, 1))
+    assert backend.known_count(Le(X, 2)) is None
+    # Point values are distinct per entry: only Gt(X, 1) can match.
+    backend.get(Gt(X, 1))
+    expression = In(Attribute('point'), ['3:3', '4:4'])
+    with mock.patch.object(backend, '_read', side_effect=backend._read) as read:
+        result = backend.get(expression)
+        assert read.call_count == 1
+        assert read.call_args[0][0] == Gt(X, 1)
+    assert sorted(result.point) == ['3:3', '4:4']
+    assert [step[0] for step in backend.tracking].count('skip') == 1
+    assert backend.count(expression) == 2
+
+
+@pytest.mark.parametrize('cls', [minimal_cache_inmemory, create_persistent])
+def test_statistics_pruning_all(cls):
+    ''' If statistics rule out every entry, the result is empty but keeps
+    the columns of the cached data. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    backend = cls(remote)
+    backend.get(Le(X, 1))
+    backend.get(Gt(X, 1))
+    expression = In(Attribute('point'), ['9:9'])
+    result = backend.get(expression)
+    assert len(result) == 0
+    assert list(result.columns) == list(SOURCE_2D.columns)
+    assert [step[0] for step in backend.tracking].count('skip') == 2
+    assert list(backend.get(expression, columns=['x']).columns) == ['x']
+    assert backend.count(expression) == 0
+    result = backend.agg(expression, {'y': ['min', 'count']})
+    assert result[('y', 'count')] == 0 and pd.isnull(result[('y', 'min')])
+    result = backend.agg(expression, {'y': ['min', 'count']}, by='x')
+    assert len(result) == 0
+    assert list(result.columns) == [('y', 'min'), ('y', 'count')]
+    remote.get.assert_called_with(Gt(X, 1))
+
+
+def test_statistics_persisted():
+    location = tempfile.mktemp()
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    minimal_cache_persistent(remote, location=location).get(Le(X, 1))
+    reopened = minimal_cache_persistent(remote, location=location)
+    assert reopened.known_count(Le(X, 1)) == 10
+    reopened.clear_cache()
+    assert reopened.cache.statistics(Le(X, 1)) is None
+
+
+def test_estimate_count():
+    ''' Estimates use entry statistics: exact for complete entries, and
+    not available if the remote would be needed. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    backend = minimal_cache_inmemory(remote)
+    assert backend.estimate_count(True) is None
+    backend.get(True)
+    assert backend.estimate_count(True) == 25
+    assert backend.estimate_count(Le(X, 4)) == 25
+    assert backend.estimate_count(And([Le(X, 1), Ge(Y, 3)])) == 4
+    remote.get.assert_called_once_with(True)
+    # Estimates of partial entries are kept (e.g. for repeated display).
+    with mock.patch('split_query.cache.estimate_count') as estimate:
+        assert backend.estimate_count(And([Le(X, 1), Ge(Y, 3)])) == 4
+        estimate.assert_not_called()
+
+
+@pytest.mark.parametrize('cls', [minimal_cache_inmemory, create_persistent])
+def test_sort_key(cls):
+    ''' Entries are stored sorted on the sort key; results are unchanged. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr).sort_values('y'))
+    backend = cls(remote)
+    backend.sort_key = 'x'
+    for expression in [Le(X, 2), And([Ge(X, 1), Lt(Y, 3)]), And([Ge(X, 1), Le(X, 3)])]:
+        result = backend.get(expression)
+        assert sorted(result.point) == sorted(source_query(expression).point)
+    for key in backend.cache.keys():
+        assert backend.cache[key].x.is_monotonic_increasing
+        assert backend._sorted_on(key) == 'x'
+
+
+def create_persistent_categorical(remote):
+    return minimal_cache_persistent(
+        remote, location=tempfile.mktemp(), categorical=['point'], data_format='table')
+
+
+@pytest.mark.parametrize('cls', [
+    functools.partial(minimal_cache_inmemory, categorical=['point']),
+    create_persistent_categorical])
+def test_categorical(cls):
+    ''' Categorical columns are encoded with a shared dictionary; results
+    from cached and fresh data have the same categories. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    backend = cls(remote)
+    backend.get(Le(X, 1))
+    expression = And([Ge(X, 1), Le(X, 3)])
+    chunks = list(backend.iter_get(expression))
+    assert len(chunks) == 2
+    # Dictionary is extended by the second (remote) chunk.
+    assert list(chunks[0].point.cat.categories) == list(SOURCE_2D.point[SOURCE_2D.x <= 1])
+    assert list(chunks[1].point.cat.categories) == list(SOURCE_2D.point[SOURCE_2D.x <= 3])
+    result = backend.get(expression)
+    assert result.point.dtype.name == 'category'
+    assert sorted(result.point) == sorted(source_query(expression).point)
+    result = backend.get(In(Attribute('point'), ['1:1', '3:2', '4:4']))
+    assert sorted(result.point) == ['1:1', '3:2', '4:4']
+    assert result.point.dtype.name == 'category'
+
+
+@pytest.mark.parametrize('cls', [
+    functools.partial(minimal_cache_inmemory, categorical=['point']),
+    create_persistent_categorical])
+def test_categorical_concurrent(cls):
+    ''' Concurrent fills adding values give each value its own code. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    backend = cls(remote)
+    queries = [And([Ge(X, x), Lt(X, x + 1), Ge(Y, y), Lt(Y, y + 1)])
+               for x in range(5) for y in range(5)]
+    threads = [threading.Thread(target=backend.fill, args=(query, )) for query in queries]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    values = backend.cache.dictionary.values['point']
+    assert sorted(values) == sorted(SOURCE_2D.point)
+    for query in queries:
+        assert list(backend.cache[query].point.astype(str)) == list(source_query(query).point)
+
+
+def test_categorical_persisted():
+    ''' Codes and dictionary are persisted: a reopened store decodes older
+    entries with the extended dictionary. '''
+    location = tempfile.mktemp()
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    minimal_cache_persistent(remote, location=location, categorical=['point']).get(Le(X, 1))
+    backend = minimal_cache_persistent(remote, location=location, categorical=['point'])
+    backend.get(Gt(X, 3))
+    data = pd.read_hdf(os.path.join(location, backend.cache.local_contents[Gt(X, 3)]))
+    assert data.point.dtype.kind == 'i'
+    reopened = minimal_cache_persistent(remote, location=location, categorical=['point'])
+    result = reopened.get(Or([Le(X, 0), Ge(X, 4)]))
+    assert sorted(result.point.astype(str)) == sorted(source_query(Or([Le(X, 0), Ge(X, 4)])).point)
+    assert len(result.point.cat.categories) == 15
+
+
+@pytest.mark.parametrize('cls', [minimal_cache_inmemory, create_persistent])
+def test_result_cache(cls):
+    ''' Repeated queries (equal after simplification, with the same columns)
+    are answered from the result cache without planning. Writing an
+    overlapping entry invalidates the result. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    backend = cls(remote)
+    backend.results = ResultCache(10 ** 6)
+    first = backend.get(Ge(X, 3))
+    result = backend.get(And([Ge(X, 3), Gt(X, 2)]))
+    assert backend.tracking == [('result', And([Ge(X, 3), Gt(X, 2)]), Ge(X, 3))]
+    assert sorted(result.point) == sorted(first.point)
+    backend.get(Ge(X, 3), columns=['point'])
+    assert backend.tracking[0][0] == 'subset'
+    # Remote returns a widened entry overlapping the cached results.
+    remote.get.side_effect = lambda expr: (True, SOURCE_2D)
+    backend.get(Le(X, 1))
+    result = backend.get(Ge(X, 3))
+    assert backend.tracking[0][0] == 'cache'
+    assert sorted(result.point) == sorted(first.point)
+    backend.clear_cache()
+    assert len(backend.results.entries) == 0
+
+
+def test_result_cache_lru():
+    frame = pd.DataFrame(dict(x=range(100)))
+    size = int(frame.memory_usage(index=True, deep=True).sum())
+    results = ResultCache(size * 2)
+    results.put((Le(X, 1), None), frame)
+    results.put((Le(X, 2), None), frame)
+    assert results.get((Le(X, 1), None)) is not None
+    results.put((Le(X, 3), None), frame)
+    assert set(key for key, _ in results.entries) == {Le(X, 1), Le(X, 3)}
+    assert results.nbytes == size * 2
+    results.put((Le(X, 4), None), pd.concat([frame] * 3))
+    assert results.get((Le(X, 4), None)) is None
+    results.invalidate(Ge(X, 2))
+    assert set(key for key, _ in results.entries) == {Le(X, 1)}
+    assert results.nbytes == size
+
+
+def test_result_cache_threads():
+    ''' Concurrent use (e.g. invalidation by a prefetch thread) keeps the
+    entries and their byte count consistent. '''
+    frame = pd.DataFrame(dict(x=range(10)))
+    size = int(frame.memory_usage(index=True, deep=True).sum())
+    results = ResultCache(size * 5)
+    errors = []
+    def run(offset):
+        try:
+            for i in range(200):
+                key = (Le(X, (i + offset) % 10), None)
+                results.put(key, frame)
+                results.get(key)
+                results.derive(Le(X, -1))
+                results.invalidate(Ge(X, (i * offset) % 10))
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run, args=(offset, )) for offset in range(4)]
+    # Switch threads often, so unlocked access would interleave.
+    interval = sys.getswitchinterval() if hasattr(sys, 'setswitchinterval') else None
+    if interval is not None:
+        sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+    finally:
+        if interval is not None:
+            sys.setswitchinterval(interval)
+    assert errors == []
+    assert results.nbytes == size * len(results.entries)
+
+
+@pytest.mark.parametrize('cls', [minimal_cache_inmemory, create_persistent])
+def test_result_cache_subset(cls):
+    ''' A narrower query is derived from a kept broader result (with the
+    needed columns) without reading cache entries. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    backend = cls(remote)
+    backend.results = ResultCache(10 ** 6)
+    backend.get(Ge(X, 2))
+    backend.get(Le(X, 1), columns=['point', 'x'])
+    with mock.patch.object(backend, '_read', wraps=backend._read) as read:
+        result = backend.get(And([Ge(X, 3), Le(Y, 1)]))
+        assert backend.tracking == [('subset', And([Ge(X, 3), Le(Y, 1)]), Ge(X, 2))]
+        assert sorted(result.point) == sorted(source_query(And([Ge(X, 3), Le(Y, 1)])).point)
+        result = backend.get(Le(X, 0), columns=['point'])
+        assert backend.tracking[0][0] == 'subset'
+        assert sorted(result.point) == ['0:0', '0:1', '0:2', '0:3', '0:4']
+        read.assert_not_called()
+    # Filter column y was not kept in the projected result.
+    backend.get(And([Le(X, 0), Le(Y, 1)]), columns=['point'])
+    assert backend.tracking[0][0] == 'cache'
+    remote.get.assert_has_calls([mock.call(Ge(X, 2)), mock.call(Le(X, 1))])
+    assert remote.get.call_count == 2
+
+
+def test_result_cache_copies():
+    ''' Changes to returned results are not seen by later hits, whether the
+    result was assembled, kept or derived. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    backend = minimal_cache_inmemory(remote, result_bytes=10 ** 6)
+    for expression in [Le(X, 2), Le(X, 2), Le(X, 1)]:
+        result = backend.get(expression)
+        result.loc[result.index[0], 'x'] = 999
+        result = backend.get(expression)
+        assert sorted(result.x) == sorted(source_query(expression).x)
+    assert sorted(backend.get(Le(X, 0)).point) == sorted(source_query(Le(X, 0)).point)
+
+
+@pytest.mark.parametrize('cls', [minimal_cache_inmemory, create_persistent, create_write_behind])
+def test_single_flight(cls):
+    ''' Concurrent overlapping queries wait for data already being fetched
+    instead of requesting it again: the remote never receives overlapping
+    requests, and every query gets the complete result. '''
+    started, proceed = threading.Event(), threading.Event()
+    def remote_get(expr):
+        if expr == Le(X, 2):
+            started.set()
+            proceed.wait(5)
+        return expr, source_query(expr)
+    remote = mock.Mock()
+    remote.get.side_effect = remote_get
+    backend = cls(remote)
+    queries = [Le(X, 2), Le(X, 3), Le(X, 1), Ge(X, 1)]
+    results = dict()
+    def run(query):
+        results[query] = backend.get(query)
+    threads = [threading.Thread(target=run, args=(query, )) for query in queries]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    for _ in range(100):
+        if remote.get.call_count >= 3:
+            break
+        time.sleep(0.01)
+    time.sleep(0.05)
+    proceed.set()
+    for thread in threads:
+        thread.join(5)
+    requested = [call[0][0] for call in remote.get.call_args_list]
+    assert requested[0] == Le(X, 2)
+    for a, b in itertools.combinations(requested, 2):
+        assert simplify(And([a, b])) is False
+    for query in queries:
+        assert sorted(results[query].point) == sorted(source_query(query).point)
+    assert len(backend.flights.flights) == 0
+
+
+def test_single_flight_buckets():
+    ''' Concurrent queries which don't overlap, but are widened to the same
+    remote bucket, request the bucket once. '''
+    started, proceed = threading.Event(), threading.Event()
+    calls = []
+    source = pd.DataFrame(dict(x=range(20)))
+    @cache_inmemory()
+    @remote_parameters(range_parameter(
+        'x', round_down=lambda x: x - (x % 10), offset=lambda x: x + 10))
+    class Remote(object):
+        def get(self, x_lower, x_upper):
+            calls.append((x_lower, x_upper))
+            started.set()
+            proceed.wait(5)
+            return query_df(source, And([Ge(X, x_lower), Le(X, x_upper)]))
+    backend = Remote()
+    queries = [And([Ge(X, 1), Le(X, 3)]), And([Ge(X, 5), Le(X, 7)])]
+    results = dict()
+    def run(query):
+        results[query] = backend.get(query)
+    threads = [threading.Thread(target=run, args=(query, )) for query in queries]
+    threads[0].start()
+    started.wait(5)
+    threads[1].start()
+    time.sleep(0.05)
+    proceed.set()
+    for thread in threads:
+        thread.join(5)
+    assert calls == [(0, 10)]
+    for query in queries:
+        assert list(results[query].x) == list(query_df(source, query).x)
+    assert len(backend.flights.buckets) == 0
+
+
+@pytest.mark.parametrize('cls', [minimal_cache_inmemory, create_persistent, create_write_behind])
+def test_fill_failure(cls):
+    ''' Entries received before a remote failure are kept; the error gives
+    the missing part, and running the query again fetches only that. '''
+    def failing_iter(query):
+        yield Le(X, 1), source_query(Le(X, 1))
+        yield And([Gt(X, 1), Le(X, 2)]), source_query(And([Gt(X, 1), Le(X, 2)]))
+        raise IOError('connection lost')
+    remote = mock.Mock()
+    remote.get.side_effect = failing_iter
+    backend = cls(remote)
+    with pytest.raises(CacheFillError) as error:
+        backend.get(Le(X, 3))
+    assert error.value.missing == And([Gt(X, 2), Le(X, 3)])
+    assert error.value.fetched == [Le(X, 1), And([Gt(X, 1), Le(X, 2)])]
+    assert isinstance(error.value.cause, IOError)
+    assert backend.tracking[-1] == ('failed', And([Gt(X, 2), Le(X, 3)]), None)
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    remote.get.reset_mock()
+    result = backend.get(Le(X, 3))
+    remote.get.assert_called_once_with(And([Gt(X, 2), Le(X, 3)]))
+    assert sorted(result.point) == sorted(source_query(Le(X, 3)).point)
+
+
+def test_fill_incomplete():
+    ''' A remote returning less than requested is reported as missing. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (Le(X, 1), source_query(Le(X, 1)))
+    backend = minimal_cache_inmemory(remote)
+    with pytest.raises(CacheFillError) as error:
+        backend.get(Le(X, 2))
+    assert error.value.missing == And([Gt(X, 1), Le(X, 2)])
+    assert error.value.cause is None
+    assert list(backend.cache.keys()) == [Le(X, 1)]
+
+
+def test_persistent_write_atomic():
+    ''' A failed data write leaves no data file and no contents entry. '''
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, source_query(expr))
+    location = tempfile.mktemp()
+    backend = minimal_cache_persistent(remote, location=location)
+    original = pd.DataFrame.to_hdf
+    def failing_to_hdf(self, path, *args, **kwargs):
+        original(self, path, *args, **kwargs)
+        raise IOError('disk full')
+    with mock.patch.object(pd.DataFrame, 'to_hdf', failing_to_hdf):
+        with pytest.raises(CacheFillError):
+            backend.get(Le(X, 1))
+    assert len(backend.cache.keys()) == 0
+    # Only the shelf files remain (no data files, complete or partial).
+    assert all(
+        name.startswith(('contents', 'statistics')) for name in os.listdir(location))
+    reopened = minimal_cache_persistent(remote, location=location)
+    assert len(reopened.cache.keys()) == 0
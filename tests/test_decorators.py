@@ -0,0 +1,104 @@
+''' Tests of the remote parameter wrapper, using a mock remote object. '''
+
+import threading
+
+import mock
+import pandas as pd
+
+from split_query.cache import SingleFlight
+from split_query.core import And, Attribute, Ge, In, Le
+from split_query.decorators import (
+    ParameterWrapper, columns_parameter, range_parameter, tag_parameter)
+from split_query.engine import query_df
+
+X = Attribute('x')
+TAG = Attribute('tag')
+
+SOURCE = pd.DataFrame(dict(
+    x=[x for x in range(12) for _ in 'abc'],
+    tag=[tag for _ in range(12) for tag in 'abc']))
+
+
+def remote_get(x_lower, x_upper, tag_values):
+    return query_df(SOURCE, And([Ge(X, x_lower), Le(X, x_upper), In(TAG, tag_values)]))
+
+
+def create_wrapper(**kwargs):
+    obj = mock.Mock()
+    obj.get.side_effect = remote_get
+    parameters = [
+        range_parameter(
+            'x', round_down=lambda x: x - (x % 2), offset=lambda x: x + 2,
+            max_span=kwargs.get('max_span')),
+        tag_parameter('tag', key='tag', max_tags=kwargs.get('max_tags'))]
+    return obj, ParameterWrapper(obj, parameters)
+
+
+def test_batched_calls():
+    ''' Batched remote calls are split back into fine-grained subqueries. '''
+    obj, wrapper = create_wrapper(max_span=6, max_tags=2)
+    expression = And([Ge(X, 1), Le(X, 6), In(TAG, ['a', 'b', 'c'])])
+    result = list(wrapper.get(expression))
+    assert obj.get.call_count == 2
+    # One cached entry per bucket and tag.
+    assert len(result) == 3 * 3
+    for subquery, data in result:
+        assert data.equals(query_df(SOURCE, subquery))
+
+
+def test_cache_aware():
+    ''' Buckets already in the cache are returned without data and are not
+    requested from the remote. '''
+    obj, wrapper = create_wrapper()
+    cached = And([Ge(X, 0), Le(X, 2), In(TAG, ['a'])])
+    wrapper.cache = {cached: query_df(SOURCE, cached)}
+    result = list(wrapper.get(And([Ge(X, 1), Le(X, 3), In(TAG, ['a'])])))
+    assert (cached, None) in result
+    assert len(result) == 2
+    obj.get.assert_called_once_with(x_lower=2, x_upper=4, tag_values={'a'})
+
+
+def test_bucket_flights():
+    ''' Buckets claimed by another query are waited for, then reused if
+    written, or requested if the other fetch failed. '''
+    bucket = And([Ge(X, 0), Le(X, 2), In(TAG, ['a'])])
+    expression = And([Ge(X, 1), Le(X, 3), In(TAG, ['a'])])
+    for written in [True, False]:
+        obj, wrapper = create_wrapper()
+        wrapper.cache, wrapper.flights = dict(), SingleFlight()
+        (flight, ), _ = wrapper.flights.claim_buckets([bucket])
+        def complete():
+            if written:
+                wrapper.cache[bucket] = query_df(SOURCE, bucket)
+            wrapper.flights.release_bucket(flight)
+        timer = threading.Timer(0.05, complete)
+        timer.start()
+        result = list(wrapper.get(expression))
+        timer.join()
+        if written:
+            assert (bucket, None) in result
+            obj.get.assert_called_once_with(x_lower=2, x_upper=4, tag_values={'a'})
+        else:
+            assert obj.get.call_args_list == [
+                mock.call(x_lower=2, x_upper=4, tag_values={'a'}),
+                mock.call(x_lower=0, x_upper=2, tag_values={'a'})]
+        assert len(result) == 2
+        assert len(wrapper.flights.buckets) == 0
+
+
+def test_columns_parameter():
+    ''' Requested columns are passed to the remote, along with the columns
+    needed to split the result. '''
+    obj = mock.Mock()
+    obj.get.side_effect = lambda columns=None, **kwargs: remote_get(**kwargs)
+    wrapper = ParameterWrapper(obj, [
+        range_parameter('x'), tag_parameter('tag', key='tag'),
+        columns_parameter()])
+    expression = And([Ge(X, 1), Le(X, 6), In(TAG, ['a'])])
+    list(wrapper.get(expression, columns=['x']))
+    obj.get.assert_called_once_with(
+        x_lower=1, x_upper=6, tag_values={'a'}, columns=['x', 'tag'])
+    # No projection unless requested.
+    obj.get.reset_mock()
+    list(wrapper.get(expression))
+    obj.get.assert_called_once_with(x_lower=1, x_upper=6, tag_values={'a'})
@@ -4,11 +4,14 @@ satisfied by eveny engine implementation. '''
 import itertools
 from datetime import datetime, timedelta
 
+import mock
 import pandas as pd
 import pytest
 import pytz
 
-from split_query.engine import query_df
+from split_query.engine import (
+    aggregate, combine_aggregates, map_query_df, may_match, normalise_aggregates,
+    partial_aggregate, partition_statistics, query_df, range_hull, required_columns)
 from split_query.core import And, Attribute, Eq, Ge, Gt, In, Le, Lt, Not, Or
 
 
@@ -54,3 +57,134 @@ def test_query_df(query, expected):
     ''' Known tests: API guarantee. '''
     result = query_df(SOURCE_2D, query)
     assert set(result['point']) == set(expected)
+
+
+@pytest.mark.parametrize('query, expected', TESTCASES_QUERY)
+def test_query_df_columns(query, expected):
+    ''' Projection to columns not involved in the filter. '''
+    result = query_df(SOURCE_2D, query, columns=['point'])
+    assert list(result.columns) == ['point']
+    assert set(result['point']) == set(expected)
+
+
+def test_required_columns():
+    query = And([Ge(x, 3), Not(In(point, ['3:1']))])
+    assert required_columns(query, None) is None
+    assert required_columns(query, ['y', 'x']) == ['y', 'x', 'point']
+
+
+def test_aggregate_partitions():
+    ''' Combined partial aggregates of any partitioning equal aggregates of
+    the whole dataframe. '''
+    spec = normalise_aggregates({'y': ['count', 'sum', 'min', 'max', 'mean'], 'dtx': 'max'})
+    parts = [SOURCE_2D[SOURCE_2D.x <= 1], SOURCE_2D[SOURCE_2D.x > 1], SOURCE_2D[:0]]
+    for by in [None, 'x', ['x', 'point']]:
+        expected = aggregate(SOURCE_2D, {'y': ['count', 'sum', 'min', 'max', 'mean'], 'dtx': 'max'}, by)
+        result = combine_aggregates([partial_aggregate(part, spec, by) for part in parts], spec, by)
+        if by is None:
+            assert list(result) == list(expected)
+        else:
+            assert result.equals(expected)
+    expected = SOURCE_2D.groupby('x').agg({'y': ['min', 'max', 'mean']})
+    result = aggregate(SOURCE_2D, {'y': ['min', 'max', 'mean']}, by='x')
+    assert (result.values == expected.values).all()
+    with pytest.raises(ValueError):
+        normalise_aggregates({'y': 'median'})
+
+
+TESTCASES_STATISTICS = [
+    Eq(x, 7), Eq(x, 2), Gt(x, 4), Ge(x, 4), Lt(x, 0), Le(x, 0),
+    In(point, ['0:0', '9:9']), In(point, ['9:9']), In(x, [7, 8]),
+    Not(Eq(x, 2)), Not(In(point, ['0:0'])),
+    Ge(dtx, DTBASE + DAY * 10), Le(dtx, DTBASE + DAY * 10),
+    And([Eq(x, 1), Gt(y, 2)]), And([Eq(x, 1), Gt(y, 5)]),
+    Or([Eq(x, 9), Gt(y, 5)]), Or([Eq(x, 9), Gt(y, 3)]),
+    Eq(Attribute('missing'), 1),
+]
+
+
+@pytest.mark.parametrize('max_distinct', [0, 5, 50])
+@pytest.mark.parametrize('query', TESTCASES_STATISTICS)
+def test_may_match(query, max_distinct):
+    ''' Statistics never rule out data which matches; with few distinct
+    values, they rule out data exactly for single-column queries. '''
+    statistics = partition_statistics(SOURCE_2D, max_distinct=max_distinct)
+    result = may_match(statistics, query)
+    if 'missing' in repr(query):
+        assert result is True
+        return
+    matches = len(query_df(SOURCE_2D, query)) > 0
+    assert result or not matches
+    if max_distinct == 50 and not isinstance(query, (And, Or)):
+        assert result == matches
+
+
+def test_may_match_empty():
+    statistics = partition_statistics(SOURCE_2D[:0])
+    assert statistics['rows'] == 0
+    assert may_match(statistics, True) is False
+
+
+@pytest.mark.parametrize('sort_key', ['x', 'y', 'dtx', 'point'])
+@pytest.mark.parametrize('query, expected', TESTCASES_QUERY)
+def test_query_df_sorted(query, expected, sort_key):
+    ''' Binary search on a sorted column gives the same result. '''
+    source = SOURCE_2D.sort_values(sort_key, kind='mergesort')
+    result = query_df(source, query, sort_key=sort_key)
+    assert set(result['point']) == set(expected)
+
+
+TESTCASES_HULL = [
+    (True, (None, None)),
+    (Ge(x, 2), (2, None)),
+    (And([Ge(x, 2), Lt(x, 4), Le(y, 1)]), (2, 4)),
+    (And([Ge(x, 2), Gt(x, 3), In(x, [1, 7])]), (3, 7)),
+    (Or([Eq(x, 1), And([Gt(x, 3), Le(x, 5)])]), (1, 5)),
+    (Or([Eq(x, 1), Gt(y, 3)]), (None, None)),
+    (Not(Le(x, 3)), (None, None)),
+]
+
+
+@pytest.mark.parametrize('query, expected', TESTCASES_HULL)
+def test_range_hull(query, expected):
+    assert range_hull(query, 'x') == expected
+
+
+def test_query_df_sorted_slice():
+    ''' Only the slice within the range hull is filtered. '''
+    source = pd.DataFrame(dict(x=range(1000)))
+    query = And([Ge(x, 100), Lt(x, 110)])
+    with mock.patch('split_query.engine.map_query_df', wraps=map_query_df) as spy:
+        result = query_df(source, query, sort_key='x')
+    assert list(result.x) == list(range(100, 110))
+    assert all(len(call[0][0]) == 11 for call in spy.call_args_list)
+
+
+@pytest.mark.parametrize('query, expected', TESTCASES_QUERY)
+def test_query_df_categorical(query, expected):
+    ''' Relations on categorical columns are evaluated on category codes,
+    with the same results (categories need not be sorted). '''
+    source = SOURCE_2D.copy()
+    source['point'] = pd.Categorical(
+        source['point'], categories=sorted(source['point'].unique(), reverse=True) + ['9:9'])
+    result = query_df(source, query)
+    assert set(result['point']) == set(expected)
+
+
+@pytest.mark.parametrize('unit', ['ns', 'us'])
+@pytest.mark.parametrize('tz', [None, 'UTC'])
+@pytest.mark.parametrize('relation', [Eq, Le, Lt, Ge, Gt])
+@pytest.mark.parametrize('offset', [timedelta(0), timedelta(hours=1, microseconds=1)])
+def test_map_query_df_datetime(unit, tz, relation, offset):
+    ''' Relations on datetime64 columns are compared as integers in the
+    column's resolution, matching pandas comparisons (including NaT). '''
+    column = pd.Series(pd.date_range('2017-01-01', periods=48, freq='h', tz=tz).as_unit(unit))
+    column[5] = pd.NaT
+    value = pd.Timestamp('2017-01-02', tz=tz) + offset
+    query = relation(Attribute('dt'), value)
+    expected = {Eq: column == value, Le: column <= value, Lt: column < value,
+                Ge: column >= value, Gt: column > value}[relation]
+    assert list(map_query_df(pd.DataFrame(dict(dt=column)), query)) == list(expected)
+    values = [value, pd.Timestamp('2017-01-01 05:00', tz=tz)]
+    assert list(map_query_df(pd.DataFrame(dict(dt=column)), In(Attribute('dt'), values))) == list(
+        column.isin(values))
@@ -0,0 +1,57 @@
+''' Tests of cardinality estimates against true counts on random data. '''
+
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from split_query.core import And, Attribute, Eq, Ge, Gt, In, Le, Lt, Not, Or
+from split_query.engine import partition_statistics, query_df
+from split_query.estimate import HyperLogLog, estimate_count
+
+
+x, y, tag, dt = [Attribute(n) for n in ['x', 'y', 'tag', 'dt']]
+
+_random = np.random.RandomState(42)
+SOURCE = pd.DataFrame(dict(
+    x=_random.normal(size=10000),
+    y=_random.randint(0, 500, size=10000),
+    tag=_random.choice(list('abcde'), size=10000),
+    dt=pd.Timestamp('2017-01-01') + pd.to_timedelta(_random.randint(0, 365, size=10000), unit='D')))
+STATISTICS = partition_statistics(SOURCE)
+
+
+TESTCASES_ESTIMATE = [
+    True, False,
+    Le(x, 0), Gt(x, 1), And([Ge(x, -1), Lt(x, 0.5)]), Gt(x, 100),
+    Eq(y, 7), In(y, [1, 2, 3]), And([Ge(y, 100), Le(y, 199)]),
+    In(tag, ['a', 'b']), Not(Eq(tag, 'c')), Eq(tag, 'z'),
+    Ge(dt, datetime.datetime(2017, 7, 1)),
+    Or([Le(x, 0), In(tag, ['a'])]),
+    And([Gt(y, 250), Or([Le(x, 0), Eq(tag, 'c')])]),
+    Not(And([Gt(y, 250), Lt(x, 0.5)])),
+    And([Not(In(tag, ['a', 'b'])), Ge(x, 0)]),
+]
+
+
+@pytest.mark.parametrize('expression', TESTCASES_ESTIMATE)
+def test_estimate_count(expression):
+    ''' Estimates are within 10% of the source size of the true count. '''
+    actual = len(query_df(SOURCE, expression))
+    estimate = estimate_count(STATISTICS, expression)
+    assert abs(estimate - actual) <= 0.1 * len(SOURCE)
+
+
+def test_estimate_exact_values():
+    ''' Columns with few distinct values have exact value counts. '''
+    for expression in [In(tag, ['a', 'b']), Not(In(tag, ['a'])), Ge(tag, 'c')]:
+        assert round(estimate_count(STATISTICS, expression)) == len(query_df(SOURCE, expression))
+
+
+def test_hyperloglog():
+    parts = [SOURCE.y[:5000], SOURCE.y[5000:]]
+    sketches = [HyperLogLog.from_series(part) for part in parts]
+    for part, sketch in zip(parts, sketches):
+        assert abs(sketch.count() - part.nunique()) <= 0.15 * part.nunique()
+    assert HyperLogLog.from_series(SOURCE.y[:0]).count() == 0
@@ -2,7 +2,7 @@
 import pytest
 
 from split_query.core import Attribute, And, Or, Not, In, Ge, Le, Lt, Gt, Eq
-from split_query.extract import extract_parameters, split_parameters
+from split_query.extract import batch_parameters, extract_parameters, split_parameters
 
 
 XVAR = Attribute('x')
@@ -72,3 +72,72 @@ def test_split_parameters(expression, parameters, expected):
     result = split_parameters(expression, parameters)
     result = sorted(result, key=lambda elem: elem[1]['xl'])
     assert list(result) == expected
+
+
+TESTCASES_DOMAIN = [
+    # Unfiltered tag is expanded to its whole domain.
+    (
+        And([Ge(YVAR, 2), Le(YVAR, 4)]),
+        [(In(XVAR, [1]), dict(xtag=1)), (In(XVAR, [2]), dict(xtag=2)), (In(XVAR, [3]), dict(xtag=3))]),
+    (
+        True,
+        [(In(XVAR, [1]), dict(xtag=1)), (In(XVAR, [2]), dict(xtag=2)), (In(XVAR, [3]), dict(xtag=3))]),
+    # Negated set replaced by remaining values.
+    (
+        Not(Eq(XVAR, 2)),
+        [(In(XVAR, [1]), dict(xtag=1)), (In(XVAR, [3]), dict(xtag=3))]),
+    (
+        In(XVAR, [2, 4]),
+        [(In(XVAR, [2]), dict(xtag=2))]),
+]
+
+
+@pytest.mark.parametrize('expression, expected', TESTCASES_DOMAIN)
+def test_split_parameters_domain(expression, expected):
+    parameters = [dict(attr='x', type='tag', key='xtag', single=True, domain=[1, 2, 3])]
+    result = sorted(split_parameters(expression, parameters), key=lambda elem: elem[1]['xtag'])
+    assert result == expected
+
+
+def _bucket(low, high, tag):
+    return (
+        And([Ge(XVAR, low), Le(XVAR, high), In(YVAR, [tag])]),
+        dict(xl=low, xu=high, ytags={tag}))
+
+
+BATCH_PARAMETERS = [
+    dict(
+        attr='x', type='range', key_lower='xl', key_upper='xu',
+        round_down=lambda x: x - (x % 2), offset=lambda x: x + 2, max_span=4),
+    dict(attr='y', type='tag', key='ytags', single=False, max_tags=2)]
+
+
+def test_batch_parameters():
+    buckets = [_bucket(low, low + 2, tag) for tag in 'abc' for low in [0, 2, 4, 8]]
+    result = batch_parameters(buckets, BATCH_PARAMETERS)
+    calls = sorted(
+        (kwargs['xl'], kwargs['xu'], tuple(sorted(kwargs['ytags'])))
+        for kwargs, _ in result)
+    # Contiguous ranges merged up to span 4, tags merged in pairs.
+    assert calls == [
+        (0, 4, ('a', 'b')), (0, 4, ('c', )),
+        (4, 6, ('a', 'b')), (4, 6, ('c', )),
+        (8, 10, ('a', 'b')), (8, 10, ('c', ))]
+    # Every bucket is covered exactly once, by a call containing it.
+    covered = [subquery for _, subqueries in result for subquery, _ in subqueries]
+    assert sorted(covered, key=repr) == sorted((sq for sq, _ in buckets), key=repr)
+    for kwargs, subqueries in result:
+        for _, bucket_kwargs in subqueries:
+            assert kwargs['xl'] <= bucket_kwargs['xl'] < bucket_kwargs['xu'] <= kwargs['xu']
+            assert bucket_kwargs['ytags'].issubset(kwargs['ytags'])
+
+
+def test_batch_parameters_no_capabilities():
+    ''' Without declared capabilities, each bucket is a separate call (repeated
+    buckets are only requested once). '''
+    buckets = [_bucket(0, 2, 'a'), _bucket(2, 4, 'a'), _bucket(0, 2, 'a')]
+    parameters = [
+        dict(attr='x', type='range', key_lower='xl', key_upper='xu'),
+        dict(attr='y', type='tag', key='ytags', single=False)]
+    result = batch_parameters(buckets, parameters)
+    assert result == [(kwargs, [(sq, kwargs)]) for sq, kwargs in buckets[:2]]
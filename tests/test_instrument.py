@@ -0,0 +1,76 @@
+''' Tests of instrumentation spans, counters and subscribers. '''
+
+import logging
+
+import mock
+import pandas as pd
+import pytest
+
+from split_query import instrument
+from split_query.cache import minimal_cache_inmemory
+from split_query.core import Attribute, Ge, Le, Or
+from split_query.engine import query_df
+
+X = Attribute('x')
+SOURCE = pd.DataFrame(dict(x=range(10)))
+
+
+@pytest.fixture
+def collector():
+    collector = instrument.subscribe(instrument.MemoryCollector())
+    yield collector
+    instrument.unsubscribe(collector)
+
+
+def create_cache():
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, query_df(SOURCE, expr))
+    return minimal_cache_inmemory(remote)
+
+
+def test_disabled():
+    ''' Without subscribers, spans are a shared no-op. '''
+    assert not instrument.enabled()
+    assert instrument.span('a') is instrument.span('b')
+    assert list(instrument.timed_iter('a', [1, 2])) == [1, 2]
+
+
+def test_cache_path(collector):
+    backend = create_cache()
+    backend.get(Le(X, 4))
+    backend.get(Or([Le(X, 2), Ge(X, 7)]))
+    summary = collector.summary()
+    for name in ['simplify', 'plan', 'read', 'remote', 'filter', 'concat']:
+        calls, total = summary['spans'][name]
+        assert calls > 0 and total >= 0
+    counters = summary['counters']
+    assert counters['cache_misses'] == 2
+    assert counters['remote_entries'] == 2
+    assert counters['cache_hits'] == 1
+    assert counters['bytes_read'] > 0
+
+
+def test_prometheus_text():
+    exporter = instrument.subscribe(instrument.PrometheusText())
+    try:
+        create_cache().get(Le(X, 4))
+    finally:
+        instrument.unsubscribe(exporter)
+    text = exporter.render()
+    assert '# TYPE split_query_remote_seconds summary' in text
+    assert 'split_query_remote_seconds_count ' in text
+    assert 'split_query_cache_misses_total 1' in text
+
+
+def test_logging_subscriber(caplog):
+    subscriber = instrument.subscribe(instrument.LoggingSubscriber(level=logging.INFO))
+    try:
+        with caplog.at_level(logging.INFO):
+            with instrument.span('step', key='value'):
+                pass
+            instrument.count('things', 3)
+    finally:
+        instrument.unsubscribe(subscriber)
+    messages = [record.getMessage() for record in caplog.records]
+    assert messages[0].startswith('span step ')
+    assert messages[1] == "count things +3 {}"
@@ -6,7 +6,7 @@ import pytest
 import mock
 
 from split_query.interface import DataSet
-from split_query.core import And, Attribute, Eq, Ge, Gt, In, Le, Lt, Not, Or
+from split_query.core import And, Attribute, Eq, Ge, Gt, In, Integer, Le, Lt, Not, Or
 
 
 def filter_test(test_func):
@@ -93,3 +93,63 @@ def test_filter_between(dataset):
     return (
         dataset[dataset.x.between(1, 3)],
         And([Ge(Attribute('x'), 1), Le(Attribute('x'), 3)]))
+
+
+def test_types():
+    ''' Declared types are kept by filtered datasets, and must refer to
+    declared attributes. '''
+    dataset = DataSet('Data', list('xyzs'), mock.Mock(), types={'x': Integer()})
+    assert dataset[dataset.x > 1].types == {'x': Integer()}
+    with pytest.raises(KeyError):
+        DataSet('Data', list('xyzs'), mock.Mock(), types={'w': Integer()})
+
+
+def test_iter_get():
+    ''' iter_get streams chunks from a capable backend, otherwise yields the
+    single result of get. '''
+    backend = mock.Mock()
+    backend.iter_get.return_value = iter([1, 2])
+    dataset = DataSet('Data', list('xy'), backend)
+    assert list(dataset[dataset.x > 1].iter_get()) == [1, 2]
+    backend.iter_get.assert_called_once_with(Gt(Attribute('x'), 1))
+    backend = mock.Mock(spec=['get'])
+    dataset = DataSet('Data', list('xy'), backend)
+    assert list(dataset.iter_get()) == [backend.get.return_value]
+
+
+def test_select():
+    ''' Projection is passed to the backend with the filter, and kept when
+    further filters are applied. '''
+    backend = mock.Mock()
+    dataset = DataSet('Data', list('xyz'), backend)
+    dataset[['x', 'y']][dataset.z > 1].get()
+    backend.get.assert_called_once_with(Gt(Attribute('z'), 1), columns=['x', 'y'])
+    backend.reset_mock()
+    dataset.select('z').get()
+    backend.get.assert_called_once_with(True, columns=['z'])
+    with pytest.raises(KeyError):
+        dataset[['x', 'w']]
+
+
+def test_aggregates():
+    ''' Aggregates are delegated to the backend with the filter expression. '''
+    backend = mock.Mock()
+    dataset = DataSet('Data', list('xy'), backend)
+    filtered = dataset[dataset.x > 1]
+    assert filtered.count() == backend.count.return_value
+    backend.count.assert_called_once_with(Gt(Attribute('x'), 1))
+    assert filtered.agg({'y': 'max'}, by='x') == backend.agg.return_value
+    backend.agg.assert_called_once_with(Gt(Attribute('x'), 1), {'y': 'max'}, by='x')
+
+
+def test_repr_records():
+    backend = mock.Mock()
+    backend.known_count.return_value = 12
+    dataset = DataSet('Data', list('xy'), backend)
+    assert '<b>Records:</b> 12<' in dataset[dataset.x > 1]._repr_html_()
+    backend.known_count.assert_called_once_with(Gt(Attribute('x'), 1))
+    backend.known_count.return_value = None
+    backend.estimate_count.return_value = 30
+    assert '<b>Records:</b> ~30<' in dataset._repr_html_()
+    backend.estimate_count.return_value = None
+    assert '<b>Records:</b> unknown<' in dataset._repr_html_()
@@ -0,0 +1,80 @@
+''' Tests of the sliding window prefetch policy. '''
+
+import mock
+import pandas as pd
+
+from split_query.cache import minimal_cache_inmemory
+from split_query.core import And, Attribute, Ge, Gt, In, Le, Or
+from split_query.decorators import ParameterWrapper, range_parameter
+from split_query.engine import query_df
+from split_query.prefetch import SlidingWindowPrefetch
+
+X = Attribute('x')
+TAG = Attribute('tag')
+SOURCE = pd.DataFrame(dict(x=range(20), tag=['a', 'b'] * 10))
+
+
+def window(lower, upper, *others):
+    return And([Ge(X, lower), Le(X, upper)] + list(others))
+
+
+def test_ahead_projected():
+    ''' Without buckets, the window is projected by its last movement. '''
+    policy = SlidingWindowPrefetch('x', buckets=2)
+    assert policy.ahead(window(0, 4)) is None
+    assert policy.ahead(window(1, 5)) == And([Gt(X, 5), Le(X, 7)])
+    # Other filters are kept, but must be unchanged between queries.
+    assert policy.ahead(window(2, 6, In(TAG, ['a']))) is None
+    assert policy.ahead(window(4, 8, In(TAG, ['a']))) == And([Gt(X, 8), Le(X, 12), In(TAG, ['a'])])
+    # Not moving forward.
+    assert policy.ahead(window(4, 8, In(TAG, ['a']))) is None
+    assert policy.ahead(window(2, 6, In(TAG, ['a']))) is None
+    # Not a single window.
+    assert policy.ahead(Or([window(0, 1), window(5, 6)])) is None
+    assert policy.ahead(Ge(X, 3)) is None
+
+
+def test_ahead_buckets():
+    policy = SlidingWindowPrefetch(
+        'x', round_down=lambda x: x - (x % 10), offset=lambda x: x + 10, buckets=1)
+    policy.ahead(window(0, 14))
+    assert policy.ahead(window(5, 17)) == And([Gt(X, 17), Le(X, 30)])
+
+
+def test_prefetch_next_bucket():
+    ''' After the window moves, the next bucket is fetched in the background
+    and the following query is answered from the cache. '''
+    obj = mock.Mock()
+    obj.get.side_effect = lambda x_lower, x_upper: query_df(
+        SOURCE, And([Ge(X, x_lower), Le(X, x_upper)]))
+    round_down, offset = lambda x: x - (x % 2), lambda x: x + 2
+    remote = ParameterWrapper(obj, [range_parameter('x', round_down=round_down, offset=offset)])
+    policy = SlidingWindowPrefetch('x', round_down=round_down, offset=offset)
+    backend = minimal_cache_inmemory(remote, prefetch=policy)
+    backend.get(window(0, 3))
+    policy.wait()
+    backend.get(window(1, 4))
+    policy.wait()
+    obj.get.assert_called_with(x_lower=6, x_upper=8)
+    tracking = backend.tracking
+    obj.get.reset_mock()
+    result = backend.get(window(2, 6))
+    # This query moves the window again, prefetching the bucket after it.
+    policy.wait()
+    obj.get.assert_called_once_with(x_lower=8, x_upper=10)
+    assert list(result.sort_values('x').x) == [2, 3, 4, 5, 6]
+    # The background fill did not replace the tracking of user queries.
+    assert all(kind != 'remote' or query != And([Gt(X, 4), Le(X, 8)])
+               for kind, query, _ in tracking)
+
+
+def test_fill():
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, query_df(SOURCE, expr))
+    backend = minimal_cache_inmemory(remote)
+    backend.get(window(0, 5))
+    with mock.patch.object(backend, '_read') as read:
+        assert backend.fill(window(0, 9)) == 1
+        assert backend.fill(window(0, 9)) == 0
+        read.assert_not_called()
+    remote.get.assert_called_with(And([Gt(X, 5), Le(X, 9)]))
@@ -0,0 +1,95 @@
+''' Tests of trace recording and replay against a synthetic remote. '''
+
+import datetime
+
+import mock
+import pandas as pd
+import pytest
+
+from split_query.cache import minimal_cache_inmemory
+from split_query.core import And, Attribute, Ge, Gt, In, Le, Lt
+from split_query.engine import query_df
+from split_query.interface import DataSet
+from split_query.replay import (
+    SyntheticRemote, TraceRecorder, fit_remote_cost, load_trace, replay,
+    sliding_window_trace)
+
+X = Attribute('x')
+TAG = Attribute('tag')
+SOURCE = pd.DataFrame(dict(x=range(10)))
+
+
+def test_record_save_load(tmpdir):
+    remote = mock.Mock()
+    remote.get.side_effect = lambda expr: (expr, query_df(SOURCE, expr))
+    recorder = TraceRecorder()
+    backend = minimal_cache_inmemory(recorder.remote(remote))
+    dataset = recorder.record(DataSet('Data', ['x'], backend))
+    dataset[dataset.x <= 4].get()
+    dataset[dataset.x <= 4][['x']].get()
+    assert [event['event'] for event in recorder.events] == ['remote', 'get', 'get']
+    assert recorder.events[0]['rows'] == 5
+    assert recorder.events[2]['columns'] == ['x']
+    path = str(tmpdir.join('trace.jsonl'))
+    recorder.save(path)
+    events = load_trace(path)
+    assert events[1]['expression'] == Le(X, 4)
+    assert events == recorder.events
+
+
+def test_synthetic_remote_deterministic():
+    remote = SyntheticRemote('x', 0, 1, tags={'tag': ['a', 'b']}, latency=1, row_cost=0.5)
+    _, whole = remote.get(And([Ge(X, 0), Lt(X, 10)]))
+    assert len(whole) == 20
+    _, part = remote.get(And([Ge(X, 4), Le(X, 6), In(TAG, ['b'])]))
+    assert list(part.x) == [4, 5, 6]
+    expected = whole[(whole.x >= 4) & (whole.x <= 6) & (whole.tag == 'b')]
+    assert list(part.value) == list(expected.value)
+    assert (remote.calls, remote.rows) == (2, 23)
+    assert remote.simulated == pytest.approx(2 + 0.5 * 23)
+    with pytest.raises(ValueError):
+        remote.get(Ge(X, 0))
+
+
+def test_synthetic_remote_datetime():
+    start = datetime.datetime(2017, 1, 1)
+    remote = SyntheticRemote('dt', start, datetime.timedelta(hours=1))
+    dt = Attribute('dt')
+    _, data = remote.get(And([Gt(dt, start), Lt(dt, start + datetime.timedelta(hours=3))]))
+    assert list(data.dt) == [start + datetime.timedelta(hours=h) for h in (1, 2)]
+
+
+def test_sliding_window_trace():
+    events = sliding_window_trace(
+        'x', 0, 10, 5, 3, tags={'tag': ['a', 'b', 'c']}, active=2, churn=1)
+    assert [event['expression'] for event in events] == [
+        And([Ge(X, 0), Lt(X, 10), In(TAG, ['a', 'b'])]),
+        And([Ge(X, 5), Lt(X, 15), In(TAG, ['b', 'c'])]),
+        And([Ge(X, 10), Lt(X, 20), In(TAG, ['c', 'a'])])]
+
+
+def test_fit_remote_cost():
+    events = [
+        dict(event='remote', rows=rows, seconds=0.5 + 0.01 * rows)
+        for rows in (10, 100, 1000)]
+    latency, row_cost = fit_remote_cost(events + [dict(event='get')])
+    assert latency == pytest.approx(0.5)
+    assert row_cost == pytest.approx(0.01)
+    assert fit_remote_cost([]) == (0.0, 0.0)
+
+
+def test_replay():
+    events = sliding_window_trace('x', 0, 10, 10, 3) * 2
+    remote = SyntheticRemote('x', 0, 1, latency=1.0)
+    report = replay(events, {
+        'none': lambda remote: remote,
+        'inmemory': minimal_cache_inmemory}, remote)
+    assert list(report.index) == ['none', 'inmemory']
+    assert report.loc['none', 'hit_ratio'] == 0.0
+    assert report.loc['none', 'remote_calls'] == 6
+    assert report.loc['inmemory', 'hit_ratio'] == 0.5
+    assert report.loc['inmemory', 'remote_calls'] == 3
+    assert report.loc['inmemory', 'remote_rows'] == 30
+    # Misses include the simulated second of remote latency.
+    assert report.loc['inmemory', 'p90'] >= 1.0
+    assert report.loc['inmemory', 'p50'] >= 0.0
@@ -0,0 +1,118 @@
+''' Tests of the retrying, concurrent transport for parameterised remotes. '''
+
+import mock
+import pandas as pd
+import pytest
+
+from split_query.cache import CacheFillError, minimal_cache_inmemory
+from split_query.core import And, Attribute, Ge, Gt, In, Le, Lt
+from split_query.decorators import ParameterWrapper, range_parameter, tag_parameter
+from split_query.engine import query_df
+from split_query.transport import Transport
+
+X = Attribute('x')
+TAG = Attribute('tag')
+
+SOURCE = pd.DataFrame(dict(
+    x=[x for x in range(12) for _ in 'abc'],
+    tag=[tag for _ in range(12) for tag in 'abc']))
+
+
+def create_transport(**kwargs):
+    transport = Transport(**kwargs)
+    transport.sleep = mock.Mock()
+    return transport
+
+
+def test_call_retries():
+    transport = create_transport(retries=3, backoff=1.0, max_backoff=3.0)
+    func = mock.Mock(side_effect=[IOError(), IOError(), 'result'])
+    assert transport.call(func, 1, a=2) == 'result'
+    assert func.call_count == 3
+    func.assert_called_with(1, a=2)
+    delays = [call[0][0] for call in transport.sleep.call_args_list]
+    assert len(delays) == 2
+    assert 0 <= delays[0] <= 1.0 and 0 <= delays[1] <= 2.0
+    assert all(0 <= transport.delay(10) <= 3.0 for _ in range(20))
+
+
+def test_call_gives_up():
+    transport = create_transport(retries=2)
+    func = mock.Mock(side_effect=IOError('down'))
+    with pytest.raises(IOError):
+        transport.call(func)
+    assert func.call_count == 3
+    # Exceptions not listed in retry_on (by default, other than I/O errors)
+    # are raised immediately.
+    for kwargs in [dict(), dict(retry_on=(IOError, ))]:
+        transport = create_transport(retries=2, **kwargs)
+        func = mock.Mock(side_effect=KeyError())
+        with pytest.raises(KeyError):
+            transport.call(func)
+        assert func.call_count == 1
+    # Retried errors can be widened.
+    transport = create_transport(retries=2, retry_on=(Exception, ))
+    func = mock.Mock(side_effect=[TypeError(), 'result'])
+    assert transport.call(func) == 'result'
+
+
+def test_map_partial_failure():
+    ''' Results of successful calls are yielded before the error is raised. '''
+    transport = create_transport(max_workers=3, retries=1)
+    def func(value):
+        if value == 2:
+            raise IOError('failed')
+        return value * 10
+    results = []
+    with pytest.raises(IOError):
+        for key, result in transport.map(func, [(k, dict(value=k)) for k in range(5)]):
+            results.append((key, result))
+    assert sorted(results) == [(0, 0), (1, 10), (3, 30), (4, 40)]
+
+
+def test_get_session():
+    session = mock.Mock()
+    session.get.return_value.status_code = 200
+    factory = mock.Mock(return_value=session)
+    transport = create_transport(timeout=5, session_factory=factory)
+    transport.get('http://remote', params=dict(a=1))
+    transport.get('http://remote', timeout=1)
+    factory.assert_called_once_with()
+    assert session.get.call_args_list == [
+        mock.call('http://remote', params=dict(a=1), timeout=5),
+        mock.call('http://remote', timeout=1)]
+    # Only transient errors raise.
+    session.get.return_value.raise_for_status.assert_not_called()
+    for status in [400, 503]:
+        session.get.return_value.status_code = status
+        transport.get('http://remote')
+    session.get.return_value.raise_for_status.assert_called_once_with()
+
+
+def test_failed_bucket_retried_alone():
+    ''' A bucket failing after its retries doesn't discard the others: they
+    are cached, and the next query fetches only the failed bucket. '''
+    failing = set([4])
+    def remote_get(x_lower, x_upper, tag_values):
+        if x_lower in failing:
+            raise IOError('unavailable')
+        return query_df(SOURCE, And([Ge(X, x_lower), Le(X, x_upper), In(TAG, tag_values)]))
+    obj = mock.Mock()
+    obj.get.side_effect = remote_get
+    parameters = [
+        range_parameter('x', round_down=lambda x: x - (x % 2), offset=lambda x: x + 2),
+        tag_parameter('tag', key='tag')]
+    transport = create_transport(retries=2)
+    backend = minimal_cache_inmemory(ParameterWrapper(obj, parameters, transport=transport))
+    expression = And([Ge(X, 0), Lt(X, 8), In(TAG, ['a', 'b'])])
+    with pytest.raises(CacheFillError) as error:
+        backend.get(expression)
+    assert isinstance(error.value.cause, IOError)
+    assert error.value.missing == And([Gt(X, 4), Lt(X, 6), In(TAG, ('a', 'b'))])
+    assert obj.get.call_count == 3 + 3
+    assert len(backend.cache.keys()) == 3
+    failing.clear()
+    obj.get.reset_mock()
+    result = backend.get(expression)
+    obj.get.assert_called_once_with(x_lower=4, x_upper=6, tag_values={'a', 'b'})
+    assert len(result) == len(query_df(SOURCE, expression))
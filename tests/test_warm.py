@@ -0,0 +1,88 @@
+''' Tests of cache warming. '''
+
+import datetime
+import json
+
+import mock
+import pandas as pd
+import pytest
+
+from split_query.cache import minimal_cache_inmemory
+from split_query.core import And, Attribute, Ge, In, Le, Lt, default
+from split_query.decorators import ParameterWrapper, range_parameter, tag_parameter
+from split_query.engine import query_df
+from split_query.interface import DataSet
+from split_query.warm import main, parse_spec, warm
+
+X = Attribute('x')
+TAG = Attribute('tag')
+
+SOURCE = pd.DataFrame(dict(
+    x=[x for x in range(12) for _ in 'ab'],
+    tag=[tag for _ in range(12) for tag in 'ab']))
+
+REMOTE = mock.Mock()
+
+
+def create_dataset(failing=()):
+    def remote_get(x_lower, x_upper, tag_values):
+        if x_lower in failing:
+            raise IOError('unavailable')
+        return query_df(SOURCE, And([Ge(X, x_lower), Le(X, x_upper), In(TAG, tag_values)]))
+    REMOTE.reset_mock()
+    REMOTE.get.side_effect = remote_get
+    parameters = [
+        range_parameter('x', round_down=lambda x: x - (x % 4), offset=lambda x: x + 4),
+        tag_parameter('tag', key='tag', domain='ab', max_tags=1)]
+    backend = minimal_cache_inmemory(ParameterWrapper(REMOTE, parameters))
+    return DataSet('source', ['x', 'tag'], backend)
+
+
+def test_warm():
+    dataset = create_dataset()
+    dataset.backend.get(And([Ge(X, 0), Lt(X, 3), In(TAG, ['a'])]))
+    progress = mock.Mock()
+    # Without a tag filter, every tag in the domain is warmed.
+    report = warm(dataset, [And([Ge(X, 0), Lt(X, 8)])], workers=2, progress=progress)
+    assert report == dict(buckets=4, cached=1, fetched=3, failed=[], coverage=1.0)
+    assert progress.call_count == 3
+    assert [call[0][:2] for call in progress.call_args_list] == [(1, 3), (2, 3), (3, 3)]
+    assert REMOTE.get.call_count == 1 + 3
+    # Queries within the warmed buckets are answered from the cache.
+    REMOTE.get.reset_mock()
+    result = dataset.backend.get(And([Ge(X, 2), Lt(X, 6), In(TAG, ['a', 'b'])]))
+    REMOTE.get.assert_not_called()
+    assert len(result) == 8
+    assert warm(dataset, [And([Ge(X, 0), Lt(X, 8), In(TAG, ['a'])])])['fetched'] == 0
+
+
+def test_warm_failures():
+    ''' A failed bucket is reported without stopping the others. '''
+    dataset = create_dataset(failing=[4])
+    report = warm(dataset, [And([Ge(X, 0), Lt(X, 12), In(TAG, ['a'])])])
+    assert (report['buckets'], report['fetched']) == (3, 2)
+    assert report['coverage'] == pytest.approx(2.0 / 3)
+    (bucket, error), = report['failed']
+    assert isinstance(error.cause, IOError)
+
+
+def test_parse_spec():
+    now = datetime.datetime(2018, 3, 10)
+    where = json.loads(json.dumps(In(TAG, ['a']), default=default))
+    spec = dict(queries=[
+        dict(window=dict(attribute='x', days=2), where=where),
+        dict(expression=json.loads(json.dumps(Lt(X, 3), default=default)))])
+    assert parse_spec(spec, now=now) == [
+        And([Ge(X, datetime.datetime(2018, 3, 8)), Le(X, now), In(TAG, ['a'])]),
+        Lt(X, 3)]
+
+
+def test_main(tmpdir, capsys):
+    spec = tmpdir.join('spec.json')
+    spec.write(json.dumps(dict(
+        dataset='tests.test_warm:create_dataset', workers=2,
+        queries=[dict(expression=And([Ge(X, 0), Lt(X, 8)]))]),
+        default=default))
+    assert main([str(spec), '--quiet']) == 0
+    assert 'buckets: 4, already cached: 0, fetched: 4' in capsys.readouterr().out
+    assert REMOTE.get.call_count == 4